@@ -0,0 +1,319 @@
+"""アクセスの受け入れ制御（クライアントごとのレート制限とAI呼び出しの同時実行数の上限）
+
+少数の利用者が「Deepリサーチ」を一括で押すと、Gemini の利用枠とスレッドプールを使い切り、
+AIを使わない通常のCRUDまでタイムアウトする。これを防ぐため、
+
+- RateLimiter: クライアント（IPアドレス。認証プロキシの背後では X-User-Id）× エンドポイント種別ごとのトークンバケット。
+  超えたリクエストは 429 と Retry-After を返す
+- ConcurrencyGate: AI呼び出し全体の同時実行数の上限と、上限に達したときの優先度別の有限の待ち行列。
+  空いた実行枠は重み付きラウンドロビンで優先度の高い行列から順に渡す（低い行列も重みの割合で必ず進む）。
+  一括処理は1回のAI呼び出しごとに枠を取り直すので、その切れ目で対話的な呼び出しに順番を譲る。
+  行列が一杯か待ち時間が上限を超えたら Overloaded を送出し、呼び出し側が 503 と Retry-After を返す
+
+いずれもワーカープロセスごとに数える（複数ワーカーでは全体の上限がワーカー数倍になる）。
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+# X-Forwarded-For の先頭をクライアントのIPとみなすか（信頼できるプロキシの背後でだけ有効にする）
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() in ("1", "true", "yes")
+# X-User-Id を利用者の単位として信頼するか（利用者を認証してヘッダーを付け直すプロキシの背後でだけ有効にする）。
+# クライアントが自由に付けられる値で数えると、値を変えるだけで制限を回避できてしまう
+RATE_LIMIT_TRUST_USER_ID = os.getenv("RATE_LIMIT_TRUST_USER_ID", "false").lower() in ("1", "true", "yes")
+# バケットを保持するクライアント数の目安（超えたら満タンに戻ったバケットから捨てる）
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+
+ADMISSION_REJECTED = REGISTRY.counter(
+    "salon_admission_rejected_total",
+    "受け入れを拒否したリクエスト数（reason=rate_limit/queue_full/queue_timeout）",
+    ("endpoint_class", "reason"),
+)
+AI_CALLS_IN_FLIGHT = REGISTRY.gauge(
+    "salon_ai_calls_in_flight",
+    "実行中のAI呼び出し数",
+    ("priority",),
+)
+AI_CALLS_QUEUED = REGISTRY.gauge(
+    "salon_ai_calls_queued",
+    "実行待ちのAI呼び出し数",
+    ("priority",),
+)
+AI_QUEUE_WAIT = REGISTRY.histogram(
+    "salon_ai_queue_wait_seconds",
+    "AI呼び出しが実行枠を得るまでの待ち時間（待たずに実行した分も0秒として含む）",
+    ("priority",),
+)
+
+# 呼び出し元が指定したAI呼び出しの優先度（一括処理の中の呼び出しを batch に下げるのに使う）
+_priority_override: ContextVar[Optional[str]] = ContextVar("ai_priority", default=None)
+
+
+@contextmanager
+def ai_priority(priority: str) -> Iterator[None]:
+    """このブロック内（とそこから起動したタスク）のAI呼び出しの優先度を指定する"""
+    token = _priority_override.set(priority)
+    try:
+        yield
+    finally:
+        _priority_override.reset(token)
+
+
+def current_priority(default: str) -> str:
+    return _priority_override.get() or default
+
+
+class Overloaded(Exception):
+    """AI呼び出しの待ち行列が一杯、または待ち時間の上限を超えた"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def retry_after_header(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+def client_key(headers: List[Tuple[bytes, bytes]], client: Optional[Tuple[str, int]]) -> str:
+    """レート制限の単位（IPアドレス。RATE_LIMIT_TRUST_USER_ID なら利用者IDを優先する）"""
+    forwarded = None
+    for name, value in headers:
+        name = name.lower()
+        if name == b"x-user-id" and RATE_LIMIT_TRUST_USER_ID and value.strip():
+            return "user:" + value.decode("latin-1").strip()
+        if name == b"x-forwarded-for":
+            forwarded = value
+    if RATE_LIMIT_TRUST_FORWARDED and forwarded:
+        return "ip:" + forwarded.decode("latin-1").split(",")[0].strip()
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class RateLimiter:
+    """クライアントごとのトークンバケット（rate_per_minute が0以下なら制限しない）"""
+
+    def __init__(self, rate_per_minute: float, burst: float, max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate_per_minute / 60
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        # クライアント -> [残りトークン, 最後に補充した時刻]
+        self._buckets: Dict[str, List[float]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, key: str, now: Optional[float] = None) -> Optional[float]:
+        """1トークン消費できれば None、できなければ次に使えるまでの秒数を返す"""
+        if not self.enabled:
+            return None
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._prune(now)
+            bucket = self._buckets[key] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return None
+        bucket[0] = tokens
+        return (1 - tokens) / self.rate
+
+    def _prune(self, now: float) -> None:
+        full = [
+            key for key, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * self.rate >= self.burst
+        ]
+        for key in full:
+            del self._buckets[key]
+
+
+@dataclass
+class PriorityClass:
+    """待ち行列の優先度ごとの設定"""
+
+    # 空いた実行枠を渡す割合の重み
+    weight: int
+    queue_size: int
+    # 行列で待てる秒数
+    timeout: float
+    # この優先度が同時に使える実行枠の上限（None なら全体の上限まで）
+    max_active: Optional[int] = None
+
+
+class ConcurrencyGate:
+    """同時実行数の上限と、優先度ごとに到着順の有限の待ち行列"""
+
+    def __init__(self, limit: int, classes: Dict[str, PriorityClass]):
+        self.limit = max(1, limit)
+        self.classes = classes
+        self._active = 0
+        self._active_by_class: Dict[str, int] = {name: 0 for name in classes}
+        self._waiters: Dict[str, Deque["asyncio.Future[None]"]] = {name: deque() for name in classes}
+        # 重み付きラウンドロビンの累積値
+        self._credit: Dict[str, int] = {name: 0 for name in classes}
+        # 1回の所要時間の移動平均（Retry-After の見積もりに使う）
+        self._average_seconds = 10.0
+        for name in classes:
+            self._update_gauges(name)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def retry_after(self, priority: str) -> float:
+        """今から並んだ場合に順番が来るまでのおおよその秒数"""
+        return self._average_seconds * (len(self._waiters[priority]) + 1) / self.limit
+
+    def expected_wait(self, priority: str) -> float:
+        """今から呼び出した場合の待ち時間の見積もり（すぐ実行できるなら0）"""
+        if not self._waiters[priority] and self._has_room(priority):
+            return 0.0
+        return self.retry_after(priority)
+
+    def _update_gauges(self, priority: str) -> None:
+        AI_CALLS_IN_FLIGHT.set(self._active_by_class[priority], priority)
+        AI_CALLS_QUEUED.set(len(self._waiters[priority]), priority)
+
+    def _has_room(self, priority: str) -> bool:
+        max_active = self.classes[priority].max_active
+        return self._active < self.limit and (
+            max_active is None or self._active_by_class[priority] < max_active
+        )
+
+    def _grant(self, priority: str) -> None:
+        self._active += 1
+        self._active_by_class[priority] += 1
+
+    def _next_class(self) -> Optional[str]:
+        """待ち手がいて枠の空いている優先度のうち、次に実行枠を渡すもの（smooth weighted round-robin）"""
+        eligible = [name for name, waiters in self._waiters.items() if waiters and self._has_room(name)]
+        if not eligible:
+            return None
+        total = 0
+        chosen = eligible[0]
+        for name in eligible:
+            self._credit[name] += self.classes[name].weight
+            total += self.classes[name].weight
+            if self._credit[name] > self._credit[chosen]:
+                chosen = name
+        self._credit[chosen] -= total
+        return chosen
+
+    def _dispatch(self) -> None:
+        while True:
+            priority = self._next_class()
+            if priority is None:
+                return
+            waiter = self._waiters[priority].popleft()
+            # 実行枠は待ち手に直接引き継ぐ
+            self._grant(priority)
+            waiter.set_result(None)
+            self._update_gauges(priority)
+
+    async def _acquire(self, priority: str) -> None:
+        settings = self.classes[priority]
+        waiters = self._waiters[priority]
+        if not waiters and self._has_room(priority):
+            self._grant(priority)
+            self._update_gauges(priority)
+            AI_QUEUE_WAIT.observe(0.0, priority)
+            return
+        if len(waiters) >= settings.queue_size:
+            raise Overloaded("queue_full", self.retry_after(priority))
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        self._update_gauges(priority)
+        start = time.monotonic()
+        try:
+            done, _pending = await asyncio.wait((waiter,), timeout=settings.timeout)
+        except asyncio.CancelledError:
+            self._abandon(priority, waiter)
+            raise
+        finally:
+            AI_QUEUE_WAIT.observe(time.monotonic() - start, priority)
+        if not done:
+            self._abandon(priority, waiter)
+            raise Overloaded("queue_timeout", self.retry_after(priority))
+
+    def _abandon(self, priority: str, waiter: "asyncio.Future[None]") -> None:
+        if waiter.done() and not waiter.cancelled():
+            # 順番を譲られた直後に諦めた場合は、次の待ち手に回す
+            self._release(priority)
+            return
+        waiter.cancel()
+        try:
+            self._waiters[priority].remove(waiter)
+        except ValueError:
+            pass
+        self._update_gauges(priority)
+
+    def _release(self, priority: str) -> None:
+        self._active -= 1
+        self._active_by_class[priority] -= 1
+        self._update_gauges(priority)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: str) -> AsyncIterator[None]:
+        await self._acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._average_seconds += (time.monotonic() - start - self._average_seconds) * 0.2
+            self._release(priority)
+
+
+class RateLimitMiddleware:
+    """読み取り（GET/HEAD）と書き込み（それ以外）のリクエストをクライアントごとに制限するASGIミドルウェア
+
+    本文を読む前に判定するため、超過したリクエストはほとんどコストをかけずに 429 を返す。
+    """
+
+    def __init__(self, app, read: RateLimiter, write: RateLimiter, exempt_paths: Tuple[str, ...] = ()):
+        self.app = app
+        self.read = read
+        self.write = write
+        self.exempt_paths = exempt_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        endpoint_class = "read" if scope["method"] in ("GET", "HEAD") else "write"
+        limiter = self.read if endpoint_class == "read" else self.write
+        retry_after = None
+        if limiter.enabled:
+            retry_after = limiter.check(client_key(scope.get("headers") or [], scope.get("client")))
+        if retry_after is None:
+            await self.app(scope, receive, send)
+            return
+        ADMISSION_REJECTED.inc(endpoint_class, "rate_limit")
+        body = '{"detail":"リクエストが多すぎます。しばらくしてから再度お試しください"}'.encode("utf-8")
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+        ]
+        headers += [
+            (key.lower().encode("ascii"), value.encode("ascii"))
+            for key, value in retry_after_header(retry_after).items()
+        ]
+        await send({"type": "http.response.start", "status": 429, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,144 @@
+"""イベント単位のアーカイブ（NDJSON）の読み書き
+
+1行に1レコード {"type": 種別, "data": レコード} を書き、先頭に header 行、末尾に件数入りの end 行を置く。
+end 行がなければ途中で切れたアーカイブとして扱う。
+書き出しは行単位で生成し、アーカイブ全体をメモリに載せない。
+読み込みも受信したそばから行単位で解析・検証するが、取り込み側（main._ArchiveImport）は
+途中までの状態を他のリクエストに見せないよう、検証済みのレコード（埋め込み画像を含む）を end 行まで溜めてから
+一度にストアへ反映する。そのため取り込み中は、取り込み後にストアが持つのと同程度のメモリを余分に使う。
+zstd 圧縮は zstandard パッケージがある場合だけ使える。
+"""
+
+import os
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+
+from serialization import dumps
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 依存が無い環境向け
+    zstandard = None
+
+ARCHIVE_FORMAT = "salon-event-archive"
+ARCHIVE_VERSION = 1
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ZSTD_MEDIA_TYPE = "application/zstd"
+# 画像を埋め込む場合も1行に収まる大きさ（これを超える行は壊れたアーカイブとみなす）
+ARCHIVE_MAX_LINE_BYTES = int(os.getenv("ARCHIVE_MAX_LINE_BYTES", str(32 * 1024 * 1024)))
+# 送信はこの程度まとめてから行う（1行ごとの送信は小さいレコードが多いと遅い）
+_FLUSH_BYTES = 64 * 1024
+
+
+class ArchiveError(ValueError):
+    """アーカイブの形式が不正"""
+
+
+def zstd_available() -> bool:
+    return zstandard is not None
+
+
+def archive_line(kind: str, data: Any) -> bytes:
+    return dumps({"type": kind, "data": data}) + b"\n"
+
+
+def header_line(event_id: str, images: str, exported_at: str) -> bytes:
+    return archive_line(
+        "header",
+        {
+            "format": ARCHIVE_FORMAT,
+            "version": ARCHIVE_VERSION,
+            "event_id": event_id,
+            "images": images,
+            "exported_at": exported_at,
+        },
+    )
+
+
+def check_header(entry: Dict[str, Any]) -> Dict[str, Any]:
+    data = entry.get("data") or {}
+    if entry.get("type") != "header" or data.get("format") != ARCHIVE_FORMAT:
+        raise ArchiveError("イベントのアーカイブではありません（先頭に header 行がありません）")
+    if data.get("version") != ARCHIVE_VERSION:
+        raise ArchiveError(f"未対応のアーカイブのバージョンです: {data.get('version')}")
+    return data
+
+
+async def encode_stream(lines: Iterable[bytes], compression: Optional[str] = None) -> AsyncIterator[bytes]:
+    """行をまとめて（必要なら zstd で圧縮して）送信用のチャンクにする"""
+    compressor = zstandard.ZstdCompressor().compressobj() if compression == "zstd" else None
+    buffer: List[bytes] = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= _FLUSH_BYTES:
+            chunk = b"".join(buffer)
+            buffer, size = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+    chunk = b"".join(buffer)
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+class ArchiveReader:
+    """受信したバイト列を (行番号, JSON) に分ける（zstd の場合は先に展開する）"""
+
+    def __init__(self, compression: Optional[str] = None, max_line_bytes: int = ARCHIVE_MAX_LINE_BYTES):
+        self.max_line_bytes = max_line_bytes
+        self._decompressor = (
+            zstandard.ZstdDecompressor().decompressobj() if compression == "zstd" else None
+        )
+        # 改行が届くまでの行の断片（大きな画像の行を受信のたびに連結し直さないよう、リストで持つ）
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self.line_number = 0
+
+    def _parse(self, line: bytes) -> Optional[Tuple[int, Dict[str, Any]]]:
+        self.line_number += 1
+        if not line.strip():
+            return None
+        try:
+            entry = orjson.loads(line)
+        except orjson.JSONDecodeError as exc:
+            raise ArchiveError(f"{self.line_number}行目: JSONとして読めません ({exc})")
+        if not isinstance(entry, dict) or not isinstance(entry.get("type"), str):
+            raise ArchiveError(f"{self.line_number}行目: type がありません")
+        return self.line_number, entry
+
+    def feed(self, chunk: bytes) -> List[Tuple[int, Dict[str, Any]]]:
+        if not chunk:
+            return []
+        if self._decompressor is not None:
+            try:
+                chunk = self._decompressor.decompress(chunk)
+            except zstandard.ZstdError as exc:
+                raise ArchiveError(f"zstd の展開に失敗しました: {exc}")
+        if b"\n" not in chunk:
+            self._pending.append(chunk)
+            self._pending_size += len(chunk)
+            if self._pending_size > self.max_line_bytes:
+                raise ArchiveError(f"{self.line_number + 1}行目が長すぎます")
+            return []
+        lines = (b"".join(self._pending) + chunk).split(b"\n")
+        rest = lines.pop()
+        # 改行を含むチャンクでも、完結した行と次の行の書きかけの両方が上限に収まっているか確かめる
+        for index, line in enumerate(lines):
+            if len(line) > self.max_line_bytes:
+                raise ArchiveError(f"{self.line_number + index + 1}行目が長すぎます")
+        if len(rest) > self.max_line_bytes:
+            raise ArchiveError(f"{self.line_number + len(lines) + 1}行目が長すぎます")
+        self._pending, self._pending_size = ([rest], len(rest)) if rest else ([], 0)
+        return [entry for entry in map(self._parse, lines) if entry is not None]
+
+    def close(self) -> List[Tuple[int, Dict[str, Any]]]:
+        entry = self._parse(b"".join(self._pending)) if self._pending else None
+        self._pending, self._pending_size = [], 0
+        return [entry] if entry is not None else []
@@ -0,0 +1,154 @@
+"""永続化（スナップショット＋追記ログ）の再起動時間のベンチマーク
+
+使い方:
+    python bench_persistence.py             # 100万件で計測
+    python bench_persistence.py 200000      # 件数を指定
+    python bench_persistence.py 1000000 /data/bench   # 書き出し先を指定（既定は一時ディレクトリ）
+
+訪問ノート8割・キーワードメモ2割のレコードを作り、次を計測する。
+    - スナップショットの書き出し時間とファイルサイズ
+    - スナップショットからの復元時間（= 停止時にスナップショットを取った場合の再起動時間）
+    - 追記ログの fsync モード別の書き込み速度と、ログの再生時間（= 異常終了後の再起動時間）
+ストアには購読者を付けずに計測するため、実際の起動では検索インデックス等の再構築の時間がこれに加わる。
+"""
+
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Tuple
+
+from main import KeywordNote, VisitNote
+from persistence import StorePersistence
+from stores import RecordStore
+
+# fsync モード別の書き込み速度を測る件数（always は1件ごとに fsync するので少なめ）
+LOG_WRITES = {"never": 100_000, "batch": 100_000, "always": 2_000}
+# ログの再生時間を測る件数
+REPLAY_WRITES = 200_000
+
+
+def new_stores() -> Dict[str, Tuple[RecordStore, type]]:
+    return {
+        "visit_notes": (RecordStore("visit_notes"), VisitNote),
+        "keyword_notes": (RecordStore("keyword_notes"), KeywordNote),
+    }
+
+
+def make_record(rng: random.Random, number: int, now: datetime):
+    created = now - timedelta(seconds=number)
+    event_id = f"event-{number % 20}"
+    if number % 5:
+        key = f"note-{number}"
+        return "visit_notes", key, VisitNote(
+            visit_note_id=key,
+            event_id=event_id,
+            target_company_id=f"target-{number % 3000}",
+            title=f"ブース訪問メモ {number}",
+            content="担当者と製品デモについて話した。" * rng.randint(2, 8),
+            keywords=[f"キーワード{rng.randint(0, 500)}" for _ in range(3)],
+            created_at=created,
+            updated_at=created,
+        )
+    key = f"keyword-{number}"
+    return "keyword_notes", key, KeywordNote(
+        keyword_note_id=key,
+        event_id=event_id,
+        keyword=f"キーワード{rng.randint(0, 500)}",
+        context="展示で聞いた用語",
+        created_at=created,
+        updated_at=created,
+    )
+
+
+def populate(stores: Dict[str, Tuple[RecordStore, type]], count: int) -> None:
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    for number in range(count):
+        name, key, record = make_record(rng, number, now)
+        stores[name][0][key] = record
+
+
+def directory_size(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def restore(directory: str) -> Tuple[int, float]:
+    stores = new_stores()
+    persistence = StorePersistence(directory, stores)
+    start = time.perf_counter()
+    persistence.load()
+    elapsed = time.perf_counter() - start
+    persistence._file.close()
+    return sum(len(store) for store, _model in stores.values()), elapsed
+
+
+async def bench_snapshot(directory: str, count: int) -> None:
+    stores = new_stores()
+    populate(stores, count)
+    persistence = StorePersistence(directory, stores)
+    persistence.load()
+    start = time.perf_counter()
+    await persistence.snapshot()
+    written = time.perf_counter() - start
+    await persistence.close(snapshot=False)
+    size = directory_size(directory)
+    print(f"  snapshot write      {written:6.2f} s  ({size / 1024 / 1024:,.0f} MiB)")
+    restored, elapsed = restore(directory)
+    assert restored == count
+    print(f"  restart (snapshot)  {elapsed:6.2f} s  ({restored / elapsed:,.0f} records/s)")
+
+
+async def bench_log(directory: str) -> None:
+    rng = random.Random(3)
+    now = datetime.utcnow()
+    for mode, writes in LOG_WRITES.items():
+        shutil.rmtree(directory, ignore_errors=True)
+        stores = new_stores()
+        persistence = StorePersistence(directory, stores, fsync=mode)
+        persistence.load()
+        flusher = asyncio.create_task(persistence.run())
+        start = time.perf_counter()
+        for number in range(writes):
+            name, key, record = make_record(rng, number, now)
+            stores[name][0][key] = record
+            if number % 1000 == 0:
+                # 実際のサーバーと同じく、定期的にイベントループへ制御を返して fsync を走らせる
+                await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+        flusher.cancel()
+        await persistence.close(snapshot=False)
+        print(f"  log write fsync={mode:<6} {writes / elapsed:10,.0f} writes/s")
+
+    shutil.rmtree(directory, ignore_errors=True)
+    stores = new_stores()
+    persistence = StorePersistence(directory, stores, fsync="never")
+    persistence.load()
+    for number in range(REPLAY_WRITES):
+        name, key, record = make_record(rng, number, now)
+        stores[name][0][key] = record
+    await persistence.close(snapshot=False)
+    restored, elapsed = restore(directory)
+    assert restored == REPLAY_WRITES
+    print(f"  restart (log only)  {elapsed:6.2f} s  ({REPLAY_WRITES / elapsed:,.0f} log entries/s)")
+
+
+def run() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    base = sys.argv[2] if len(sys.argv) > 2 else tempfile.mkdtemp(prefix="bench-persistence-")
+    directory = os.path.join(base, "stores")
+    shutil.rmtree(directory, ignore_errors=True)
+    print(f"{count:,} records in {directory}")
+    try:
+        asyncio.run(bench_snapshot(directory, count))
+        asyncio.run(bench_log(directory))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    run()
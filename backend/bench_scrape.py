@@ -0,0 +1,97 @@
+"""スクレイピング解析のベンチマーク
+
+使い方:
+    python bench_scrape.py                     # 合成した出展者一覧ページ（約5MB）で計測
+    python bench_scrape.py page1.html page2.html  # 保存した実際の出展者一覧ページで計測
+
+旧実装（BeautifulSoup(html.parser) を全セレクタで全走査）と
+scraping.extract_items の各パーサーを同じ条件で比較する。
+"""
+
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+from bs4 import BeautifulSoup
+
+from scraping import PARSER_BACKENDS, extract_items, resolve_parser
+
+SELECTORS = ["a.exhibitor", "li", "a"]
+LIMIT = 50
+REPEAT = 5
+
+
+def legacy_extract(html: str, selectors: List[str], limit: int) -> List[Dict[str, Any]]:
+    """変更前の scrape_event と同じ処理"""
+    soup = BeautifulSoup(html, "html.parser")
+    items: List[Dict[str, Any]] = []
+    seen_texts = set()
+    for selector in selectors:
+        for element in soup.select(selector):
+            text = element.get_text(strip=True)
+            if not text:
+                continue
+            key = (selector, text)
+            if key in seen_texts:
+                continue
+            seen_texts.add(key)
+            entry: Dict[str, Any] = {"text": text, "selector": selector}
+            href = element.get("href")
+            if href:
+                entry["href"] = href
+            items.append(entry)
+            if len(items) >= limit:
+                break
+        if len(items) >= limit:
+            break
+    return items
+
+
+def synthetic_page(exhibitors: int = 20000) -> str:
+    rows = []
+    for i in range(exhibitors):
+        rows.append(
+            f'<li class="item"><div class="card"><span class="booth">{chr(65 + i % 8)}-{i:05d}</span>'
+            f'<a class="exhibitor" href="/exhibitors/{i}">株式会社サンプル{i}</a>'
+            f'<p class="desc">画像検査・FA機器・産業用ロボットの展示 {i}</p></div></li>'
+        )
+    return (
+        "<html><head><title>出展者一覧</title></head><body><nav><a href='/'>TOP</a></nav><ul>"
+        + "".join(rows)
+        + "</ul></body></html>"
+    )
+
+
+def measure(label: str, func, html: str) -> None:
+    timings = []
+    count = 0
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        count = len(func(html))
+        timings.append(time.perf_counter() - start)
+    print(
+        f"  {label:<22} median {statistics.median(timings) * 1000:8.1f} ms"
+        f"  min {min(timings) * 1000:8.1f} ms  items={count}"
+    )
+
+
+def main() -> None:
+    pages = []
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, encoding="utf-8", errors="replace") as fp:
+                pages.append((path, fp.read()))
+    else:
+        pages.append(("synthetic", synthetic_page()))
+
+    backends = [name for name in PARSER_BACKENDS if resolve_parser(name) == name]
+    for name, html in pages:
+        print(f"{name}: {len(html.encode('utf-8')) / 1024 / 1024:.1f} MB, selectors={SELECTORS}, limit={LIMIT}")
+        measure("legacy (bs4 select)", lambda h: legacy_extract(h, SELECTORS, LIMIT), html)
+        for backend in backends:
+            measure(backend, lambda h, b=backend: extract_items(h, SELECTORS, LIMIT, True, b), html)
+
+
+if __name__ == "__main__":
+    main()
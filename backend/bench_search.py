@@ -0,0 +1,94 @@
+"""全文検索のベンチマーク
+
+使い方:
+    python bench_search.py            # 合成した50万件のノート・キーワード・資料テキストで計測
+    python bench_search.py 100000     # 件数を指定
+
+search.SearchIndex に文書を登録し、代表的なクエリ（絞り込み・ページ送りを含む）の
+レイテンシ（中央値 / p95 / 最大）を表示する。目標は50万件で1クエリ20ms未満。
+"""
+
+import random
+import statistics
+import sys
+import time
+
+from search import SearchIndex
+
+REPEAT = 20
+
+_TOPICS = [
+    "画像検査", "外観検査", "協働ロボット", "搬送装置", "AGV", "AMR", "PLC", "IoTゲートウェイ",
+    "予知保全", "振動センサー", "温度管理", "トレーサビリティ", "生産管理システム", "MES",
+    "クラウド連携", "エッジAI", "深層学習", "異常検知", "品質管理", "省人化", "自動倉庫",
+    "ピッキング", "溶接ロボット", "塗装ライン", "射出成形", "金型", "3Dプリンター", "CAD",
+    "デジタルツイン", "シミュレーション", "画像処理ライブラリ", "カメラモジュール", "照明",
+    "レーザー加工", "切削工具", "工作機械", "センサフュージョン", "無線LAN", "5G", "セキュリティ",
+]
+_PHRASES = [
+    "のデモを見た", "について質問した", "の導入事例を聞いた", "の価格感は要確認",
+    "は既存ラインに後付け可能", "の精度が高い", "の納期は三か月", "に興味あり",
+    "を来月までに比較検討", "は競合より安い", "のサポート体制が手厚い", "はPoCから始められる",
+    "の資料をもらった", "は海外拠点でも実績あり", "の担当者と名刺交換", "のライセンス体系が複雑",
+]
+_COMPANIES = ["サンプル", "テクノ", "精機", "電機", "システムズ", "ロボティクス", "工業", "製作所"]
+
+
+def synthetic_document(rng: random.Random, number: int) -> str:
+    sentences = []
+    for _ in range(rng.randint(2, 4)):
+        sentences.append(rng.choice(_TOPICS) + rng.choice(_PHRASES))
+    company = f"株式会社{rng.choice(_COMPANIES)}{rng.choice(_COMPANIES)}{number % 5000}"
+    return f"{company}。" + "。".join(sentences)
+
+
+def build(count: int) -> SearchIndex:
+    rng = random.Random(42)
+    index = SearchIndex(filter_fields=("event_id", "target_company_id", "doc_type"))
+    doc_types = ["visit_note", "keyword_note", "material"]
+    start = time.perf_counter()
+    for number in range(count):
+        index.add(
+            f"doc:{number}",
+            synthetic_document(rng, number),
+            {
+                "event_id": f"event-{number % 50}",
+                "target_company_id": f"target-{number % 20000}",
+                "doc_type": doc_types[number % 3],
+            },
+        )
+    elapsed = time.perf_counter() - start
+    print(f"indexed {count} documents in {elapsed:.1f} s ({count / elapsed:,.0f} docs/s)")
+    return index
+
+
+def measure(index: SearchIndex, label: str, query: str, **kwargs) -> None:
+    timings = []
+    page = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        page = index.search(query, **kwargs)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(
+        f"  {label:<34} median {statistics.median(timings) * 1000:7.2f} ms"
+        f"  p95 {p95 * 1000:7.2f} ms  max {timings[-1] * 1000:7.2f} ms  total={page.total}"
+    )
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    index = build(count)
+    measure(index, "画像検査", "画像検査")
+    measure(index, "画像検査 (event filter)", "画像検査", filters={"event_id": "event-7"})
+    measure(index, "画像検査 デモ (2 terms)", "画像検査 デモ")
+    measure(index, "協働ロボット 価格 (page 5)", "協働ロボット 価格", offset=80, limit=20)
+    measure(index, "plc (ascii word)", "plc")
+    measure(index, "検 (single char)", "検")
+    measure(index, "精機123 (rare)", "精機123")
+    measure(index, "存在しない語", "存在しない語")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""一覧レスポンスのJSON化のベンチマーク
+
+使い方:
+    python bench_serialization.py          # 500社のターゲット企業一覧で計測
+    python bench_serialization.py 2000     # 件数を指定
+
+長い ai_research と scraped_context を持つターゲット企業を登録し、
+response_model による検証＋JSON化（従来の経路）と、JSON断片キャッシュの連結（GET /target-companies）の
+1リクエストあたりのCPU時間を比べる。
+"""
+
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import List
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+import main
+from bench_search import synthetic_document
+
+REPEAT = 30
+
+
+def populate(count: int) -> str:
+    rng = random.Random(11)
+    now = datetime.utcnow()
+    event = main.Event(
+        event_id="bench-event", name="ベンチマーク展", start_date="2026-01-01", end_date="2026-01-03",
+        created_at=now, updated_at=now,
+    )
+    main.events_store[event.event_id] = event
+    for number in range(count):
+        report = "\n".join(synthetic_document(rng, number) for _ in range(12))
+        target = main.TargetCompany(
+            target_company_id=f"target-{number}",
+            event_id=event.event_id,
+            name=f"サンプル{number}株式会社",
+            website_url=f"https://example.com/{number}",
+            ai_research=report,
+            research_summary=report[:200],
+            scraped_context={
+                "fingerprint": f"fp-{number}",
+                "items": [{"text": synthetic_document(rng, number)[:120], "href": f"/b/{i}"} for i in range(8)],
+            },
+            created_at=now,
+            updated_at=now,
+        )
+        main.target_companies_store[target.target_company_id] = target
+    return event.event_id
+
+
+def legacy_app() -> FastAPI:
+    """変更前と同じく、モデルの一覧を response_model で返すだけのアプリ"""
+    app = FastAPI(default_response_class=JSONResponse)
+
+    @app.get("/target-companies", response_model=List[main.TargetCompany])
+    async def list_target_companies(event_id: str):
+        return [
+            target for target in main.target_companies_store.values() if target.event_id == event_id
+        ]
+
+    return app
+
+
+def measure(label: str, client: TestClient, path: str) -> float:
+    client.get(path)  # 初回（断片の作成）は除いて計測する
+    cpu = []
+    wall = []
+    for _ in range(REPEAT):
+        start_cpu, start_wall = time.process_time(), time.perf_counter()
+        response = client.get(path)
+        cpu.append(time.process_time() - start_cpu)
+        wall.append(time.perf_counter() - start_wall)
+    assert response.status_code == 200
+    median_cpu = statistics.median(cpu) * 1000
+    print(
+        f"  {label:<34} cpu {median_cpu:7.2f} ms  wall {statistics.median(wall) * 1000:7.2f} ms"
+        f"  ({len(response.content) / 1024:,.0f} KiB)"
+    )
+    return median_cpu
+
+
+def run() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    event_id = populate(count)
+    path = f"/target-companies?event_id={event_id}"
+    print(f"{count} target companies")
+    legacy = measure("response_model + JSONResponse", TestClient(legacy_app()), path)
+    cached = measure("cached fragments", TestClient(main.app), path)
+    print(f"  CPU per request reduced by {(1 - cached / legacy) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,77 @@
+"""類似検索のベンチマーク
+
+使い方:
+    python bench_similarity.py           # 合成した10万件のノートで計測
+    python bench_similarity.py 300000    # 件数を指定
+
+similarity.vectorize でベクトル化して VectorIndex に登録し、
+1件ずつの top-k と、複数件をまとめた top_k_many のレイテンシを表示する。
+"""
+
+import random
+import statistics
+import sys
+import time
+
+from bench_search import synthetic_document
+from similarity import SIMILARITY_DIM, VectorIndex, vectorize
+
+REPEAT = 20
+K = 10
+BATCH = 64
+
+
+def build(count: int):
+    rng = random.Random(7)
+    index = VectorIndex(filter_fields=("event_id",))
+    start = time.perf_counter()
+    for number in range(count):
+        index.add(
+            f"doc:{number}",
+            vectorize(synthetic_document(rng, number)),
+            {"event_id": f"event-{number % 50}"},
+        )
+    elapsed = time.perf_counter() - start
+    print(
+        f"indexed {count} vectors (dim={SIMILARITY_DIM}) in {elapsed:.1f} s"
+        f" ({count / elapsed:,.0f} vectors/s)"
+    )
+    return index
+
+
+def measure(label: str, func) -> None:
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(
+        f"  {label:<36} median {statistics.median(timings) * 1000:7.2f} ms"
+        f"  p95 {p95 * 1000:7.2f} ms"
+    )
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    index = build(count)
+    query = index.vector("doc:0")
+    batch = [index.vector(f"doc:{number}") for number in range(BATCH)]
+    excludes = [f"doc:{number}" for number in range(BATCH)]
+
+    measure(f"top-{K} (1 query)", lambda: index.top_k(query, K, exclude="doc:0"))
+    measure(
+        f"top-{K} (1 query, event filter)",
+        lambda: index.top_k(query, K, filters={"event_id": "event-3"}, exclude="doc:0"),
+    )
+    measure(f"top-{K} x {BATCH} queries (batched)", lambda: index.top_k_many(batch, K, exclude=excludes))
+    measure(
+        f"top-{K} x {BATCH} queries (one by one)",
+        lambda: [index.top_k(vector, K, exclude=key) for vector, key in zip(batch, excludes)],
+    )
+    measure("vectorize (1 note)", lambda: vectorize(synthetic_document(random.Random(1), 1)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""ワーカー数ごとのスループットのベンチマーク
+
+使い方:
+    python bench_workers.py              # 1〜CPUコア数のワーカーで計測
+    python bench_workers.py 1 2 4 8      # ワーカー数を指定
+    BENCH_SECONDS=30 BENCH_CLIENTS=4 python bench_workers.py
+
+ワーカー数ごとに uvicorn を WEB_CONCURRENCY・PERSIST_DIR 付きで起動し、
+ターゲット企業200社と訪問ノート2,000件を登録してから、別プロセスの負荷クライアントで
+全文検索・ターゲット企業一覧・ノートの更新（5%）を混ぜたリクエストを送り続け、
+1秒あたりの処理件数とレイテンシを測る。更新は共有ログ経由で全ワーカーに反映されるため、その取り込みの負荷も含む。
+負荷クライアントも同じマシンのCPUを使うため、コア数に余裕のある環境で計測すること。
+"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+import httpx
+
+from bench_search import synthetic_document
+
+PORT = int(os.getenv("BENCH_PORT", "18080"))
+SECONDS = float(os.getenv("BENCH_SECONDS", "15"))
+# 負荷クライアントのプロセス数と、1プロセスあたりの同時リクエスト数
+CLIENTS = int(os.getenv("BENCH_CLIENTS", str(max(2, (os.cpu_count() or 2) // 2))))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "16"))
+WRITE_RATIO = 0.05
+TARGETS = 200
+NOTES = 2000
+QUERIES = ["画像検査", "外観検査", "自動化", "AI", "ロボット", "センサー", "予知保全", "物流"]
+BASE = f"http://127.0.0.1:{PORT}"
+
+
+def start_server(workers: int, directory: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(workers),
+        "PERSIST_DIR": directory,
+        "LOOP_MONITOR_ENABLED": "false",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(PORT), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{BASE}/events", timeout=1)
+            # 全ワーカーの起動を待つ
+            time.sleep(1 + workers * 0.5)
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    server.kill()
+    raise RuntimeError("サーバーが起動しませんでした")
+
+
+def populate() -> Tuple[str, List[str]]:
+    rng = random.Random(5)
+    with httpx.Client(base_url=BASE, timeout=60) as client:
+        event = client.post(
+            "/events", json={"name": "ベンチマーク展", "start_date": "2026-01-01", "end_date": "2026-01-03"}
+        ).json()
+        event_id = event["event_id"]
+        targets = []
+        for number in range(TARGETS):
+            target = client.post(
+                "/target-companies",
+                json={"event_id": event_id, "name": f"サンプル{number}株式会社", "priority": "medium"},
+            ).json()
+            targets.append(target["target_company_id"])
+        notes = []
+        for number in range(NOTES):
+            note = client.post(
+                f"/events/{event_id}/notes",
+                json={
+                    "event_id": event_id,
+                    "target_company_id": targets[number % TARGETS],
+                    "title": f"訪問メモ{number}",
+                    "content": synthetic_document(rng, number),
+                },
+            ).json()
+            notes.append(note["visit_note_id"])
+    return event_id, notes
+
+
+async def _client_loop(event_id: str, notes: List[str], seconds: float, seed: int) -> List[float]:
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    deadline = time.monotonic() + seconds
+    # 接続を使い回さず、カーネルが各ワーカーへ接続を振り分けるようにする
+    limits = httpx.Limits(max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=BASE, timeout=60, limits=limits) as client:
+
+        async def worker() -> None:
+            while time.monotonic() < deadline:
+                roll = rng.random()
+                start = time.perf_counter()
+                if roll < WRITE_RATIO:
+                    note_id = rng.choice(notes)
+                    response = await client.put(
+                        f"/visit-notes/{note_id}", json={"highlight": rng.random() < 0.5}
+                    )
+                elif roll < 0.55:
+                    response = await client.get(
+                        "/search", params={"q": rng.choice(QUERIES), "event_id": event_id}
+                    )
+                else:
+                    response = await client.get(
+                        "/target-companies", params={"event_id": event_id, "view": "compact"}
+                    )
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return latencies
+
+
+def _client_process(args: Tuple[str, List[str], float, int]) -> List[float]:
+    return asyncio.run(_client_loop(*args))
+
+
+def measure(workers: int) -> Tuple[float, float, float]:
+    directory = tempfile.mkdtemp(prefix="bench-workers-")
+    server = start_server(workers, directory)
+    try:
+        event_id, notes = populate()
+        with multiprocessing.Pool(CLIENTS) as pool:
+            results = pool.map(
+                _client_process, [(event_id, notes, SECONDS, seed) for seed in range(CLIENTS)]
+            )
+    finally:
+        server.terminate()
+        server.wait(60)
+        shutil.rmtree(directory, ignore_errors=True)
+    latencies = sorted(latency for result in results for latency in result)
+    throughput = len(latencies) / SECONDS
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    return throughput, p50, p95
+
+
+def run() -> None:
+    counts = [int(arg) for arg in sys.argv[1:]] or list(range(1, (os.cpu_count() or 1) + 1))
+    print(f"{CLIENTS} client processes x {CONCURRENCY} concurrent requests, {SECONDS:.0f}s per run")
+    baseline = None
+    for workers in counts:
+        throughput, p50, p95 = measure(workers)
+        baseline = baseline or throughput
+        print(
+            f"  workers={workers:<3} {throughput:8.1f} req/s  (x{throughput / baseline:.2f})"
+            f"  p50 {p50:7.1f} ms  p95 {p95:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,115 @@
+"""名刺の重複検出用インデックス
+
+メールアドレス・電話番号・氏名＋会社名を正規化したキーで名刺IDを引けるようにし、
+新しくスキャンした名刺が既に登録済みかを辞書引きだけで判定する。
+"""
+
+import re
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+
+from matching import normalize_company_name
+
+_NON_DIGITS = re.compile(r"\D+")
+_NAME_STRIP = re.compile(r"[\s・･.,、]+")
+# 市外局番＋番号として最低限の桁数（内線番号だけの断片などは照合に使わない）
+_MIN_PHONE_DIGITS = 9
+# 個人に固有とみなす項目。代表電話は同じ会社の別人と共有されるため、一致しても候補の提示に留める
+STRONG_MATCH_KINDS = ("email", "mobile", "name_company")
+
+
+def normalize_email(email: Optional[str]) -> str:
+    email = unicodedata.normalize("NFKC", email or "").strip().lower()
+    return email if "@" in email else ""
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """数字のみにし、国番号 +81 は国内表記（先頭0）に揃える"""
+    text = unicodedata.normalize("NFKC", phone or "")
+    # 「内線」「ext.」以降は代表番号の違いにすぎないため落とす
+    text = re.split(r"内線|ext\.?|x(?=\d)", text, maxsplit=1, flags=re.IGNORECASE)[0]
+    digits = _NON_DIGITS.sub("", text)
+    if text.strip().startswith("+81"):
+        digits = "0" + digits[2:].lstrip("0")
+    return digits if len(digits) >= _MIN_PHONE_DIGITS else ""
+
+
+def normalize_person_name(name: Optional[str]) -> str:
+    return _NAME_STRIP.sub("", unicodedata.normalize("NFKC", name or "").lower())
+
+
+def name_company_key(full_name: Optional[str], company_name: Optional[str]) -> str:
+    name = normalize_person_name(full_name)
+    company = normalize_company_name(company_name)
+    return f"{name}|{company}" if name and company else ""
+
+
+def card_keys(
+    email: Optional[str],
+    phone: Optional[str],
+    mobile: Optional[str],
+    full_name: Optional[str],
+    company_name: Optional[str],
+) -> List[Tuple[str, str]]:
+    """(種別, 正規化キー) の一覧。種別は email / mobile / phone / name_company"""
+    keys: List[Tuple[str, str]] = []
+    normalized_email = normalize_email(email)
+    if normalized_email:
+        keys.append(("email", normalized_email))
+    for kind, number in (("mobile", mobile), ("phone", phone)):
+        normalized_phone = normalize_phone(number)
+        if normalized_phone:
+            keys.append((kind, normalized_phone))
+    name_key = name_company_key(full_name, company_name)
+    if name_key:
+        keys.append(("name_company", name_key))
+    return keys
+
+
+def is_same_person(matched_on: List[str]) -> bool:
+    return any(kind in STRONG_MATCH_KINDS for kind in matched_on)
+
+
+class CardDuplicateIndex:
+    """(種別, 正規化キー) -> 名刺ID の辞書。電話番号は代表・携帯を区別せず突き合わせる"""
+
+    def __init__(self):
+        self._index: Dict[Tuple[str, str], Set[str]] = {}
+
+    @staticmethod
+    def _lookup_keys(kind: str, value: str) -> List[Tuple[str, str]]:
+        # 携帯番号を代表番号欄に書いた名刺とも一致させる
+        if kind in ("phone", "mobile"):
+            return [("phone", value), ("mobile", value)]
+        return [(kind, value)]
+
+    def add(self, card_id: str, keys: List[Tuple[str, str]]) -> None:
+        for key in keys:
+            self._index.setdefault(key, set()).add(card_id)
+
+    def remove(self, card_id: str, keys: List[Tuple[str, str]]) -> None:
+        for key in keys:
+            card_ids = self._index.get(key)
+            if card_ids is None:
+                continue
+            card_ids.discard(card_id)
+            if not card_ids:
+                del self._index[key]
+
+    def find(self, keys: List[Tuple[str, str]]) -> Dict[str, List[str]]:
+        """一致した名刺ID -> 一致した種別の一覧
+
+        電話番号は、両方が携帯番号として登録されている場合だけ mobile、それ以外は phone とする。
+        """
+        matches: Dict[str, List[str]] = {}
+        for kind, value in keys:
+            for stored_kind, stored_value in self._lookup_keys(kind, value):
+                if kind in ("phone", "mobile"):
+                    matched = "mobile" if kind == stored_kind == "mobile" else "phone"
+                else:
+                    matched = kind
+                for card_id in sorted(self._index.get((stored_kind, stored_value), ())):
+                    kinds = matches.setdefault(card_id, [])
+                    if matched not in kinds:
+                        kinds.append(matched)
+        return matches
@@ -0,0 +1,101 @@
+"""オフライン対応PWA向けの変更ログ
+
+ストアへの書き込みごとに単調増加のシーケンス番号を振り、
+端末は前回受け取った番号以降の差分（更新と削除の墓標）だけを取得する。
+番号にはストアのバージョンを使うため、再起動後や別のワーカープロセスでも同じ変更は同じ番号になる。
+
+ログは (ストア名, キー) ごとに最新の1件だけを残す形で常に圧縮されており、
+期限切れの墓標は compact() で取り除く。取り除いた範囲より前から同期しようとした端末には
+全件の再取得（reset）を指示する。
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Iterator, List, Optional, Tuple
+
+
+@dataclass
+class ChangeEntry:
+    seq: int
+    entity: str
+    key: str
+    deleted: bool
+    # 変更前後のイベントID（別イベントへ移動した記録は、移動元の同期にも含める）
+    event_ids: Tuple[str, ...]
+    recorded_at: float
+
+
+class ChangeLog:
+    def __init__(self, tombstone_ttl: float):
+        self.tombstone_ttl = tombstone_ttl
+        self._seq = 0
+        # これより小さい seq からの差分は墓標を失っている可能性がある
+        self._horizon = 0
+        self._entries: "OrderedDict[Tuple[str, str], ChangeEntry]" = OrderedDict()
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    @property
+    def horizon(self) -> int:
+        return self._horizon
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def record(
+        self,
+        entity: str,
+        key: str,
+        deleted: bool,
+        event_ids: Tuple[str, ...] = (),
+        seq: Optional[int] = None,
+    ) -> ChangeEntry:
+        self._seq = max(self._seq, seq) if seq is not None else self._seq + 1
+        entry = ChangeEntry(self._seq, entity, key, deleted, event_ids, time.time())
+        self._entries.pop((entity, key), None)
+        self._entries[(entity, key)] = entry
+        return entry
+
+    def since(self, seq: int, event_id: Optional[str] = None) -> Iterator[ChangeEntry]:
+        """seq より後の変更を古い順に返す（event_id 指定時はそのイベントに関わるものだけ）"""
+        newer: List[ChangeEntry] = []
+        for entry in reversed(self._entries.values()):
+            if entry.seq <= seq:
+                break
+            if event_id is None or event_id in entry.event_ids:
+                newer.append(entry)
+        return reversed(newer)
+
+    def needs_reset(self, seq: int) -> bool:
+        return seq < self._horizon
+
+    def forget_before(self, seq: int) -> None:
+        """seq までの削除の墓標を持っていないことを記録する（スナップショットから復元したとき）"""
+        self._horizon = max(self._horizon, seq)
+        self._seq = max(self._seq, seq)
+
+    def compact(self, now: Optional[float] = None) -> int:
+        """期限切れの墓標を削除し、削除件数を返す"""
+        cutoff = (now if now is not None else time.time()) - self.tombstone_ttl
+        expired = [
+            key for key, entry in self._entries.items()
+            if entry.deleted and entry.recorded_at < cutoff
+        ]
+        for key in expired:
+            self._horizon = max(self._horizon, self._entries.pop(key).seq)
+        return len(expired)
+
+
+def record_event_ids(entity: str, key: str, *records: Any) -> Tuple[str, ...]:
+    """変更を絞り込むためのイベントID（イベント自身はそのID）"""
+    if entity == "events":
+        return (key,)
+    event_ids = []
+    for record in records:
+        event_id = getattr(record, "event_id", None)
+        if event_id and event_id not in event_ids:
+            event_ids.append(event_id)
+    return tuple(event_ids)
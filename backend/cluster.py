@@ -0,0 +1,156 @@
+"""複数ワーカープロセスでの協調
+
+uvicorn --workers（WEB_CONCURRENCY）で起動すると、各ワーカーが main を読み込んで同じバックグラウンド処理を始める。
+スナップショットのように1か所でだけ動かしたい処理は BackgroundJobs に登録し、
+ロックファイルの flock（LeaderLease）を取れたワーカーだけが実行する。
+所有者のワーカーが落ちるとOSがロックを解放し、残りのワーカーのどれかが次の確認で引き継ぐ。
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from metrics import REGISTRY
+
+# 所有者がいないときに引き継ぎを試す間隔
+JOB_LEASE_RETRY_SECONDS = float(os.getenv("JOB_LEASE_RETRY_SECONDS", "2"))
+
+JOB_OWNER = REGISTRY.gauge(
+    "salon_background_job_owner",
+    "このワーカーが定期ジョブの所有者なら1",
+)
+JOB_RUNS = REGISTRY.counter(
+    "salon_background_job_runs_total",
+    "定期ジョブの実行回数（result=ok/error）",
+    ("job", "result"),
+)
+
+
+class LeaderLease:
+    """ロックファイルの排他 flock を取れたプロセスだけが所有者になる"""
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise RuntimeError("ワーカー間のリースには flock が使えるOSが必要です")
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        file = open(self.path, "a+b")
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        file.truncate(0)
+        file.write(str(os.getpid()).encode("ascii"))
+        file.flush()
+        self._file = file
+        return True
+
+    def release(self) -> None:
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+@dataclass
+class _Job:
+    name: str
+    interval: float
+    func: Callable[[], Awaitable[None]]
+    # 間隔を待たずに実行する条件
+    due: Optional[Callable[[], bool]] = None
+    last_run: float = 0.0
+
+
+class BackgroundJobs:
+    """定期ジョブを所有者のワーカーだけで実行する（lease が None なら単一プロセスとして常に実行する）"""
+
+    def __init__(self, lease: Optional[LeaderLease] = None, tick: float = 1.0):
+        self.lease = lease
+        self.tick = tick
+        self._jobs: List[_Job] = []
+        self._next_attempt = 0.0
+
+    def add(
+        self,
+        name: str,
+        interval: float,
+        func: Callable[[], Awaitable[None]],
+        due: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self._jobs.append(_Job(name, interval, func, due))
+
+    @property
+    def is_owner(self) -> bool:
+        return self.lease is None or self.lease.held
+
+    def _acquire(self) -> bool:
+        if self.is_owner:
+            return True
+        now = time.monotonic()
+        if now < self._next_attempt:
+            return False
+        self._next_attempt = now + JOB_LEASE_RETRY_SECONDS
+        if self.lease.try_acquire():
+            print(f"Background jobs owned by worker {os.getpid()}")
+            # 引き継いだ直後は前の所有者の実行時刻が分からないため、間隔を数え直す
+            for job in self._jobs:
+                job.last_run = now
+            JOB_OWNER.set(1)
+            return True
+        return False
+
+    async def run(self) -> None:
+        """lifespan でタスクとして起動する"""
+        started = time.monotonic()
+        for job in self._jobs:
+            job.last_run = started
+        JOB_OWNER.set(1 if self._acquire() else 0)
+        while True:
+            await asyncio.sleep(self.tick)
+            if not self._acquire():
+                continue
+            for job in self._jobs:
+                if time.monotonic() - job.last_run < job.interval and not (job.due and job.due()):
+                    continue
+                try:
+                    await job.func()
+                    JOB_RUNS.inc(job.name, "ok")
+                except Exception as exc:
+                    JOB_RUNS.inc(job.name, "error")
+                    print(f"Background job {job.name} failed: {exc}")
+                job.last_run = time.monotonic()
+
+    def release(self) -> None:
+        if self.lease is not None:
+            self.lease.release()
+            JOB_OWNER.set(0)
+
+
+class CatchUpMiddleware:
+    """リクエストの処理前に、他のワーカーの書き込みをストアへ取り込む"""
+
+    def __init__(self, app, catch_up: Callable[[], int]):
+        self.app = app
+        self.catch_up = catch_up
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.catch_up()
+        await self.app(scope, receive, send)
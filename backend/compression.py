@@ -0,0 +1,211 @@
+"""レスポンス圧縮（Brotli / gzip）
+
+Accept-Encoding に応じて Brotli（brotli パッケージがある場合）か gzip でレスポンスを圧縮するASGIミドルウェア。
+小さい本文、画像などの圧縮済み形式、既に Content-Encoding が付いたレスポンスは圧縮しない。
+一括で返す大きな本文はスレッドで圧縮してイベントループを止めない。
+StreamingResponse はチャンクごとに圧縮してフラッシュするため、NDJSONなどの逐次送信もそのまま届く。
+"""
+
+import os
+import zlib
+from typing import List, Optional, Tuple
+
+import anyio
+
+from metrics import REGISTRY
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 依存が無い環境向け
+    brotli = None
+
+# これより小さい本文は圧縮しない（ヘッダーとCPUのコストの方が大きい）
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+# これ以上の本文はスレッドで圧縮する
+COMPRESS_THREAD_BYTES = int(os.getenv("COMPRESS_THREAD_BYTES", str(256 * 1024)))
+# 動的なレスポンス向けに速度寄りの設定（Brotli の既定11は遅すぎる）
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+)
+# 逐次届くこと自体に意味がある形式は、圧縮のバッファリングで遅れないようそのまま返す
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+
+COMPRESSION_BYTES = REGISTRY.counter(
+    "salon_http_compression_bytes_total",
+    "圧縮したレスポンスの本文サイズ（stage=original/compressed）",
+    ("encoding", "stage"),
+)
+COMPRESSION_SAVED_BYTES = REGISTRY.counter(
+    "salon_http_compression_saved_bytes_total",
+    "圧縮で削減した転送バイト数",
+    ("encoding",),
+)
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Accept-Encoding から使う圧縮形式を選ぶ（q値が同じなら br を優先）"""
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        weights[name] = quality
+    best = None
+    best_quality = 0.0
+    for encoding in supported_encodings():
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    if content_type.startswith(UNCOMPRESSED_TYPES):
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES) or "+json" in content_type or "+xml" in content_type
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            self._gzip = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        """data を圧縮する。finish=False でも受信側が展開できるところまでフラッシュする"""
+        if self.encoding == "br":
+            output = self._brotli.process(data)
+            return output + (self._brotli.finish() if finish else self._brotli.flush())
+        output = self._gzip.compress(data)
+        return output + self._gzip.flush(zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH)
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class CompressionMiddleware:
+    """Accept-Encoding に応じてレスポンス本文を圧縮するASGIミドルウェア"""
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES, thread_size: int = COMPRESS_THREAD_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_size = thread_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = _header(list(scope.get("headers") or []), b"accept-encoding")
+        encoding = negotiate_encoding(accept.decode("latin-1")) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def compress(data: bytes, finish: bool) -> bytes:
+            if len(data) >= self.thread_size:
+                return await anyio.to_thread.run_sync(compressor.compress, data, finish)
+            return compressor.compress(data, finish)
+
+        def record(original: int, compressed: int) -> None:
+            COMPRESSION_BYTES.inc(encoding, "original", amount=original)
+            COMPRESSION_BYTES.inc(encoding, "compressed", amount=compressed)
+            COMPRESSION_SAVED_BYTES.inc(encoding, amount=max(0, original - compressed))
+
+        def compressed_headers(content_length: Optional[int]) -> List[Tuple[bytes, bytes]]:
+            headers = [
+                (key, value)
+                for key, value in start_message.get("headers") or []
+                if key.lower() not in (b"content-length", b"vary", b"etag")
+            ]
+            original = start_message.get("headers") or []
+            vary = _header(original, b"vary")
+            headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+            etag = _header(original, b"etag")
+            if etag is not None:
+                # 圧縮後の表現はバイト列が異なるため弱いETagにする
+                headers.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+            headers.append((b"content-encoding", encoding.encode("ascii")))
+            if content_length is not None:
+                headers.append((b"content-length", str(content_length).encode("ascii")))
+            return headers
+
+        original_size = 0
+        compressed_size = 0
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough, original_size, compressed_size
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = message.get("headers") or []
+                content_type = (_header(headers, b"content-type") or b"").decode("latin-1")
+                if (
+                    _header(headers, b"content-encoding") is not None
+                    or message["status"] in (204, 206, 304)
+                    or not is_compressible(content_type)
+                ):
+                    passthrough = True
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body:
+                    # 一括のレスポンス：小さければそのまま返す
+                    if len(body) < self.minimum_size:
+                        passthrough = True
+                        await send(start_message)
+                        await send(message)
+                        return
+                    compressor = _Compressor(encoding)
+                    data = await compress(body, finish=True)
+                    record(len(body), len(data))
+                    await send({**start_message, "headers": compressed_headers(len(data))})
+                    await send({"type": "http.response.body", "body": data})
+                    return
+                # ストリーミング：長さが分からないので Content-Length を外してチャンクごとに送る
+                compressor = _Compressor(encoding)
+                await send({**start_message, "headers": compressed_headers(None)})
+            data = await compress(body, finish=not more_body)
+            original_size += len(body)
+            compressed_size += len(data)
+            if not more_body:
+                record(original_size, compressed_size)
+            if data or not more_body:
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
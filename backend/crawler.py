@@ -0,0 +1,341 @@
+"""展示会公式サイトの出展者一覧をサーバー側で取得する非同期クローラー
+
+接続はプール済みの httpx.AsyncClient を共有し、ホストごとの同時接続数を制限する。
+robots.txt を尊重し、ETag / Last-Modified による条件付きGETで
+再クロール時は変更のないページの転送と再取得を省く。
+
+取得先のURLは利用者が指定するため、ループバック・プライベート・リンクローカル（クラウドのメタデータ等）の
+アドレスには接続しない。名前解決の結果と実際の接続先の両方を確認し、リダイレクトは1段ずつ同じ確認をして辿る。
+"""
+
+import asyncio
+import ipaddress
+import os
+import socket
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urljoin, urlsplit
+from urllib.robotparser import RobotFileParser
+
+import httpx
+
+from metrics import REGISTRY
+from scraping import parse_scrape_page
+
+CRAWLER_USER_AGENT = os.getenv("CRAWLER_USER_AGENT", "salon-crawler/1.0")
+CRAWLER_PER_HOST_CONCURRENCY = int(os.getenv("CRAWLER_PER_HOST_CONCURRENCY", "2"))
+CRAWLER_TIMEOUT_SECONDS = float(os.getenv("CRAWLER_TIMEOUT_SECONDS", "20"))
+CRAWLER_MAX_PAGE_BYTES = int(os.getenv("CRAWLER_MAX_PAGE_BYTES", str(20 * 1024 * 1024)))
+# 社内サイトなど、内部アドレスでも取得を許可するネットワーク（カンマ区切りのCIDR）
+CRAWLER_ALLOWED_NETWORKS = [
+    network.strip() for network in os.getenv("CRAWLER_ALLOWED_NETWORKS", "").split(",") if network.strip()
+]
+CRAWLER_MAX_REDIRECTS = 5
+ROBOTS_TTL_SECONDS = 3600.0
+# RFC 9309: robots.txt は少なくとも500KiBまで読めばよい
+ROBOTS_MAX_BYTES = 512 * 1024
+
+# rel="next" とよくある「次へ」リンクを既定のページ送りセレクタとする
+DEFAULT_NEXT_SELECTORS = ["link[rel=next]", "a[rel=next]", "a.next", "li.next > a"]
+
+CRAWLER_FETCHES = REGISTRY.counter(
+    "salon_crawler_fetches_total",
+    "クローラーのページ取得数（result=ok/not_modified/robots_denied/blocked/error）",
+    ("result",),
+)
+CRAWLER_FETCH_DURATION = REGISTRY.histogram(
+    "salon_crawler_fetch_duration_seconds",
+    "クローラーの1ページあたりの取得時間",
+)
+
+
+class FetchRejected(Exception):
+    """取得先が許可されていない、または応答が大きすぎる・リダイレクトが多すぎる"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class ConditionalCache:
+    """URLごとに ETag / Last-Modified と本文を保持する（件数上限付きLRU）"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Optional[str], Optional[str], str]]" = OrderedDict()
+
+    def validators(self, url: str) -> Dict[str, str]:
+        entry = self._entries.get(url)
+        if not entry:
+            return {}
+        etag, last_modified, _ = entry
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def body(self, url: str) -> Optional[str]:
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        self._entries.move_to_end(url)
+        return entry[2]
+
+    def store(self, url: str, response: httpx.Response, body: str) -> None:
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        if not etag and not last_modified:
+            self._entries.pop(url, None)
+            return
+        self._entries[url] = (etag, last_modified, body)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+@dataclass
+class CrawlResult:
+    items: List[Dict[str, Any]] = field(default_factory=list)
+    pages: List[Dict[str, Any]] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+
+
+class Crawler:
+    def __init__(
+        self,
+        per_host_concurrency: int = CRAWLER_PER_HOST_CONCURRENCY,
+        user_agent: str = CRAWLER_USER_AGENT,
+        timeout: float = CRAWLER_TIMEOUT_SECONDS,
+        max_page_bytes: int = CRAWLER_MAX_PAGE_BYTES,
+        allowed_networks: Sequence[str] = CRAWLER_ALLOWED_NETWORKS,
+    ):
+        self.per_host_concurrency = per_host_concurrency
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.max_page_bytes = max_page_bytes
+        self.allowed_networks = [ipaddress.ip_network(network, strict=False) for network in allowed_networks]
+        self.cache = ConditionalCache()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._robots: Dict[str, Tuple[float, Optional[RobotFileParser]]] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={"User-Agent": self.user_agent},
+                timeout=self.timeout,
+                # リダイレクト先も接続先の確認をするため、自前で1段ずつ辿る
+                follow_redirects=False,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_concurrency)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    def _address_allowed(self, address: str) -> bool:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        if any(ip in network for network in self.allowed_networks):
+            return True
+        return ip.is_global and not ip.is_multicast
+
+    async def _check_url(self, url: str) -> None:
+        """URLのホストを名前解決し、内部ネットワークのアドレスなら FetchRejected を送出する"""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise FetchRejected("blocked", f"http/https 以外のURLは取得できません: {url}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+        except OSError as exc:
+            raise httpx.ConnectError(f"名前解決に失敗しました: {parts.hostname}: {exc}") from exc
+        for info in infos:
+            if not self._address_allowed(info[4][0]):
+                raise FetchRejected("blocked", f"内部ネットワークのアドレスは取得できません: {url}")
+
+    def _check_peer(self, url: str, response: httpx.Response) -> None:
+        # 名前解決から接続までの間にDNSの応答が変わった場合（DNSリバインディング）に備え、実際の接続先も確認する
+        stream = response.extensions.get("network_stream")
+        server_addr = stream.get_extra_info("server_addr") if stream is not None else None
+        if server_addr and not self._address_allowed(server_addr[0]):
+            raise FetchRejected("blocked", f"内部ネットワークのアドレスは取得できません: {url}")
+
+    async def _get(
+        self, url: str, headers: Optional[Dict[str, str]] = None, max_bytes: Optional[int] = None
+    ) -> Tuple[httpx.Response, bytes]:
+        """接続先を確認しながらリダイレクトを辿って取得し、(応答, 本文) を返す
+
+        本文は max_bytes を超えた時点で読み込みを打ち切る。ホストごとの同時接続数の制限は各段で取る。
+        """
+        max_bytes = self.max_page_bytes if max_bytes is None else max_bytes
+        for _hop in range(CRAWLER_MAX_REDIRECTS + 1):
+            await self._check_url(url)
+            async with self._semaphore(urlsplit(url).netloc):
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    self._check_peer(url, response)
+                    location = response.headers.get("location")
+                    if response.is_redirect and location:
+                        url = urljoin(url, location)
+                        continue
+                    declared = response.headers.get("content-length")
+                    if declared and declared.isdigit() and int(declared) > max_bytes:
+                        raise FetchRejected("too_large", f"ページが大きすぎます: {url}")
+                    chunks: List[bytes] = []
+                    size = 0
+                    async for chunk in response.aiter_bytes():
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise FetchRejected("too_large", f"ページが大きすぎます: {url}")
+                        chunks.append(chunk)
+                    return response, b"".join(chunks)
+        raise FetchRejected("too_many_redirects", f"リダイレクトが多すぎます: {url}")
+
+    @staticmethod
+    def _decode(response: httpx.Response, content: bytes) -> str:
+        return content.decode(response.encoding or "utf-8", errors="replace")
+
+    async def _robots_parser(self, url: str) -> Optional[RobotFileParser]:
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        cached = self._robots.get(origin)
+        if cached and time.monotonic() - cached[0] < ROBOTS_TTL_SECONDS:
+            return cached[1]
+
+        parser: Optional[RobotFileParser] = RobotFileParser()
+        try:
+            response, content = await self._get(f"{origin}/robots.txt", max_bytes=ROBOTS_MAX_BYTES)
+            if response.status_code >= 500:
+                # RFC 9309: サーバーエラー時は全体を不許可として扱う
+                parser.disallow_all = True
+            elif response.status_code >= 400:
+                parser = None
+            else:
+                parser.parse(self._decode(response, content).splitlines())
+        except (httpx.HTTPError, FetchRejected) as exc:
+            print(f"Warning: robots.txt fetch failed for {origin}: {exc}")
+            parser = None
+        self._robots[origin] = (time.monotonic(), parser)
+        return parser
+
+    async def allowed(self, url: str) -> bool:
+        parser = await self._robots_parser(url)
+        if parser is None:
+            return True
+        return parser.can_fetch(self.user_agent, url)
+
+    async def fetch(self, url: str) -> Tuple[str, Optional[str]]:
+        """(result, 本文) を返す。result は ok / not_modified / robots_denied / blocked / error"""
+        start = time.perf_counter()
+        try:
+            # robots.txt を取りに行く前に、取得先のアドレスを確認する
+            await self._check_url(url)
+            if not await self.allowed(url):
+                CRAWLER_FETCHES.inc("robots_denied")
+                return "robots_denied", None
+            response, content = await self._get(url, self.cache.validators(url))
+            if response.status_code == 304:
+                body = self.cache.body(url)
+                if body is not None:
+                    CRAWLER_FETCHES.inc("not_modified")
+                    return "not_modified", body
+                # キャッシュが消えていた場合は条件なしで取り直す
+                response, content = await self._get(url)
+        except FetchRejected as exc:
+            result = "blocked" if exc.reason == "blocked" else "error"
+            CRAWLER_FETCHES.inc(result)
+            print(f"Warning: crawl fetch rejected for {url}: {exc}")
+            return result, None
+        except httpx.HTTPError as exc:
+            CRAWLER_FETCHES.inc("error")
+            print(f"Warning: crawl fetch failed for {url}: {exc}")
+            return "error", None
+        finally:
+            CRAWLER_FETCH_DURATION.observe(time.perf_counter() - start)
+
+        if response.status_code >= 400:
+            CRAWLER_FETCHES.inc("error")
+            return "error", None
+        body = self._decode(response, content)
+        self.cache.store(url, response, body)
+        CRAWLER_FETCHES.inc("ok")
+        return "ok", body
+
+    async def crawl(
+        self,
+        start_url: str,
+        selectors: List[str],
+        limit: int,
+        include_links: bool = True,
+        parser: Optional[str] = None,
+        follow_pagination: bool = True,
+        max_pages: int = 10,
+        next_selectors: Optional[List[str]] = None,
+    ) -> CrawlResult:
+        """出展者一覧を起点にページ送りを辿り、limit件まで抽出する"""
+        result = CrawlResult()
+        start_host = urlsplit(start_url).netloc
+        link_selectors = (next_selectors or DEFAULT_NEXT_SELECTORS) if follow_pagination else None
+        seen_items = set()
+        visited = set()
+        url: Optional[str] = start_url
+
+        while url and len(result.pages) < max_pages and len(result.items) < limit:
+            visited.add(url)
+            status, body = await self.fetch(url)
+            result.pages.append({"url": url, "result": status})
+            if body is None:
+                if status == "robots_denied":
+                    result.notes.append(f"robots.txtにより取得が許可されていません: {url}")
+                elif status == "blocked":
+                    result.notes.append(f"内部ネットワークのアドレスは取得できません: {url}")
+                else:
+                    result.notes.append(f"ページの取得に失敗しました: {url}")
+                break
+
+            page = await parse_scrape_page(
+                body,
+                selectors,
+                limit - len(result.items),
+                include_links=include_links,
+                parser=parser,
+                link_selectors=link_selectors,
+            )
+            for item in page["items"]:
+                key = (item["selector"], item["text"])
+                if key in seen_items:
+                    continue
+                seen_items.add(key)
+                if item.get("href"):
+                    item["href"] = urljoin(url, item["href"])
+                item["page_url"] = url
+                result.items.append(item)
+                if len(result.items) >= limit:
+                    break
+
+            url = None
+            for href in page["links"]:
+                candidate = urljoin(result.pages[-1]["url"], href).split("#", 1)[0]
+                if urlsplit(candidate).netloc == start_host and candidate not in visited:
+                    url = candidate
+                    break
+
+        return result
+
+
+crawler = Crawler()
@@ -0,0 +1,327 @@
+"""POSTリクエストの Idempotency-Key 対応
+
+タイムアウト後にモバイル端末が同じリクエストを再送しても、Gemini呼び出しやレポート作成を
+やり直さないよう、キーごとに最初のレスポンスを保存して再送時はそれを返す。
+同じキーのリクエストが処理中なら、完了を待って同じレスポンスを返す。
+
+キーはメソッド・パスと組で管理し、同じキーで本文が異なるリクエストは 422 で拒否する。
+保存件数には上限があり、TTLを過ぎたものから破棄する。
+
+処理中・保存済みの記録は RecordStore に置き、PERSIST_DIR を設定すれば他のストアと同じく永続化される。
+複数ワーカーでは共有ログを通じて全ワーカーが同じ記録を見るため、別のワーカーに届いた再送も
+二重に処理しない（処理中なら、そのワーカーが結果を書き込むまでログを読み直して待つ）。
+処理していたワーカーが落ちた記録は、処理中のまま残らないよう破棄して処理し直す。
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, field_serializer, field_validator
+
+from metrics import record_cache
+from stores import RecordStore, write_lock
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "2000"))
+# これより大きいレスポンスは保存せず、再送時は改めて処理する
+IDEMPOTENCY_MAX_BODY_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BODY_BYTES", str(2 * 1024 * 1024)))
+# 指紋を取るために読み込むリクエスト本文の上限。超えたらキーを使わずにそのまま処理する
+IDEMPOTENCY_MAX_REQUEST_BYTES = int(os.getenv("IDEMPOTENCY_MAX_REQUEST_BYTES", str(1024 * 1024)))
+# これより長く処理中のままの記録は、処理していたワーカーが応答しなくなったものとみなす
+IDEMPOTENCY_PENDING_TIMEOUT_SECONDS = float(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT_SECONDS", "600"))
+# 他のワーカーが処理中の再送が、結果を確かめに共有ログを読み直す間隔
+IDEMPOTENCY_POLL_SECONDS = 0.2
+MAX_KEY_LENGTH = 255
+
+_METHODS = {"POST"}
+
+
+@dataclass
+class StoredResponse:
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+
+class IdempotencyRecord(BaseModel):
+    """キー1件分の記録（status が None の間は owner のワーカーが処理中）"""
+
+    fingerprint: str
+    # ワーカー間で比べるため壁時計の時刻
+    created_at: float
+    owner: int
+    status: Optional[int] = None
+    headers: List[Tuple[str, str]] = []
+    body: bytes = b""
+
+    @field_validator("body", mode="before")
+    @classmethod
+    def _decode_body(cls, value):
+        # ログ・スナップショットには base64 の文字列で保存している
+        return base64.b64decode(value) if isinstance(value, str) else value
+
+    @field_serializer("body", when_used="json")
+    def _encode_body(self, value: bytes) -> str:
+        return base64.b64encode(value).decode("ascii")
+
+    @property
+    def done(self) -> bool:
+        return self.status is not None
+
+    def response(self) -> StoredResponse:
+        return StoredResponse(
+            self.status,
+            [(name.encode("latin-1"), value.encode("latin-1")) for name, value in self.headers],
+            self.body,
+        )
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IdempotencyStore:
+    """キー -> 処理中または保存済みの記録（件数上限付き・TTLあり）"""
+
+    def __init__(
+        self,
+        records: Optional[RecordStore] = None,
+        ttl: float = IDEMPOTENCY_TTL_SECONDS,
+        max_keys: int = IDEMPOTENCY_MAX_KEYS,
+        pending_timeout: float = IDEMPOTENCY_PENDING_TIMEOUT_SECONDS,
+    ):
+        self.records = RecordStore("idempotency") if records is None else records
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.pending_timeout = pending_timeout
+        # このワーカーで処理中のキー -> 完了を待つ再送を起こすFuture
+        self._local: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def _abandoned(self, key: str, record: IdempotencyRecord, now: float) -> bool:
+        """処理中のまま完了しない記録か（処理していたワーカーが落ちた・再起動した）"""
+        if record.done:
+            return False
+        if now - record.created_at > self.pending_timeout:
+            return True
+        if record.owner == os.getpid():
+            return key not in self._local
+        return not _process_alive(record.owner)
+
+    def _stale(self, key: str, record: IdempotencyRecord, now: float) -> bool:
+        if record.done:
+            return now - record.created_at > self.ttl
+        return self._abandoned(key, record, now)
+
+    def _evict(self, now: float) -> None:
+        # 古い順に、期限切れか上限超過の分を捨てる。処理中のものは待っている再送があるので残す
+        for key in list(self.records):
+            record = self.records[key]
+            stale = self._stale(key, record, now)
+            if not stale and len(self.records) <= self.max_keys:
+                break
+            if record.done or stale:
+                del self.records[key]
+            else:
+                break
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[str, IdempotencyRecord]:
+        """("new" | "wait" | "mismatch", record) を返す"""
+        now = time.time()
+        # 確認と登録の間に他のワーカーが同じキーを登録しないよう、共有ログのロックの中で行う
+        with write_lock():
+            self._evict(now)
+            record = self.records.get(key)
+            if record is not None and self._stale(key, record, now):
+                del self.records[key]
+                record = None
+            if record is None:
+                record = IdempotencyRecord(fingerprint=fingerprint, created_at=now, owner=os.getpid())
+                self.records[key] = record
+                self._local[key] = asyncio.get_running_loop().create_future()
+                return "new", record
+        if record.fingerprint != fingerprint:
+            return "mismatch", record
+        return "wait", record
+
+    async def wait(self, key: str, record: IdempotencyRecord) -> Optional[StoredResponse]:
+        """処理中のリクエストの結果を待つ（保存されなかった・処理が途絶えた場合は None）"""
+        if record.done:
+            return record.response()
+        future = self._local.get(key)
+        if future is not None:
+            # 待っている再送が切断されても、元のリクエストは止めない
+            return await asyncio.shield(future)
+        # 他のワーカーが処理中。共有ログを読み直して結果が書き込まれるのを待つ
+        while True:
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+            with write_lock():
+                current = self.records.get(key)
+            if current is None or current.fingerprint != record.fingerprint:
+                return None
+            if current.done:
+                return current.response()
+            if self._abandoned(key, current, time.time()):
+                return None
+
+    def finish(self, key: str, record: IdempotencyRecord, response: Optional[StoredResponse]) -> None:
+        """レスポンスを保存して待機中の再送を起こす。保存しない場合はキーを解放する"""
+        # サーバーエラーは再試行でやり直せるよう保存しない
+        if response is not None and (response.status >= 500 or len(response.body) > IDEMPOTENCY_MAX_BODY_BYTES):
+            response = None
+        future = self._local.pop(key, None)
+        with write_lock():
+            # 処理中に破棄・登録し直された記録は上書きしない
+            if self.records.get(key) == record:
+                if response is None:
+                    del self.records[key]
+                else:
+                    self.records[key] = record.model_copy(
+                        update={
+                            "status": response.status,
+                            "headers": [
+                                (name.decode("latin-1"), value.decode("latin-1"))
+                                for name, value in response.headers
+                            ],
+                            "body": response.body,
+                        }
+                    )
+        if future is not None and not future.done():
+            future.set_result(response)
+
+
+idempotency_store = IdempotencyStore()
+
+
+async def _send_json(send, status: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _replay(send, response: StoredResponse) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": response.status,
+            "headers": response.headers + [(b"idempotent-replayed", b"true")],
+        }
+    )
+    await send({"type": "http.response.body", "body": response.body})
+
+
+def _prepend_receive(chunks: List[bytes], receive):
+    """読み込み済みの本文を先に返し、その後は元の receive に委ねる"""
+    pending = list(chunks)
+
+    async def wrapped():
+        if pending:
+            return {"type": "http.request", "body": pending.pop(0), "more_body": True}
+        return await receive()
+
+    return wrapped
+
+
+class IdempotencyMiddleware:
+    """Idempotency-Key ヘッダー付きのPOSTを一度だけ処理するASGIミドルウェア"""
+
+    def __init__(self, app, store: IdempotencyStore = idempotency_store):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") not in _METHODS:
+            await self.app(scope, receive, send)
+            return
+        header = dict(scope.get("headers") or []).get(b"idempotency-key")
+        if header is None:
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = header.decode("latin-1").strip()
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, "Idempotency-Key が不正です")
+            return
+
+        # 本文を読み切って指紋を取り、アプリにはそのまま渡し直す
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            more_body = message.get("more_body", False)
+            if more_body and size > IDEMPOTENCY_MAX_REQUEST_BYTES:
+                # 大きな本文（/events/import のストリーミングなど）はメモリに溜めず、
+                # 読んだ分を渡し直してから残りをそのまま流す（再送の重複は防げない）
+                print(f"Idempotency-Key ignored: request body exceeds {IDEMPOTENCY_MAX_REQUEST_BYTES} bytes")
+                await self.app(scope, _prepend_receive(chunks, receive), send)
+                return
+        body = b"".join(chunks)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        key = f"{scope['method']} {scope['path']} {idempotency_key}"
+
+        state, record = self.store.begin(key, fingerprint)
+        if state == "mismatch":
+            await _send_json(send, 422, "この Idempotency-Key は内容の異なるリクエストで使用済みです")
+            return
+        if state == "wait":
+            record_cache("idempotency", True)
+            stored = await self.store.wait(key, record)
+            if stored is None:
+                await _send_json(send, 409, "同じ Idempotency-Key のリクエストが完了しませんでした。再試行してください")
+            else:
+                await _replay(send, stored)
+            return
+        record_cache("idempotency", False)
+
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status = 500
+        headers: List[Tuple[bytes, bytes]] = []
+        response_body = []
+
+        async def capture_send(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers") or [])
+            elif message["type"] == "http.response.body":
+                response_body.append(message.get("body", b""))
+            await send(message)
+
+        stored: Optional[StoredResponse] = None
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            stored = StoredResponse(status, headers, b"".join(response_body))
+        finally:
+            self.store.finish(key, record, stored)
@@ -0,0 +1,170 @@
+"""イベントループの遅延計測とブロッキング検知
+
+ループ上のハートビート（一定間隔のsleep）の遅れをラグとして記録し、
+別スレッドのウォッチドッグがハートビートの途絶を検知した時点で
+ループスレッドのスタックを採取して、どのハンドラがループを塞いでいるかを出力する。
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from metrics import REGISTRY
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LOOP_LAG = REGISTRY.histogram(
+    "salon_event_loop_lag_seconds",
+    "イベントループのスケジューリング遅延",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_BLOCKED = REGISTRY.counter(
+    "salon_event_loop_blocked_total",
+    "しきい値を超えてイベントループを塞いだ処理の検知数",
+    ("handler",),
+)
+
+
+def _percentile(sorted_values: List[float], quantile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(quantile * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _handler_name(stack: traceback.StackSummary) -> str:
+    """スタック中で最も内側にあるアプリケーションコードの関数をハンドラ名とみなす
+
+    外側から探すと、ルートより外側にあるアプリ内のASGIミドルウェア（圧縮・Idempotency など）が
+    常に見つかってしまうため、ループを実際に塞いでいる側（内側）から探す。
+    """
+    for frame in reversed(stack):
+        if os.path.dirname(os.path.abspath(frame.filename)) == APP_DIR and not frame.filename.endswith(
+            ("loopmonitor.py", "metrics.py", "profiler.py")
+        ):
+            return f"{frame.name} ({os.path.basename(frame.filename)})"
+    if stack:
+        last = stack[-1]
+        return f"{last.name} ({os.path.basename(last.filename)})"
+    return "unknown"
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = 0.05,
+        block_threshold: float = 0.1,
+        window: int = 2048,
+        max_events: int = 50,
+    ):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self._lags: Deque[float] = deque(maxlen=window)
+        self.blocking_events: Deque[Dict[str, Any]] = deque(maxlen=max_events)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="salon-loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1.0)
+            self._watchdog = None
+
+    async def _beat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._heartbeat = time.monotonic()
+            self._lags.append(lag)
+            LOOP_LAG.observe(lag)
+
+    def _watch(self) -> None:
+        # ハートビート間隔＋しきい値を超えて更新がなければブロックとみなす
+        limit = self.interval + self.block_threshold
+        reported_heartbeat = None
+        while not self._stop.wait(min(self.block_threshold / 2, 0.05)):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat
+            if stalled < limit or heartbeat == reported_heartbeat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            reported_heartbeat = heartbeat
+            stack = traceback.extract_stack(frame)
+            handler = _handler_name(stack)
+            LOOP_BLOCKED.inc(handler)
+            event = {
+                "detected_at": time.time(),
+                "blocked_for": round(stalled, 4),
+                "handler": handler,
+                "stack": traceback.format_list(stack),
+            }
+            self.blocking_events.append(event)
+            print(
+                f"Event loop blocked for {stalled * 1000:.0f}ms+ in {handler}\n"
+                + "".join(event["stack"][-12:])
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        values = sorted(self._lags)
+        return {
+            "samples": len(values),
+            "interval": self.interval,
+            "block_threshold": self.block_threshold,
+            "p50": _percentile(values, 0.5),
+            "p90": _percentile(values, 0.9),
+            "p99": _percentile(values, 0.99),
+            "max": values[-1] if values else 0.0,
+            "blocking_events": len(self.blocking_events),
+        }
+
+    def collect(self):
+        stats = self.stats()
+        yield (
+            "salon_event_loop_lag_quantile_seconds",
+            "gauge",
+            "直近ウィンドウにおけるイベントループ遅延のパーセンタイル",
+            [
+                ({"quantile": "0.5"}, stats["p50"]),
+                ({"quantile": "0.9"}, stats["p90"]),
+                ({"quantile": "0.99"}, stats["p99"]),
+                ({"quantile": "1"}, stats["max"]),
+            ],
+        )
+
+
+loop_monitor = LoopMonitor(
+    interval=float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "50")) / 1000,
+    block_threshold=float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100")) / 1000,
+)
+REGISTRY.register_collector(loop_monitor.collect)
@@ -1,26 +1,142 @@
+from contextlib import asynccontextmanager
 from datetime import date, datetime
 from uuid import uuid4
-
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hmac
+import threading
+import time
+
+import anyio
+import httpx
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.concurrency import run_in_threadpool
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any, Literal
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, List, Dict, Any, AsyncIterator, FrozenSet, Iterator, Literal, Tuple
 from google import genai
+from google.genai import errors as genai_errors
 from google.genai import types
 import os
 from dotenv import load_dotenv
 import base64
 import binascii
-from bs4 import BeautifulSoup
 import json
+from soupsieve import SelectorSyntaxError
+
+from admission import (
+    ADMISSION_REJECTED,
+    ConcurrencyGate,
+    Overloaded,
+    PriorityClass,
+    RateLimiter,
+    RateLimitMiddleware,
+    ai_priority,
+    client_key,
+    current_priority,
+    retry_after_header,
+)
+from archive import (
+    NDJSON_MEDIA_TYPE,
+    ZSTD_MEDIA_TYPE,
+    ArchiveError,
+    ArchiveReader,
+    archive_line,
+    check_header,
+    encode_stream,
+    header_line,
+    zstd_available,
+)
+from metrics import (
+    GEMINI_ERRORS,
+    GEMINI_REQUEST_DURATION,
+    REGISTRY,
+    MetricsMiddleware,
+    record_cache,
+)
+from loopmonitor import loop_monitor
+from compression import CompressionMiddleware
+from idempotency import IdempotencyMiddleware, IdempotencyRecord, idempotency_store
+from cards import CardDuplicateIndex, card_keys, is_same_person
+from cluster import BackgroundJobs, CatchUpMiddleware, LeaderLease
+from changelog import ChangeLog, record_event_ids
+from crawler import crawler
+from matching import CompanyNameIndex
+from scrape_history import ScrapeHistory, item_fingerprint, normalize_text
+from search import SearchIndex
+from serialization import FieldSelection, JSONBytesResponse, dumps, fragment_cache
+from similarity import VectorIndex, vectorize
+from singleflight import single_flight
+from suggest import SuggestIndex
+from stores import RecordStore, VersionConflict, write_group, write_lock
+from scraping import parse_scrape_items, shutdown_executor
+from routing import AI_MODEL_SERVED, ModelRoute, ModelRouter, current_latency_budget, latency_budget
+from persistence import (
+    PERSIST_DIR,
+    PERSIST_SNAPSHOT_INTERVAL_SECONDS,
+    PERSIST_SNAPSHOT_ON_SHUTDOWN,
+    WEB_CONCURRENCY,
+    StorePersistence,
+)
+from profiler import (
+    MAX_PROFILE_SECONDS,
+    RequestProfilingMiddleware,
+    SamplingProfiler,
+    profile_results,
+    whole_process_lock,
+)
 
 load_dotenv()
 
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+# 削除の墓標を同期用に保持する期間と、期限切れを掃除する間隔
+SYNC_TOMBSTONE_TTL_SECONDS = float(os.getenv("SYNC_TOMBSTONE_TTL_SECONDS", str(7 * 24 * 3600)))
+SYNC_COMPACT_INTERVAL_SECONDS = float(os.getenv("SYNC_COMPACT_INTERVAL_SECONDS", "3600"))
+
+
+async def _compact_change_log_periodically() -> None:
+    while True:
+        await asyncio.sleep(SYNC_COMPACT_INTERVAL_SECONDS)
+        removed = change_log.compact()
+        if removed:
+            print(f"Change log compacted: {removed} tombstones removed (horizon={change_log.horizon})")
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    persister = None
+    if persistence is not None:
+        restored = persistence.load()
+        # スナップショットより前の削除は記録が残っていないため、それ以前からの同期は全件取得にする
+        change_log.forget_before(restored["snapshot_version"])
+        persister = asyncio.create_task(persistence.run())
+    compactor = asyncio.create_task(_compact_change_log_periodically())
+    job_runner = asyncio.create_task(background_jobs.run())
+    try:
+        yield
+    finally:
+        compactor.cancel()
+        job_runner.cancel()
+        if persister is not None:
+            persister.cancel()
+            # 複数ワーカーでは定期ジョブの所有者だけがスナップショットを取る
+            await persistence.close(snapshot=PERSIST_SNAPSHOT_ON_SHUTDOWN and background_jobs.is_owner)
+        background_jobs.release()
+        if LOOP_MONITOR_ENABLED:
+            await loop_monitor.stop()
+        shutdown_executor()
+        await crawler.aclose()
+
+
 app = FastAPI(
     title="展示会用名刺管理API",
     description="名刺OCRとDeepリサーチ機能を提供するAPI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    # 標準の json より高速な orjson でレスポンスをJSON化する
+    default_response_class=ORJSONResponse,
 )
 
 # CORS設定
@@ -36,14 +152,66 @@ ALLOWED_ORIGINS = [origin.strip() for origin in ALLOWED_ORIGINS_STR.split(",") i
 # デバッグ用: 許可されているオリジンをログ出力
 print(f"CORS設定: 許可されているオリジン: {ALLOWED_ORIGINS}")
 
+# Idempotency-Key 付きPOSTの再送は保存済みレスポンスを返す（CORSより内側に置き、再送にもCORSヘッダーを付ける）
+app.add_middleware(IdempotencyMiddleware)
+
+# クライアント（IP。RATE_LIMIT_TRUST_USER_ID なら X-User-Id）ごとのレート制限。1分あたりの回数と連続で使える回数（0で無効）
+RATE_LIMITS: Dict[str, RateLimiter] = {
+    # AIを使うエンドポイント（名刺スキャン、Deepリサーチ、事前調査、キーワード提案、資料の自動解析、レポート生成）
+    "ai": RateLimiter(
+        float(os.getenv("RATE_LIMIT_AI_PER_MINUTE", "10")), float(os.getenv("RATE_LIMIT_AI_BURST", "5"))
+    ),
+    # ターゲット企業の一括事前調査
+    "ai_batch": RateLimiter(
+        float(os.getenv("RATE_LIMIT_AI_BATCH_PER_MINUTE", "2")), float(os.getenv("RATE_LIMIT_AI_BATCH_BURST", "2"))
+    ),
+    "read": RateLimiter(
+        float(os.getenv("RATE_LIMIT_READ_PER_MINUTE", "0")), float(os.getenv("RATE_LIMIT_READ_BURST", "200"))
+    ),
+    "write": RateLimiter(
+        float(os.getenv("RATE_LIMIT_WRITE_PER_MINUTE", "0")), float(os.getenv("RATE_LIMIT_WRITE_BURST", "60"))
+    ),
+}
+# 読み取り・書き込みの制限は本文を読む前に判定する（429 にもCORSヘッダーが付くようCORSより内側に置く）
+app.add_middleware(
+    RateLimitMiddleware, read=RATE_LIMITS["read"], write=RATE_LIMITS["write"], exempt_paths=("/metrics",)
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Idempotent-Replayed"],
 )
 
+# Accept-Encoding に応じた Brotli / gzip 圧縮（Idempotency より外側に置き、保存するレスポンスは非圧縮のままにする）
+app.add_middleware(CompressionMiddleware)
+
+# 管理用エンドポイントのトークン（未設定の場合は管理機能を無効化）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def _is_admin_token(token: Optional[str]) -> bool:
+    if not ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+async def _require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="管理機能は無効です（ADMIN_TOKEN未設定）")
+    if not _is_admin_token(x_admin_token):
+        raise HTTPException(status_code=401, detail="管理者トークンが正しくありません")
+
+
+# X-Profile: 1 と管理者トークンを付けたリクエストだけをプロファイルする
+app.add_middleware(RequestProfilingMiddleware, authorize=_is_admin_token)
+
+# メトリクス計測（CORSより外側で全リクエストを計測する）
+app.add_middleware(MetricsMiddleware)
+
 # Gemini API設定（新しいSDK）
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 if GEMINI_API_KEY:
@@ -52,11 +220,187 @@ else:
     gemini_client = None
 
 
+# AI呼び出し全体の同時実行数の上限と待ち行列（スレッドプールの既定40スレッドを使い切らないよう十分小さくする）
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_QUEUE_SIZE = int(os.getenv("AI_QUEUE_SIZE", "32"))
+AI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("AI_QUEUE_TIMEOUT_SECONDS", "30"))
+# 一括処理は対話的な呼び出しに順番を譲るため長めに待たせ、同時に使える枠も全体の半分までにする
+AI_BATCH_QUEUE_TIMEOUT_SECONDS = float(os.getenv("AI_BATCH_QUEUE_TIMEOUT_SECONDS", "600"))
+AI_BATCH_MAX_CONCURRENCY = int(os.getenv("AI_BATCH_MAX_CONCURRENCY", str(max(1, AI_MAX_CONCURRENCY // 2))))
+ai_gate = ConcurrencyGate(
+    AI_MAX_CONCURRENCY,
+    {
+        # ブースで結果を待っている操作（名刺スキャン、キーワード提案、資料の自動解析）
+        "interactive": PriorityClass(
+            int(os.getenv("AI_PRIORITY_WEIGHT_INTERACTIVE", "8")), AI_QUEUE_SIZE, AI_QUEUE_TIMEOUT_SECONDS
+        ),
+        # 画面から1件ずつ依頼する調査（Deepリサーチ、事前調査）
+        "standard": PriorityClass(
+            int(os.getenv("AI_PRIORITY_WEIGHT_STANDARD", "3")), AI_QUEUE_SIZE, AI_QUEUE_TIMEOUT_SECONDS
+        ),
+        # 一括事前調査、レポート生成
+        "batch": PriorityClass(
+            int(os.getenv("AI_PRIORITY_WEIGHT_BATCH", "1")),
+            AI_QUEUE_SIZE,
+            AI_BATCH_QUEUE_TIMEOUT_SECONDS,
+            AI_BATCH_MAX_CONCURRENCY,
+        ),
+    },
+)
+# 呼び出し箇所ごとの既定の優先度（ai_priority() で呼び出し元から下げられる）
+AI_CALL_SITE_PRIORITY = {
+    "scan": "interactive",
+    "keyword_suggest": "interactive",
+    "material_analysis": "interactive",
+    "deep_research": "standard",
+    "pre_research": "standard",
+    "event_report": "batch",
+}
+
+
+def _model_route(call_site: str, models: List[str], latency_budget: Optional[float] = None) -> ModelRoute:
+    """AI_MODELS_<呼び出し箇所>（カンマ区切り）と AI_LATENCY_BUDGET_<呼び出し箇所>_SECONDS（0で無効）で上書きできる"""
+    name = call_site.upper()
+    configured_models = [model.strip() for model in os.getenv(f"AI_MODELS_{name}", "").split(",") if model.strip()]
+    configured_budget = os.getenv(f"AI_LATENCY_BUDGET_{name}_SECONDS")
+    if configured_budget is not None:
+        latency_budget = float(configured_budget) or None
+    return ModelRoute(configured_models or models, latency_budget)
+
+
+# 呼び出し箇所ごとのモデルの候補（先頭が品質優先の既定）と、待ち時間を含めた所要時間の目安（秒）
+model_router = ModelRouter(
+    {
+        "scan": _model_route("scan", ["gemini-1.5-flash", "gemini-1.5-pro"], 15),
+        # ブースで待っている間に返したいので、pro が目安に収まらなければ flash を使う
+        "keyword_suggest": _model_route("keyword_suggest", ["gemini-1.5-pro", "gemini-1.5-flash"], 5),
+        "material_analysis": _model_route("material_analysis", ["gemini-1.5-flash", "gemini-1.5-pro"], 20),
+        "pre_research": _model_route("pre_research", ["gemini-1.5-pro", "gemini-1.5-flash"]),
+        "event_report": _model_route("event_report", ["gemini-1.5-pro", "gemini-1.5-flash"]),
+        "deep_research": _model_route("deep_research", ["gemini-1.5-pro", "gemini-2.0-flash-exp"]),
+    },
+    # 実測が集まるまでの所要時間の仮定値
+    expected_seconds={"gemini-1.5-flash": 3.0, "gemini-2.0-flash-exp": 3.0, "gemini-1.5-pro": 10.0},
+    # 待ち行列がこの件数以上なら速いモデルを先に使う（0で無効）
+    queue_depth_threshold=int(os.getenv("AI_ROUTE_QUEUE_DEPTH", str(AI_MAX_CONCURRENCY))),
+)
+
+
+def _check_rate_limit(request: Request, endpoint_class: str) -> None:
+    limiter = RATE_LIMITS[endpoint_class]
+    retry_after = limiter.check(client_key(request.scope.get("headers") or [], request.scope.get("client")))
+    if retry_after is not None:
+        ADMISSION_REJECTED.inc(endpoint_class, "rate_limit")
+        raise HTTPException(
+            status_code=429,
+            detail="AI機能の利用回数の上限に達しました。しばらくしてから再度お試しください",
+            headers=retry_after_header(retry_after),
+        )
+
+
+def _rate_limit(endpoint_class: str):
+    """AIを使うエンドポイントの依存関係（クライアントごとの回数の上限を超えたら 429）"""
+
+    async def dependency(request: Request) -> None:
+        _check_rate_limit(request, endpoint_class)
+
+    return dependency
+
+
+async def _ai_latency_budget(x_ai_latency_budget_ms: Optional[int] = Header(None)) -> AsyncIterator[None]:
+    """X-AI-Latency-Budget-Ms で、このリクエストのAI呼び出しの所要時間の目安を呼び出し箇所の既定から変える（0で目安なし）"""
+    if x_ai_latency_budget_ms is None:
+        yield
+        return
+    with latency_budget(x_ai_latency_budget_ms / 1000 if x_ai_latency_budget_ms > 0 else float("inf")):
+        yield
+
+
+def _is_model_failure(exc: Exception) -> bool:
+    """別のモデルで試し直す意味のある失敗か（サーバーエラー・タイムアウト・利用枠超過・モデルが無い）
+
+    リクエスト内容の誤り（400など）はどのモデルでも同じく失敗するため、モデルの不調とはみなさない。
+    """
+    if isinstance(exc, genai_errors.APIError):
+        return exc.code is None or exc.code >= 500 or exc.code in (404, 408, 429)
+    return isinstance(exc, (httpx.TimeoutException, httpx.TransportError, TimeoutError, ConnectionError))
+
+
+def _is_admission_rejection(exc: Exception) -> bool:
+    """_generate_content が混雑で受け付けなかった（503 と Retry-After を返すべき）例外か"""
+    return isinstance(exc, HTTPException) and exc.status_code == 503
+
+
+async def _generate_content(call_site: str, contents: Any, config: Any = None) -> Tuple[Any, str]:
+    """Gemini呼び出しをスレッドプールで実行し、所要時間と失敗数を記録する
+
+    モデルは model_router が呼び出し箇所の候補から選び、サーバーエラー・タイムアウト・利用枠超過で
+    失敗したら残りの候補を順に試す。
+    同時実行数が上限に達している間は優先度別の待ち行列で待ち、行列が一杯か待ちすぎた場合は 503 を返す。
+    (レスポンス, 結果を返したモデル名) を返す。
+    """
+    priority = current_priority(AI_CALL_SITE_PRIORITY.get(call_site, "standard"))
+    models, reason = model_router.plan(
+        call_site,
+        current_latency_budget(None),
+        queue_wait=ai_gate.expected_wait(priority),
+        queue_depth=ai_gate.queued,
+    )
+    for attempt, model in enumerate(models):
+
+        def _invoke(model: str = model):
+            return gemini_client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=config,
+            )
+
+        try:
+            async with ai_gate.slot(priority):
+                start = time.perf_counter()
+                try:
+                    response = await run_in_threadpool(_invoke)
+                except Exception as exc:
+                    GEMINI_ERRORS.inc(model, call_site, type(exc).__name__)
+                    if not _is_model_failure(exc):
+                        raise
+                    model_router.record(model, False, time.perf_counter() - start)
+                    if attempt + 1 == len(models):
+                        raise
+                    print(f"Warning: {model} failed for {call_site}, trying {models[attempt + 1]}: {exc}")
+                    continue
+                finally:
+                    GEMINI_REQUEST_DURATION.observe(time.perf_counter() - start, model, call_site)
+        except Overloaded as exc:
+            ADMISSION_REJECTED.inc("ai", exc.reason)
+            raise HTTPException(
+                status_code=503,
+                detail="AI処理が混み合っています。しばらくしてから再度お試しください",
+                headers=retry_after_header(exc.retry_after),
+            )
+        model_router.record(model, True, time.perf_counter() - start)
+        AI_MODEL_SERVED.inc(call_site, model, reason if attempt == 0 else "fallback")
+        return response, model
+    raise RuntimeError(f"{call_site} にAIモデルが設定されていません")
+
+
 # リクエスト/レスポンスモデル
 class CardScanRequest(BaseModel):
     image_base64: str
 
 
+class CardDuplicateCandidate(BaseModel):
+    card_id: str
+    full_name: Optional[str] = None
+    company_name: Optional[str] = None
+    matched_on: List[str] = Field(
+        default_factory=list, description="一致した項目（email / mobile / phone / name_company）"
+    )
+    same_person: bool = Field(
+        False, description="同一人物とみなせるか（代表電話だけの一致は別人の可能性あり）"
+    )
+
+
 class CardScanResponse(BaseModel):
     company_name: Optional[str] = None
     departments: Optional[List[str]] = None
@@ -64,8 +408,14 @@ class CardScanResponse(BaseModel):
     full_name: Optional[str] = None
     name_reading: Optional[str] = None
     email: Optional[str] = None
+    phone: Optional[str] = None
+    mobile: Optional[str] = None
     company_url: Optional[str] = None
     address: Optional[str] = None
+    duplicates: List[CardDuplicateCandidate] = Field(
+        default_factory=list, description="登録済みの同一人物と思われる名刺"
+    )
+    ai_model: Optional[str] = Field(None, description="読み取りに使ったAIモデル")
 
 
 class DeepResearchRequest(BaseModel):
@@ -90,6 +440,7 @@ class DeepResearchResponse(BaseModel):
     status: str
     sources: List[SourceReference] = []
     search_queries: List[str] = []
+    ai_model: Optional[str] = None
 
 
 class EventBase(BaseModel):
@@ -175,6 +526,65 @@ class MeetingVisitContext(BaseModel):
     booth_experience: Optional[str] = Field(None, description="ブース訪問時の感想・記録")
     followup_tasks: List[str] = Field(default_factory=list, description="フォローアップタスク候補")
 
+
+class BusinessCardBase(BusinessCardLinkage):
+    target_company_id: Optional[str] = Field(None, description="紐づくターゲット企業ID")
+    company_name: Optional[str] = Field(None, description="会社名")
+    departments: List[str] = Field(default_factory=list, description="部署名")
+    titles: List[str] = Field(default_factory=list, description="役職")
+    full_name: Optional[str] = Field(None, description="氏名")
+    name_reading: Optional[str] = Field(None, description="氏名のローマ字またはフリガナ")
+    email: Optional[str] = Field(None, description="メールアドレス")
+    phone: Optional[str] = Field(None, description="電話番号")
+    mobile: Optional[str] = Field(None, description="携帯電話番号")
+    company_url: Optional[str] = Field(None, description="会社URL")
+    address: Optional[str] = Field(None, description="会社住所")
+    image_id: Optional[str] = Field(None, description="名刺画像ID（upload/imageで取得）")
+    visit_context: Optional[MeetingVisitContext] = Field(
+        None, description="ブース訪問時の記録"
+    )
+
+
+class BusinessCardCreate(BusinessCardBase):
+    created_by: Optional[str] = Field(None, description="スキャンした担当者（メールアドレスなど）")
+    merge_duplicates: bool = Field(
+        True, description="登録済みの同一人物があれば新規作成せずに統合するか"
+    )
+
+
+class BusinessCard(BusinessCardBase):
+    card_id: str = Field(..., description="名刺ID")
+    scanned_by: List[str] = Field(default_factory=list, description="スキャンした担当者一覧")
+    scan_count: int = Field(1, description="統合された分も含めたスキャン回数")
+    created_at: datetime = Field(..., description="作成日時")
+    updated_at: datetime = Field(..., description="更新日時")
+
+
+class BusinessCardUpdate(BaseModel):
+    event_id: Optional[str] = None
+    booth_id: Optional[str] = None
+    target_company_id: Optional[str] = None
+    visit_notes: Optional[str] = None
+    highlight: Optional[bool] = None
+    company_name: Optional[str] = None
+    departments: Optional[List[str]] = None
+    titles: Optional[List[str]] = None
+    full_name: Optional[str] = None
+    name_reading: Optional[str] = None
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    mobile: Optional[str] = None
+    company_url: Optional[str] = None
+    address: Optional[str] = None
+    image_id: Optional[str] = None
+    visit_context: Optional[MeetingVisitContext] = None
+
+
+class BusinessCardUpsertResponse(BaseModel):
+    card: BusinessCard
+    merged: bool = Field(False, description="既存の名刺に統合したか")
+    matched_on: List[str] = Field(default_factory=list, description="統合の根拠となった項目")
+
 NoteType = Literal["conversation", "demo", "material", "question", "followup", "other"]
 
 
@@ -193,6 +603,7 @@ class TargetCompanyBase(BaseModel):
         None, description="スクレイピングで取得した生データ"
     )
     ai_research: Optional[str] = Field(None, description="AIによる事前調査レポート")
+    ai_research_model: Optional[str] = Field(None, description="事前調査レポートを生成したAIモデル")
     highlight: bool = Field(False, description="注目ターゲットとしてマーク済みか")
 
 
@@ -242,6 +653,10 @@ class BatchPreResearchRequest(PreResearchRequest):
         default=None,
         description="事前調査を実行するターゲット企業ID。未指定の場合はイベント配下の全企業を対象",
     )
+    new_since_version: Optional[int] = Field(
+        default=None,
+        description="指定した版以降のスクレイピングで新たに現れた出展者に対応する企業だけを対象にする",
+    )
 
 
 class UploadImageRequest(BaseModel):
@@ -316,6 +731,7 @@ class KeywordNoteBase(BaseModel):
     keyword: str = Field(..., description="メモしたキーワード・疑問点")
     context: Optional[str] = Field(default=None, description="キーワードの補足情報")
     ai_suggestions: List[str] = Field(default_factory=list, description="AI提案")
+    ai_suggestions_model: Optional[str] = Field(default=None, description="AI提案を生成したモデル")
     status: Literal["open", "resolved"] = Field(
         default="open", description="対応状況"
     )
@@ -344,6 +760,7 @@ class KeywordSuggestionRequest(BaseModel):
 
 class KeywordSuggestionResponse(BaseModel):
     suggestions: List[str]
+    ai_model: Optional[str] = None
 
 
 class MaterialImageBase(BaseModel):
@@ -363,6 +780,9 @@ class MaterialImageBase(BaseModel):
     ai_summary: Optional[str] = Field(
         default=None, description="AIによる要約・注目ポイント"
     )
+    ai_model: Optional[str] = Field(
+        default=None, description="OCR・要約に使ったAIモデル"
+    )
 
 
 class MaterialImage(MaterialImageBase):
@@ -442,6 +862,9 @@ class EventReport(BaseModel):
     metadata: Optional[Dict[str, Any]] = Field(
         default=None, description="生成時のメタデータ"
     )
+    ai_model: Optional[str] = Field(
+        default=None, description="本文を生成したAIモデル"
+    )
     created_at: datetime = Field(..., description="作成日時")
     updated_at: datetime = Field(..., description="更新日時")
 
@@ -499,6 +922,18 @@ class ScrapeRequest(BaseModel):
     include_links: bool = Field(
         default=True, description="抽出結果にリンク情報を含めるか"
     )
+    parser: Optional[Literal["selectolax", "lxml", "html.parser"]] = Field(
+        default=None, description="HTMLパーサー（未指定の場合はSCRAPE_PARSERの設定値）"
+    )
+    follow_pagination: bool = Field(
+        default=True, description="サーバー側取得時にページ送りリンクを辿るか"
+    )
+    max_pages: int = Field(
+        default=10, ge=1, le=100, description="サーバー側取得時に辿る最大ページ数"
+    )
+    next_selectors: Optional[List[str]] = Field(
+        default=None, description="ページ送りリンクのCSSセレクタ（未指定の場合はrel=nextなど）"
+    )
 
 
 class ScrapeResult(BaseModel):
@@ -507,42 +942,656 @@ class ScrapeResult(BaseModel):
     items: List[Dict[str, Any]]
     source_url: Optional[str] = None
     notes: Optional[str] = None
+    pages: List[Dict[str, Any]] = Field(
+        default_factory=list, description="サーバー側で取得したページと取得結果"
+    )
+    version: Optional[int] = Field(
+        default=None, description="スクレイピング結果の版番号（差分があった場合に増加）"
+    )
+    changes: Optional[Dict[str, int]] = Field(
+        default=None, description="前回結果からの追加・削除・変更件数"
+    )
+
+
+class ScrapeVersionSummary(BaseModel):
+    version: int
+    parsed_at: datetime
+    source_url: Optional[str] = None
+    added: int
+    removed: int
+    changed: int
+
+
+class ScrapeChangesResponse(BaseModel):
+    event_id: str
+    since: int = Field(..., description="比較元の版番号")
+    current_version: int = Field(..., description="現在の版番号")
+    added: List[Dict[str, Any]] = Field(default_factory=list, description="追加された項目")
+    removed: List[Dict[str, Any]] = Field(default_factory=list, description="削除された項目")
+    changed: List[Dict[str, Any]] = Field(
+        default_factory=list, description="変更された項目（before/after）"
+    )
+    versions: List[ScrapeVersionSummary] = Field(
+        default_factory=list, description="対象期間の版ごとの件数"
+    )
+
+
+class ScrapeMatchRequest(BaseModel):
+    fingerprints: Optional[List[str]] = Field(
+        default=None, description="照合する項目のフィンガープリント（未指定の場合は全件）"
+    )
+    threshold: float = Field(default=0.6, ge=0, le=1, description="候補とみなす最低スコア")
+    limit_per_item: int = Field(default=3, ge=1, le=20, description="項目ごとの最大候補数")
+
+
+class TargetMatchCandidate(BaseModel):
+    target_company_id: str
+    name: str
+    score: float
+
+
+class ScrapedItemMatch(BaseModel):
+    item: Dict[str, Any]
+    matches: List[TargetMatchCandidate]
+
+
+class CreateTargetsFromScrapedRequest(BaseModel):
+    fingerprints: Optional[List[str]] = Field(
+        default=None, description="登録する項目のフィンガープリント（未指定の場合は全件）"
+    )
+    match_threshold: float = Field(
+        default=0.85, ge=0, le=1, description="このスコア以上の既存企業があれば登録しない"
+    )
+    priority: Optional[str] = Field(default=None, description="登録する企業の優先度")
+    highlight_tags: List[str] = Field(default_factory=list, description="登録する企業のタグ")
+
+
+class CreateTargetsFromScrapedResponse(BaseModel):
+    created: List[TargetCompany]
+    skipped: List[ScrapedItemMatch] = Field(
+        default_factory=list, description="既存企業と一致したため登録しなかった項目"
+    )
+
+
+SearchDocType = Literal["visit_note", "keyword_note", "material"]
+
+
+class SearchHitResponse(BaseModel):
+    doc_type: SearchDocType
+    doc_id: str
+    event_id: str
+    target_company_id: Optional[str] = None
+    title: Optional[str] = None
+    snippet: str = Field(..., description="一致箇所周辺の抜粋")
+    highlights: List[List[int]] = Field(
+        default_factory=list, description="snippet内の一致位置 [開始, 終了)"
+    )
+    score: float
+
+
+class SearchResponse(BaseModel):
+    query: str
+    total: int
+    offset: int
+    limit: int
+    hits: List[SearchHitResponse]
+
+
+SuggestKind = Literal["company", "booth", "booth_code", "person", "tag"]
+
+
+class SuggestItem(BaseModel):
+    text: str = Field(..., description="候補の表記")
+    kind: SuggestKind
+    source: Optional[str] = Field(None, description="候補の出どころ（target_company / booth / card / event）")
+    source_id: Optional[str] = Field(None, description="出どころのID（タグでは省略）")
+    event_id: Optional[str] = None
+    detail: Optional[str] = Field(None, description="補足（担当者の所属ブースなど）")
+
+
+SimilarDocType = Literal["visit_note", "target_company", "material"]
+
+
+class SimilarDocument(BaseModel):
+    doc_type: SimilarDocType
+    doc_id: str
+    event_id: str
+    target_company_id: Optional[str] = None
+    title: Optional[str] = None
+    snippet: str = Field(..., description="本文の冒頭")
+    score: float = Field(..., description="コサイン類似度")
+
+
+SyncEntity = Literal[
+    "events", "booths", "target_companies", "visit_notes",
+    "keyword_notes", "material_images", "tasks", "business_cards",
+]
+
+
+class SyncChange(BaseModel):
+    seq: int
+    entity: SyncEntity
+    id: str
+    op: Literal["upsert", "delete"]
+    data: Optional[Dict[str, Any]] = Field(
+        None, description="upsert時の最新レコード（値がnullの項目は省略）"
+    )
+
+
+class SyncResponse(BaseModel):
+    since: int
+    next_since: int = Field(..., description="次回の since に指定する値")
+    reset: bool = Field(
+        False, description="true の場合は端末側のデータを破棄して changes で置き換える"
+    )
+    has_more: bool = False
+    changes: List[SyncChange]
+
+
+BatchEntity = Literal[
+    "visit_notes", "keyword_notes", "tasks", "material_images", "target_companies"
+]
+
+
+class BatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    entity: BatchEntity
+    id: Optional[str] = Field(
+        None, description="update/delete の対象ID（同じバッチで作成したものは temp_id でも可）"
+    )
+    temp_id: Optional[str] = Field(
+        None, description="create 時にクライアントが振った仮ID。後続の操作の id や参照項目に使える"
+    )
+    data: Dict[str, Any] = Field(default_factory=dict, description="作成・更新時の本文")
+    if_match: Optional[str] = Field(
+        None, description="update/delete 時、対象がこの ETag のままの場合だけ適用する（違えば412）"
+    )
+
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(..., min_length=1, max_length=500)
+    atomic: bool = Field(
+        True, description="true の場合、1件でも失敗したら何も反映しない"
+    )
+
+
+class BatchOperationResult(BaseModel):
+    index: int
+    status: int = Field(..., description="個別の操作に相当するHTTPステータス")
+    id: Optional[str] = None
+    temp_id: Optional[str] = None
+    data: Optional[Dict[str, Any]] = None
+    error: Optional[Any] = None
+
+
+class BatchResponse(BaseModel):
+    committed: bool = Field(..., description="書き込みを反映したか")
+    id_map: Dict[str, str] = Field(default_factory=dict, description="temp_id -> 採番したID")
+    results: List[BatchOperationResult]
+
+
+ArchiveImages = Literal["reference", "inline"]
+
+
+class EventImportResponse(BaseModel):
+    event_id: str = Field(..., description="インポートで作成したイベントID")
+    counts: Dict[str, int] = Field(default_factory=dict, description="種別ごとの作成件数")
+    id_map: Dict[str, str] = Field(default_factory=dict, description="アーカイブ内のID -> 採番したID")
+    missing_images: List[str] = Field(
+        default_factory=list,
+        description="アーカイブにもこのサーバーにもなかった画像ID（参照は外し、その画像の資料は取り込まない）",
+    )
 
 
 # 簡易インメモリーストア
-events_store: Dict[str, Event] = {}
-booths_store: Dict[str, Booth] = {}
-target_companies_store: Dict[str, TargetCompany] = {}
-uploaded_images_store: Dict[str, UploadedImage] = {}
-visit_notes_store: Dict[str, VisitNote] = {}
-keyword_notes_store: Dict[str, KeywordNote] = {}
-material_images_store: Dict[str, MaterialImage] = {}
-tasks_store: Dict[str, Task] = {}
-event_reports_store: Dict[str, EventReport] = {}
+# 書き込み時に検索インデックス等へ変更を通知するため RecordStore（dict互換）を使用
+events_store: Dict[str, Event] = RecordStore("events")
+booths_store: Dict[str, Booth] = RecordStore("booths")
+target_companies_store: Dict[str, TargetCompany] = RecordStore("target_companies")
+uploaded_images_store: Dict[str, UploadedImage] = RecordStore("uploaded_images")
+visit_notes_store: Dict[str, VisitNote] = RecordStore("visit_notes")
+keyword_notes_store: Dict[str, KeywordNote] = RecordStore("keyword_notes")
+material_images_store: Dict[str, MaterialImage] = RecordStore("material_images")
+tasks_store: Dict[str, Task] = RecordStore("tasks")
+event_reports_store: Dict[str, EventReport] = RecordStore("event_reports")
+business_cards_store: Dict[str, BusinessCard] = RecordStore("business_cards")
+# イベントIDごとのスクレイピング結果の版履歴
+scrape_history_store: Dict[str, ScrapeHistory] = RecordStore("scrape_history")
+# 出展者名とターゲット企業名を同一とみなす既定スコア
+SCRAPE_MATCH_THRESHOLD = float(os.getenv("SCRAPE_MATCH_THRESHOLD", "0.6"))
+# イベントIDごとのターゲット企業名インデックス（出展者とのあいまい照合用）
+target_name_indexes: Dict[str, CompanyNameIndex] = {}
+
+
+def _index_target_name(
+    _store: str, key: str, old: Optional[TargetCompany], new: Optional[TargetCompany]
+) -> None:
+    if old is not None and (new is None or old.event_id != new.event_id or old.name != new.name):
+        index = target_name_indexes.get(old.event_id)
+        if index is not None:
+            index.remove(key)
+    if new is not None and (old is None or old.event_id != new.event_id or old.name != new.name):
+        target_name_indexes.setdefault(new.event_id, CompanyNameIndex()).add(key, new.name)
+
+
+target_companies_store.subscribe(_index_target_name)
+
+
+# ノート・キーワードメモ・資料OCRテキストの全文検索インデックス（キーは "種別:ID"）
+search_index = SearchIndex(filter_fields=("event_id", "target_company_id", "doc_type"))
+
+
+def _search_document(doc_type: str, record: Any) -> Tuple[str, Dict[str, Any]]:
+    if doc_type == "visit_note":
+        parts = [record.title, record.content, " ".join(record.keywords)]
+        title = record.title
+    elif doc_type == "keyword_note":
+        parts = [record.keyword, record.context, " ".join(record.ai_suggestions)]
+        title = record.keyword
+    else:
+        parts = [record.caption, " ".join(record.tags), record.ocr_text, record.ai_summary]
+        title = record.caption
+    fields = {
+        "doc_type": doc_type,
+        "event_id": record.event_id,
+        "target_company_id": record.target_company_id,
+        "title": title,
+    }
+    return "\n".join(part for part in parts if part), fields
+
+
+def _search_indexer(doc_type: str):
+    def listener(_store: str, key: str, old: Any, new: Any) -> None:
+        index_key = f"{doc_type}:{key}"
+        if new is None:
+            search_index.remove(index_key)
+            return
+        text, fields = _search_document(doc_type, new)
+        if old is not None and index_key in search_index and _search_document(doc_type, old) == (text, fields):
+            return
+        search_index.add(index_key, text, {**fields, "doc_id": key})
+
+    return listener
+
+
+visit_notes_store.subscribe(_search_indexer("visit_note"))
+keyword_notes_store.subscribe(_search_indexer("keyword_note"))
+material_images_store.subscribe(_search_indexer("material"))
+
+
+# オフライン端末の差分同期用の変更ログ
+change_log = ChangeLog(tombstone_ttl=SYNC_TOMBSTONE_TTL_SECONDS)
+sync_stores: Dict[str, Dict[str, Any]] = {
+    "events": events_store,
+    "booths": booths_store,
+    "target_companies": target_companies_store,
+    "visit_notes": visit_notes_store,
+    "keyword_notes": keyword_notes_store,
+    "material_images": material_images_store,
+    "tasks": tasks_store,
+    "business_cards": business_cards_store,
+}
+
+
+def _record_change(store_name: str, key: str, old: Any, new: Any) -> None:
+    if old is not None and new is not None and old == new:
+        return
+    change_log.record(
+        store_name,
+        key,
+        deleted=new is None,
+        event_ids=record_event_ids(store_name, key, new, old),
+        seq=sync_stores[store_name].last_version,
+    )
+
 
+for _sync_store in sync_stores.values():
+    _sync_store.subscribe(_record_change)
 
-def _touch_event(event: Event) -> Event:
-    return event.model_copy(update={"updated_at": datetime.utcnow()})
 
+# 一覧レスポンス用のJSON断片キャッシュ（書き込みのたびに該当レコードの断片を破棄する）
+for _listed_store in [*sync_stores.values(), event_reports_store]:
+    _listed_store.subscribe(fragment_cache.invalidate)
 
-def _touch_booth(booth: Booth) -> Booth:
-    return booth.model_copy(update={"updated_at": datetime.utcnow()})
+ListView = Literal["full", "compact"]
 
+# view=compact で省く大きな項目（ストア名ごと）
+COMPACT_LIST_EXCLUDES: Dict[str, FrozenSet[str]] = {
+    "events": frozenset({"scraped_data"}),
+    "target_companies": frozenset({"ai_research", "scraped_context"}),
+    "material_images": frozenset({"ocr_text"}),
+    "event_reports": frozenset({"content", "metadata"}),
+}
 
-def _touch_target_company(target: TargetCompany) -> TargetCompany:
-    return target.model_copy(update={"updated_at": datetime.utcnow()})
 
+def _split_fields(value: Optional[str]) -> List[str]:
+    return [name.strip() for name in (value or "").split(",") if name.strip()]
+
+
+class ListFields:
+    """一覧エンドポイント共通の fields / exclude / view パラメータ"""
+
+    def __init__(
+        self,
+        fields: Optional[str] = Query(default=None, description="返す項目（カンマ区切り。IDは常に含む）"),
+        exclude: Optional[str] = Query(default=None, description="省く項目（カンマ区切り）"),
+        view: ListView = Query(
+            default="full",
+            description="compact はAIレポート・スクレイピング結果・OCR全文などの大きな項目を省く",
+        ),
+    ):
+        self.fields = _split_fields(fields)
+        self.exclude = _split_fields(exclude)
+        self.view = view
+
+    def selection(self, store: RecordStore, model: Any, key_field: str) -> FieldSelection:
+        unknown = [name for name in self.fields + self.exclude if name not in model.model_fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"不明な項目です: {', '.join(unknown)}")
+        excluded = set(self.exclude)
+        if self.view == "compact":
+            # fields で明示した項目は compact でも返す
+            excluded |= COMPACT_LIST_EXCLUDES.get(store.name, frozenset()) - set(self.fields)
+        excluded.discard(key_field)
+        include = frozenset(self.fields) | {key_field} if self.fields else None
+        # 表示形式そのままの場合だけ断片をキャッシュする
+        view = self.view if not self.fields and not self.exclude else None
+        return FieldSelection(include, frozenset(excluded), view)
+
+    def response(self, store: RecordStore, records: Any, model: Any, key_field: str) -> JSONBytesResponse:
+        return fragment_cache.list_response(
+            store, records, key_field, self.selection(store, model, key_field)
+        )
 
-def _touch_visit_note(note: VisitNote) -> VisitNote:
-    return note.model_copy(update={"updated_at": datetime.utcnow()})
 
+# 名刺の重複検出インデックス（正規化したメール・電話番号・氏名＋会社名 -> 名刺ID）
+card_duplicate_index = CardDuplicateIndex()
 
-def _touch_material(material: MaterialImage) -> MaterialImage:
-    return material.model_copy(update={"updated_at": datetime.utcnow()})
 
+def _card_keys(card: Any) -> List[Tuple[str, str]]:
+    return card_keys(card.email, card.phone, card.mobile, card.full_name, card.company_name)
 
-def _touch_task(task: Task) -> Task:
-    return task.model_copy(update={"updated_at": datetime.utcnow()})
+
+def _index_card(
+    _store: str, key: str, old: Optional[BusinessCard], new: Optional[BusinessCard]
+) -> None:
+    old_keys = _card_keys(old) if old is not None else []
+    new_keys = _card_keys(new) if new is not None else []
+    if old_keys != new_keys:
+        card_duplicate_index.remove(key, old_keys)
+        card_duplicate_index.add(key, new_keys)
+
+
+business_cards_store.subscribe(_index_card)
+
+
+def _find_duplicate_cards(card: Any, exclude: Optional[str] = None) -> List[CardDuplicateCandidate]:
+    """同一人物とみなせるもの、一致した項目数の多いものから順に返す"""
+    candidates = []
+    for card_id, matched_on in card_duplicate_index.find(_card_keys(card)).items():
+        existing = business_cards_store.get(card_id)
+        if existing is None or card_id == exclude:
+            continue
+        candidates.append(
+            CardDuplicateCandidate(
+                card_id=card_id,
+                full_name=existing.full_name,
+                company_name=existing.company_name,
+                matched_on=matched_on,
+                same_person=is_same_person(matched_on),
+            )
+        )
+    priority = {"email": 0, "mobile": 1, "name_company": 2, "phone": 3}
+    candidates.sort(
+        key=lambda candidate: (
+            not candidate.same_person,
+            -len(candidate.matched_on),
+            min(priority[kind] for kind in candidate.matched_on),
+        )
+    )
+    return candidates
+
+
+# ダッシュボードのインクリメンタルサーチ用の前方一致インデックス
+suggest_index = SuggestIndex()
+
+SuggestEntry = Tuple[str, str, str, Dict[str, Any], Tuple[str, ...], Optional[str]]
+
+
+def _tag_entries(event_id: str, tags: List[str]) -> List[SuggestEntry]:
+    return [
+        (f"tag:{event_id}:{tag}", tag, "tag", {"source": "event", "event_id": event_id}, (), event_id)
+        for tag in dict.fromkeys(tag.strip() for tag in tags)
+        if tag
+    ]
+
+
+def _suggest_entries(source: str, key: str, record: Any) -> List[SuggestEntry]:
+    """レコード1件から (候補ID, 表記, 種別, 付随情報, 読み, scope) の一覧を作る"""
+    if source == "event":
+        return _tag_entries(key, record.highlight_tags)
+    if source == "card":
+        if not record.full_name:
+            return []
+        readings = (record.name_reading,) if record.name_reading else ()
+        return [
+            (f"card:{key}", record.full_name, "person",
+             {"source": "card", "source_id": key, "event_id": record.event_id, "detail": record.company_name},
+             readings, record.event_id),
+        ]
+    payload = {"source": source, "source_id": key, "event_id": record.event_id}
+    entries: List[SuggestEntry] = [
+        (f"{source}:{key}", record.name, "company" if source == "target_company" else "booth",
+         {**payload, "detail": record.booth_code}, (), record.event_id),
+    ]
+    if record.booth_code:
+        entries.append(
+            (f"{source}:{key}:booth_code", record.booth_code, "booth_code",
+             {**payload, "detail": record.name}, (), record.event_id)
+        )
+    for position, person in enumerate(getattr(record, "contact_persons", None) or []):
+        entries.append(
+            (f"{source}:{key}:person:{position}", person, "person",
+             {**payload, "detail": record.name}, (), record.event_id)
+        )
+    return entries + _tag_entries(record.event_id, record.highlight_tags)
+
+
+def _suggest_indexer(source: str):
+    def listener(_store: str, key: str, old: Any, new: Any) -> None:
+        old_entries = _suggest_entries(source, key, old) if old is not None else []
+        new_entries = _suggest_entries(source, key, new) if new is not None else []
+        if old_entries == new_entries:
+            return
+        for entry in old_entries:
+            suggest_index.remove(entry[0])
+        for entry_id, text, kind, payload, readings, scope in new_entries:
+            suggest_index.add(entry_id, text, kind, payload, readings=readings, scope=scope)
+
+    return listener
+
+
+events_store.subscribe(_suggest_indexer("event"))
+target_companies_store.subscribe(_suggest_indexer("target_company"))
+booths_store.subscribe(_suggest_indexer("booth"))
+business_cards_store.subscribe(_suggest_indexer("card"))
+
+
+# 来場ノート本文・事前調査レポート・資料OCRテキストの類似検索用ベクトル（キーは "種別:ID"）
+similarity_index = VectorIndex(filter_fields=("event_id", "doc_type"))
+
+
+def _similarity_document(doc_type: str, key: str, record: Any) -> Tuple[str, Dict[str, Any]]:
+    if doc_type == "visit_note":
+        text = "\n".join(part for part in [record.title, record.content] if part)
+        target_company_id, title = record.target_company_id, record.title
+    elif doc_type == "target_company":
+        text = "\n".join(
+            part for part in [record.ai_research, record.research_summary, record.description] if part
+        )
+        target_company_id, title = key, record.name
+    else:
+        text = "\n".join(part for part in [record.ocr_text, record.ai_summary] if part)
+        target_company_id, title = record.target_company_id, record.caption
+    fields = {
+        "doc_type": doc_type,
+        "doc_id": key,
+        "event_id": record.event_id,
+        "target_company_id": target_company_id,
+        "title": title,
+        "snippet": " ".join(text.split())[:80],
+    }
+    return text, fields
+
+
+def _similarity_indexer(doc_type: str):
+    def listener(_store: str, key: str, old: Any, new: Any) -> None:
+        index_key = f"{doc_type}:{key}"
+        if new is None:
+            similarity_index.remove(index_key)
+            return
+        text, fields = _similarity_document(doc_type, key, new)
+        if old is not None and index_key in similarity_index:
+            old_text, old_fields = _similarity_document(doc_type, key, old)
+            if old_text == text:
+                if old_fields != fields:
+                    similarity_index.add(index_key, similarity_index.vector(index_key), fields)
+                return
+        vector = vectorize(text)
+        if vector is None:
+            similarity_index.remove(index_key)
+        else:
+            similarity_index.add(index_key, vector, fields)
+
+    return listener
+
+
+visit_notes_store.subscribe(_similarity_indexer("visit_note"))
+target_companies_store.subscribe(_similarity_indexer("target_company"))
+material_images_store.subscribe(_similarity_indexer("material"))
+
+
+# PERSIST_DIR を設定した場合はストアをスナップショット＋追記ログで保存し、起動時に復元する
+# （全インデックスの購読を済ませてから作り、復元したレコードも各インデックスに載せる）
+# WEB_CONCURRENCY >= 2 で複数ワーカーを起動する場合は、全ワーカーが同じログを共有してストアを揃える
+if WEB_CONCURRENCY > 1 and not PERSIST_DIR:
+    raise RuntimeError("複数ワーカー（WEB_CONCURRENCY >= 2）で起動するには PERSIST_DIR を設定してください")
+persistence: Optional[StorePersistence] = None
+# スナップショットなど、1ワーカーだけで実行する定期ジョブ
+background_jobs = BackgroundJobs(
+    LeaderLease(os.path.join(PERSIST_DIR, "jobs.lock")) if WEB_CONCURRENCY > 1 else None
+)
+if PERSIST_DIR:
+    persistence = StorePersistence(
+        PERSIST_DIR,
+        {
+            "events": (events_store, Event),
+            "booths": (booths_store, Booth),
+            "target_companies": (target_companies_store, TargetCompany),
+            "uploaded_images": (uploaded_images_store, UploadedImage),
+            "visit_notes": (visit_notes_store, VisitNote),
+            "keyword_notes": (keyword_notes_store, KeywordNote),
+            "material_images": (material_images_store, MaterialImage),
+            "tasks": (tasks_store, Task),
+            "event_reports": (event_reports_store, EventReport),
+            "business_cards": (business_cards_store, BusinessCard),
+            "scrape_history": (scrape_history_store, ScrapeHistory),
+            "idempotency": (idempotency_store.records, IdempotencyRecord),
+        },
+        shared=WEB_CONCURRENCY > 1,
+    )
+    background_jobs.add(
+        "snapshot", PERSIST_SNAPSHOT_INTERVAL_SECONDS, persistence.snapshot, due=persistence.needs_snapshot
+    )
+    if persistence.shared:
+        app.add_middleware(CatchUpMiddleware, catch_up=persistence.catch_up)
+
+
+def _similar_documents(
+    index_key: str, limit: int, event_id: Optional[str], doc_type: Optional[str]
+) -> List[SimilarDocument]:
+    vector = similarity_index.vector(index_key)
+    if vector is None:
+        # 本文が空の文書は比較できない
+        return []
+    hits = similarity_index.top_k(
+        vector,
+        k=limit,
+        filters={"event_id": event_id, "doc_type": doc_type},
+        exclude=index_key,
+    )
+    return [SimilarDocument(**fields, score=score) for _, score, fields in hits]
+
+
+def _scraped_items(event: Event) -> List[Dict[str, Any]]:
+    scraped_data = event.scraped_data or {}
+    items: List[Dict[str, Any]] = []
+    if isinstance(scraped_data, dict):
+        items = scraped_data.get("items") or scraped_data.get("results") or []
+    normalized: List[Dict[str, Any]] = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"text": item}
+        if not isinstance(item, dict):
+            continue
+        if not item.get("fingerprint"):
+            item = {**item, "fingerprint": item_fingerprint(item)}
+        normalized.append(item)
+    return normalized
+
+
+def _etag(store: RecordStore, key: str) -> str:
+    return f'"{store.version(key)}"'
+
+
+def _set_etag(response: Response, store: RecordStore, key: str) -> None:
+    response.headers["ETag"] = _etag(store, key)
+
+
+def _if_match_version(if_match: Optional[str]) -> Optional[int]:
+    """If-Match ヘッダーの ETag をバージョンに変換する（未指定・"*" は None）"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        # 解釈できないタグはどのバージョンにも一致しない
+        return -1
+
+
+def _patch_record(
+    store: RecordStore,
+    key: str,
+    changes: Dict[str, Any],
+    not_found: str,
+    if_match: Optional[str] = None,
+    response: Optional[Response] = None,
+) -> Any:
+    """最新のレコードに changes と updated_at だけを反映する
+
+    await を挟んだ処理の結果を書き戻すときも、間に行われた他の項目の編集を上書きしない。
+    If-Match が現在の ETag と一致しなければ 412、反映後のレコードが検証を通らなければ 422 を返す。
+    """
+    try:
+        updated = store.patch(
+            key, {**changes, "updated_at": datetime.utcnow()}, _if_match_version(if_match)
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail=not_found)
+    except VersionConflict:
+        raise HTTPException(
+            status_code=412,
+            detail="他の端末で更新されています。最新の内容を取得してからやり直してください",
+        )
+    except ValidationError as exc:
+        # 必須項目に null を送った場合など、反映後のレコードとして不正な値は保存せずに 422 を返す
+        raise HTTPException(status_code=422, detail=exc.errors(include_url=False, include_context=False))
+    if response is not None:
+        _set_etag(response, store, key)
+    return updated
 
 
 def _require_event(event_id: str) -> Event:
@@ -587,9 +1636,16 @@ def _require_keyword(keyword_note_id: str) -> KeywordNote:
     return keyword_note
 
 
+def _require_card(card_id: str) -> BusinessCard:
+    card = business_cards_store.get(card_id)
+    if not card:
+        raise HTTPException(status_code=404, detail="名刺が見つかりません")
+    return card
+
+
 async def _generate_pre_research_report(
     event: Event, target: TargetCompany, request: PreResearchRequest
-) -> str:
+) -> Tuple[str, Optional[str]]:
     focus_section = ""
     if request.focus_points:
         focus_section = "\n".join(f"- {point}" for point in request.focus_points)
@@ -603,24 +1659,26 @@ async def _generate_pre_research_report(
             + "\n"
         )
 
+    # 展示会サイトの出展者情報のうち、このターゲットに一致するものだけを渡す
     scraped_section = ""
-    scraped_data = event.scraped_data or {}
-    scraped_items = []
-    if isinstance(scraped_data, dict):
-        scraped_items = scraped_data.get("items") or scraped_data.get("results") or []
+    scraped_items = _scraped_items(event)
     if scraped_items:
+        linked = (target.scraped_context or {}).get("fingerprint")
+        index = CompanyNameIndex()
+        index.add(target.target_company_id, target.name)
         lines = []
-        for item in scraped_items[:10]:
-            if isinstance(item, dict):
-                text = item.get("text") or item.get("title") or ""
-                href = item.get("href") or item.get("url")
-                if text:
-                    if href:
-                        lines.append(f"- {text} ({href})")
-                    else:
-                        lines.append(f"- {text}")
-            elif isinstance(item, str):
-                lines.append(f"- {item}")
+        for item in scraped_items:
+            text = item.get("text") or item.get("title") or ""
+            if not text:
+                continue
+            if item["fingerprint"] != linked and not index.match(
+                text, limit=1, threshold=SCRAPE_MATCH_THRESHOLD
+            ):
+                continue
+            href = item.get("href") or item.get("url")
+            lines.append(f"- {text} ({href})" if href else f"- {text}")
+            if len(lines) >= 10:
+                break
         if lines:
             scraped_section = "\n# 展示会サイトからの候補情報\n" + "\n".join(lines) + "\n"
 
@@ -653,25 +1711,22 @@ async def _generate_pre_research_report(
             )
         if request.keywords:
             fallback.append("- 深掘りキーワード: " + ", ".join(request.keywords))
-        return base_summary + "\n\n" + "\n".join(fallback)
-
-    def _invoke():
-        return gemini_client.models.generate_content(
-            model="gemini-1.5-pro",
-            contents=base_summary,
-            config=types.GenerateContentConfig(temperature=0.4),
-        )
+        return base_summary + "\n\n" + "\n".join(fallback), None
 
-    response = await run_in_threadpool(_invoke)
+    response, model = await _generate_content(
+        "pre_research",
+        base_summary,
+        types.GenerateContentConfig(temperature=0.4),
+    )
     if not response or not getattr(response, "text", None):
         raise HTTPException(status_code=500, detail="AIリサーチの生成に失敗しました")
 
-    return response.text
+    return response.text, model
 
 
 async def _generate_keyword_suggestions(
     keyword_note: KeywordNote, additional_context: Optional[str] = None
-) -> List[str]:
+) -> Tuple[List[str], Optional[str]]:
     context_block = ""
     if keyword_note.context:
         context_block += f"\n# 既存メモ\n{keyword_note.context}\n"
@@ -693,16 +1748,13 @@ async def _generate_keyword_suggestions(
             f"- 既存システムとの連携や技術スタックについて質問する",
             "- 展示会後のフォローアップ資料やデモの提供可否を確認する",
         ]
-        return fallback
+        return fallback, None
 
-    def _invoke():
-        return gemini_client.models.generate_content(
-            model="gemini-1.5-pro",
-            contents=base_prompt,
-            config=types.GenerateContentConfig(temperature=0.5),
-        )
-
-    response = await run_in_threadpool(_invoke)
+    response, model = await _generate_content(
+        "keyword_suggest",
+        base_prompt,
+        types.GenerateContentConfig(temperature=0.5),
+    )
     if not response or not getattr(response, "text", None):
         raise HTTPException(status_code=500, detail="AI提案の生成に失敗しました")
 
@@ -711,7 +1763,7 @@ async def _generate_keyword_suggestions(
         for line in response.text.splitlines()
         if line.strip()
     ]
-    return [line for line in lines if line]
+    return [line for line in lines if line], model
 
 
 async def _run_material_analysis(
@@ -722,6 +1774,7 @@ async def _run_material_analysis(
             "ocr_text": None,
             "ai_summary": None,
             "tags": [],
+            "ai_model": None,
         }
 
     prompt = """あなたは展示会で集めた資料を整理するアシスタントです。
@@ -743,25 +1796,23 @@ async def _run_material_analysis(
         base64_data = image.content_base64
         if "," in base64_data:
             base64_data = base64_data.split(",", 1)[1]
-        image_bytes = base64.b64decode(base64_data)
+        # 大きな画像のデコードでイベントループを塞がないようにスレッドで実行
+        image_bytes = await run_in_threadpool(base64.b64decode, base64_data)
     except Exception as decode_error:
         raise HTTPException(
             status_code=400, detail=f"画像データのデコードに失敗しました: {decode_error}"
         )
 
-    def _invoke():
-        return gemini_client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=[
-                prompt,
-                types.Part.from_bytes(
-                    data=image_bytes, mime_type=image.media_type or "image/jpeg"
-                ),
-            ],
-            config=types.GenerateContentConfig(temperature=0.2),
-        )
-
-    response = await run_in_threadpool(_invoke)
+    response, model = await _generate_content(
+        "material_analysis",
+        [
+            prompt,
+            types.Part.from_bytes(
+                data=image_bytes, mime_type=image.media_type or "image/jpeg"
+            ),
+        ],
+        types.GenerateContentConfig(temperature=0.2),
+    )
     if not response or not getattr(response, "text", None):
         raise HTTPException(status_code=500, detail="資料画像の解析に失敗しました")
 
@@ -785,6 +1836,7 @@ async def _run_material_analysis(
             "ocr_text": result.get("ocr_text"),
             "ai_summary": summary_text,
             "tags": tags_list,
+            "ai_model": model,
         }
     except json.JSONDecodeError:
         # JSONパースに失敗した場合はそのままテキストを返却
@@ -792,6 +1844,7 @@ async def _run_material_analysis(
             "ocr_text": response.text,
             "ai_summary": None,
             "tags": [],
+            "ai_model": model,
         }
 
 
@@ -844,7 +1897,7 @@ def _collect_event_data(event_id: str) -> Dict[str, Any]:
 
 async def _generate_event_report_markdown(
     event: Event, data: Dict[str, Any], request: EventReportRequest
-) -> str:
+) -> Tuple[str, Optional[str]]:
     metrics = data["metrics"]
     targets: List[TargetCompany] = data["targets"]
     notes: List[VisitNote] = data["notes"]
@@ -874,6 +1927,7 @@ async def _generate_event_report_markdown(
                     else ""
                 )
             )
+            for target in targets
         ]
     )
 
@@ -896,6 +1950,7 @@ async def _generate_event_report_markdown(
                 if note.keywords
                 else ""
             )
+            for note in highlighted_notes
         ]
     )
 
@@ -912,6 +1967,7 @@ async def _generate_event_report_markdown(
                 if material.tags
                 else ""
             )
+            for material in materials
         ]
     )
 
@@ -920,6 +1976,7 @@ async def _generate_event_report_markdown(
         [
             f"- {task.title} (ステータス: {task.status}, 期限: {task.due_date or '未設定'})"
             + (f"\n  詳細: {task.description}" if task.description else "")
+            for task in open_tasks
         ]
     )
 
@@ -931,6 +1988,7 @@ async def _generate_event_report_markdown(
                 if keyword.ai_suggestions
                 else ""
             )
+            for keyword in keywords
         ]
     )
 
@@ -998,23 +2056,69 @@ async def _generate_event_report_markdown(
             fallback += "\n### 注目する観点\n" + "\n".join(
                 f"- {point}" for point in request.focus_points
             )
-        return fallback
-
-    def _invoke():
-        return gemini_client.models.generate_content(
-            model="gemini-1.5-pro",
-            contents=context,
-            config=types.GenerateContentConfig(
-                temperature=0.3,
-                top_p=0.8,
-            ),
-        )
-
-    response = await run_in_threadpool(_invoke)
+        return fallback, None
+
+    response, model = await _generate_content(
+        "event_report",
+        context,
+        types.GenerateContentConfig(
+            temperature=0.3,
+            top_p=0.8,
+        ),
+    )
     if not response or not getattr(response, "text", None):
         raise HTTPException(status_code=500, detail="レポート生成に失敗しました")
 
-    return response.text
+    return response.text, model
+
+
+def _store_size_collector():
+    stores = {
+        "events": events_store,
+        "booths": booths_store,
+        "target_companies": target_companies_store,
+        "uploaded_images": uploaded_images_store,
+        "visit_notes": visit_notes_store,
+        "keyword_notes": keyword_notes_store,
+        "material_images": material_images_store,
+        "tasks": tasks_store,
+        "event_reports": event_reports_store,
+        "business_cards": business_cards_store,
+    }
+    yield (
+        "salon_store_records",
+        "gauge",
+        "インメモリーストアの件数",
+        [({"store": name}, len(store)) for name, store in stores.items()],
+    )
+
+
+def _threadpool_collector():
+    # /metricsハンドラ（イベントループ上）から呼ばれる前提
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    yield (
+        "salon_threadpool_borrowed_tokens",
+        "gauge",
+        "スレッドプールで実行中のタスク数",
+        [({}, statistics.borrowed_tokens)],
+    )
+    yield (
+        "salon_threadpool_total_tokens",
+        "gauge",
+        "スレッドプールの上限数",
+        [({}, statistics.total_tokens)],
+    )
+    yield (
+        "salon_threadpool_waiting_tasks",
+        "gauge",
+        "スレッドプールの空き待ちタスク数",
+        [({}, statistics.tasks_waiting)],
+    )
+
+
+REGISTRY.register_collector(_store_size_collector)
+REGISTRY.register_collector(_threadpool_collector)
 
 
 @app.get("/")
@@ -1029,6 +2133,341 @@ async def root():
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.post("/admin/profile", dependencies=[Depends(_require_admin)])
+async def profile_process(
+    seconds: float = Query(default=10.0, gt=0, le=MAX_PROFILE_SECONDS),
+    interval: float = Query(default=0.005, gt=0, le=1.0),
+    threads: Literal["all", "loop", "workers"] = "all",
+    include_idle: bool = False,
+):
+    """プロセス全体のスタックを指定秒数サンプリングし、collapsed形式で返す"""
+    if not whole_process_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="別のプロファイルを実行中です")
+    try:
+        loop_thread_id = threading.get_ident()
+        thread_ids = None
+        if threads == "loop":
+            thread_ids = {loop_thread_id}
+        elif threads == "workers":
+            thread_ids = {
+                thread.ident
+                for thread in threading.enumerate()
+                if thread.ident != loop_thread_id
+            }
+        profiler = SamplingProfiler(
+            interval=interval, thread_ids=thread_ids, include_idle=include_idle
+        ).start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+    finally:
+        whole_process_lock.release()
+
+    filename = f"profile-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.folded"
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Profile-Samples": str(profiler.sample_count),
+        },
+    )
+
+
+@app.get("/admin/loop", dependencies=[Depends(_require_admin)])
+async def get_loop_stats():
+    """イベントループ遅延の統計と直近のブロッキング検知結果"""
+    return {
+        "enabled": LOOP_MONITOR_ENABLED,
+        **loop_monitor.stats(),
+        "recent_blocking": list(loop_monitor.blocking_events),
+    }
+
+
+@app.get("/admin/profiles", dependencies=[Depends(_require_admin)])
+async def list_request_profiles():
+    return profile_results.list()
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(_require_admin)])
+async def get_request_profile(profile_id: str):
+    result = profile_results.get(profile_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="プロファイル結果が見つかりません")
+    return PlainTextResponse(
+        result["collapsed"],
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'},
+    )
+
+
+@app.get("/search", response_model=SearchResponse)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    event_id: Optional[str] = None,
+    target_company_id: Optional[str] = None,
+    doc_type: Optional[SearchDocType] = Query(default=None, alias="type"),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+):
+    """来場ノート・キーワードメモ・資料のOCRテキストを横断検索する（全語を含むものをBM25順）"""
+    page = search_index.search(
+        q,
+        filters={"event_id": event_id, "target_company_id": target_company_id, "doc_type": doc_type},
+        limit=limit,
+        offset=offset,
+    )
+    return SearchResponse(
+        query=q,
+        total=page.total,
+        offset=offset,
+        limit=limit,
+        hits=[
+            SearchHitResponse(
+                **hit.fields,
+                snippet=hit.snippet,
+                highlights=[list(span) for span in hit.highlights],
+                score=hit.score,
+            )
+            for hit in page.hits
+        ],
+    )
+
+
+@app.get("/search/suggest", response_model=List[SuggestItem])
+async def search_suggest(
+    q: str = Query(..., min_length=1, max_length=100),
+    event_id: Optional[str] = None,
+    kind: Optional[List[SuggestKind]] = Query(default=None),
+    limit: int = Query(default=8, ge=1, le=30),
+):
+    """入力途中の文字列に前方一致する企業名・人名・ブース番号・タグを返す（かな/ローマ字対応）"""
+    return [
+        SuggestItem(text=entry.text, kind=entry.kind, **entry.payload)
+        for entry in suggest_index.suggest(q, limit=limit, kinds=kind, scope=event_id)
+    ]
+
+
+@app.get("/sync", response_model=SyncResponse)
+async def sync_changes(
+    since: int = Query(default=0, ge=0),
+    event_id: Optional[str] = None,
+    limit: int = Query(default=500, ge=1, le=5000),
+):
+    """since 以降に作成・更新・削除されたレコードを古い順に返す（初回は since=0 で全件）"""
+    reset = since > change_log.seq or change_log.needs_reset(since)
+    start = 0 if reset else since
+    changes: List[SyncChange] = []
+    has_more = False
+    next_since = start
+    for entry in change_log.since(start, event_id):
+        if len(changes) >= limit:
+            has_more = True
+            break
+        record = None if entry.deleted else sync_stores[entry.entity].get(entry.key)
+        changes.append(
+            SyncChange(
+                seq=entry.seq,
+                entity=entry.entity,
+                id=entry.key,
+                op="delete" if record is None else "upsert",
+                data=None if record is None else record.model_dump(mode="json", exclude_none=True),
+            )
+        )
+        next_since = entry.seq
+    if not has_more:
+        # 絞り込みで対象外だった変更も含め、ここまでは確認済み
+        next_since = change_log.seq
+    return SyncResponse(
+        since=since, next_since=next_since, reset=reset, has_more=has_more, changes=changes
+    )
+
+
+# バッチで扱うエンティティごとの (作成モデル, 更新モデル, レコードモデル, IDフィールド, 見つからない時のメッセージ)
+_BATCH_ENTITIES: Dict[str, Tuple[Any, Any, Any, str, str]] = {
+    "visit_notes": (VisitNoteBase, VisitNoteUpdate, VisitNote, "visit_note_id", "来場ノートが見つかりません"),
+    "keyword_notes": (KeywordNoteBase, KeywordNoteUpdate, KeywordNote, "keyword_note_id", "キーワードメモが見つかりません"),
+    "tasks": (TaskCreate, TaskUpdate, Task, "task_id", "タスクが見つかりません"),
+    # 一括登録では時間のかかる auto_ocr は受け付けない
+    "material_images": (MaterialImageBase, MaterialImageUpdate, MaterialImage, "material_id", "資料画像が見つかりません"),
+    "target_companies": (TargetCompanyCreate, TargetCompanyUpdate, TargetCompany, "target_company_id", "ターゲット企業が見つかりません"),
+}
+# 参照項目 -> (参照先ストア名, 見つからない時のメッセージ)
+_BATCH_REFERENCES: Dict[str, Tuple[str, str]] = {
+    "event_id": ("events", "イベントが見つかりません"),
+    "target_company_id": ("target_companies", "ターゲット企業が見つかりません"),
+    "visit_note_id": ("visit_notes", "来場ノートが見つかりません"),
+    "image_id": ("uploaded_images", "紐づく画像が見つかりません"),
+    "image_ids": ("uploaded_images", "添付画像が見つかりません"),
+}
+
+
+class _BatchSession:
+    """バッチ内の書き込みを溜めておき、最後にまとめてストアへ反映する
+
+    参照の検証は溜めた書き込み→ストアの順に見るため、同じバッチで作成したレコードも参照できる。
+    ストアの検索結果はバッチ内でキャッシュする。
+    """
+
+    def __init__(self):
+        self.stores: Dict[str, Dict[str, Any]] = {
+            **sync_stores, "uploaded_images": uploaded_images_store
+        }
+        self.id_map: Dict[str, str] = {}
+        self.writes: List[Tuple[str, str, Any]] = []
+        self._staged: Dict[Tuple[str, str], Any] = {}
+        self._cache: Dict[Tuple[str, str], Any] = {}
+
+    def resolve(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self.id_map.get(item, item) if isinstance(item, str) else item for item in value]
+        return self.id_map.get(value, value) if isinstance(value, str) else value
+
+    def get(self, entity: str, key: str) -> Any:
+        if (entity, key) in self._staged:
+            return self._staged[(entity, key)]
+        if (entity, key) not in self._cache:
+            self._cache[(entity, key)] = self.stores[entity].get(key)
+        return self._cache[(entity, key)]
+
+    def require(self, entity: str, key: str, detail: str) -> Any:
+        record = self.get(entity, key)
+        if record is None:
+            raise HTTPException(status_code=404, detail=f"{detail}: {key}")
+        return record
+
+    def check_references(self, data: Dict[str, Any]) -> None:
+        for field_name, (entity, detail) in _BATCH_REFERENCES.items():
+            value = data.get(field_name)
+            for key in value if isinstance(value, list) else [value]:
+                if key:
+                    self.require(entity, key, detail)
+
+    def stage(self, entity: str, key: str, record: Any) -> None:
+        self._staged[(entity, key)] = record
+        self.writes.append((entity, key, record))
+
+    def commit(self) -> None:
+        # 永続化のログでも1件にまとめ、異常終了後の再生や他のワーカーで途中までの状態にならないようにする
+        with write_group():
+            for entity, key, record in self.writes:
+                store = self.stores[entity]
+                if record is None:
+                    store.pop(key, None)
+                else:
+                    store[key] = record
+
+
+def _apply_batch_operation(session: _BatchSession, operation: BatchOperation) -> Tuple[int, str, Any]:
+    """1件の操作を検証して溜め、(ステータス, ID, レコード) を返す"""
+    create_model, update_model, record_model, id_field, not_found = _BATCH_ENTITIES[operation.entity]
+    data = {
+        key: session.resolve(value) if key in _BATCH_REFERENCES else value
+        for key, value in operation.data.items()
+    }
+
+    if operation.op == "create":
+        if operation.temp_id and operation.temp_id in session.id_map:
+            raise HTTPException(status_code=400, detail=f"temp_id が重複しています: {operation.temp_id}")
+        payload = create_model.model_validate(data)
+        fields = payload.model_dump()
+        session.check_references(fields)
+        now = datetime.utcnow()
+        record = record_model(**{id_field: str(uuid4())}, created_at=now, updated_at=now, **fields)
+        record_id = getattr(record, id_field)
+        if operation.temp_id:
+            session.id_map[operation.temp_id] = record_id
+        session.stage(operation.entity, record_id, record)
+        return 201, record_id, record
+
+    if not operation.id:
+        raise HTTPException(status_code=400, detail="update/delete には id が必要です")
+    record_id = session.resolve(operation.id)
+    current = session.require(operation.entity, record_id, not_found)
+    if operation.if_match is not None:
+        expected = _if_match_version(operation.if_match)
+        if expected is not None and session.stores[operation.entity].version(record_id) != expected:
+            raise HTTPException(
+                status_code=412,
+                detail=f"他の端末で更新されています: {record_id}",
+            )
+    if operation.op == "delete":
+        if operation.entity == "target_companies":
+            # 関連レコードの参照の付け替えが必要なため、個別の DELETE を使う
+            raise HTTPException(status_code=400, detail="ターゲット企業の削除はバッチでは行えません")
+        session.stage(operation.entity, record_id, None)
+        return 204, record_id, None
+
+    update_data = update_model.model_validate(data).model_dump(exclude_unset=True)
+    for list_field in ("highlight_tags", "image_ids", "keywords", "tags"):
+        if list_field in update_data and update_data[list_field] is None:
+            update_data[list_field] = []
+    session.check_references(update_data)
+    record = current.model_copy(update={**update_data, "updated_at": datetime.utcnow()})
+    session.stage(operation.entity, record_id, record)
+    return 200, record_id, record
+
+
+@app.post("/batch", response_model=BatchResponse)
+async def apply_batch(request: BatchRequest):
+    """オフライン中に溜めた作成・更新・削除を順番に適用する
+
+    後続の操作は先行する create の temp_id を id や参照項目（event_id, target_company_id,
+    visit_note_id, image_id, image_ids）に使える。書き込みは全操作の検証後にまとめて反映する。
+    """
+    # 検証から反映までの間に、他のワーカープロセスの書き込みが割り込まないようにする
+    with write_lock():
+        session = _BatchSession()
+        results: List[BatchOperationResult] = []
+        failed = False
+        for index, operation in enumerate(request.operations):
+            try:
+                status, record_id, record = _apply_batch_operation(session, operation)
+            except HTTPException as exc:
+                failed = True
+                results.append(
+                    BatchOperationResult(index=index, status=exc.status_code, temp_id=operation.temp_id, error=exc.detail)
+                )
+                continue
+            except ValidationError as exc:
+                failed = True
+                results.append(
+                    BatchOperationResult(
+                        index=index,
+                        status=422,
+                        temp_id=operation.temp_id,
+                        error=exc.errors(include_url=False, include_context=False),
+                    )
+                )
+                continue
+            results.append(
+                BatchOperationResult(
+                    index=index,
+                    status=status,
+                    id=record_id,
+                    temp_id=operation.temp_id,
+                    data=record.model_dump(mode="json") if record is not None else None,
+                )
+            )
+
+        if failed and request.atomic:
+            for result in results:
+                if result.status < 400:
+                    result.status = 424
+                    result.error = "他の操作が失敗したため適用されませんでした"
+                    result.data = None
+            return BatchResponse(committed=False, results=results)
+
+        session.commit()
+        return BatchResponse(committed=True, id_map=session.id_map, results=results)
+
+
 @app.post("/events", response_model=Event, status_code=201)
 async def create_event(payload: EventCreate):
     now = datetime.utcnow()
@@ -1046,31 +2485,32 @@ async def create_event(payload: EventCreate):
 
 
 @app.get("/events", response_model=List[Event])
-async def list_events():
-    return list(events_store.values())
+async def list_events(listing: ListFields = Depends()):
+    return listing.response(events_store, events_store.values(), Event, "event_id")
 
 
 @app.get("/events/{event_id}", response_model=Event)
-async def get_event(event_id: str):
+async def get_event(event_id: str, response: Response):
     event = events_store.get(event_id)
     if not event:
         raise HTTPException(status_code=404, detail="イベントが見つかりません")
+    _set_etag(response, events_store, event_id)
     return event
 
 
 @app.put("/events/{event_id}", response_model=Event)
-async def update_event(event_id: str, payload: EventUpdate):
-    current = events_store.get(event_id)
-    if not current:
-        raise HTTPException(status_code=404, detail="イベントが見つかりません")
-
+async def update_event(
+    event_id: str,
+    payload: EventUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+):
     update_data = payload.model_dump(exclude_unset=True)
     if "highlight_tags" in update_data and update_data["highlight_tags"] is None:
         update_data["highlight_tags"] = []
-    updated = current.model_copy(update=update_data)
-    updated = updated.model_copy(update={"updated_at": datetime.utcnow()})
-    events_store[event_id] = updated
-    return updated
+    return _patch_record(
+        events_store, event_id, update_data, "イベントが見つかりません", if_match, response
+    )
 
 
 @app.post("/events/{event_id}/scrape", response_model=Event)
@@ -1079,55 +2519,185 @@ async def scrape_event(event_id: str, payload: ScrapeRequest):
 
     selectors = payload.selectors or ["a.exhibitor", "li", "a"]
     items: List[Dict[str, Any]] = []
+    pages: List[Dict[str, Any]] = []
     notes: Optional[str] = None
+    source_url = payload.source_url or event.event_website_url
 
     if payload.source_html:
-        soup = BeautifulSoup(payload.source_html, "html.parser")
-        seen_texts = set()
-        for selector in selectors:
-            for element in soup.select(selector):
-                text = element.get_text(strip=True)
-                if not text:
-                    continue
-                key = (selector, text)
-                if key in seen_texts:
-                    continue
-                seen_texts.add(key)
-                entry: Dict[str, Any] = {
-                    "text": text,
-                    "selector": selector,
-                }
-                if payload.include_links:
-                    href = element.get("href")
-                    if href:
-                        entry["href"] = href
-                items.append(entry)
-                if len(items) >= payload.limit:
-                    break
-            if len(items) >= payload.limit:
-                break
+        try:
+            items = await parse_scrape_items(
+                payload.source_html,
+                selectors,
+                payload.limit,
+                include_links=payload.include_links,
+                parser=payload.parser,
+            )
+        except SelectorSyntaxError as exc:
+            raise HTTPException(status_code=400, detail=f"CSSセレクタが不正です: {exc}")
         if not items:
             notes = "指定されたセレクタでは情報を抽出できませんでした。セレクタを調整してください。"
+    elif source_url and source_url.startswith(("http://", "https://")):
+        try:
+            crawl = await crawler.crawl(
+                source_url,
+                selectors,
+                payload.limit,
+                include_links=payload.include_links,
+                parser=payload.parser,
+                follow_pagination=payload.follow_pagination,
+                max_pages=payload.max_pages,
+                next_selectors=payload.next_selectors,
+            )
+        except SelectorSyntaxError as exc:
+            raise HTTPException(status_code=400, detail=f"CSSセレクタが不正です: {exc}")
+        items = crawl.items
+        pages = crawl.pages
+        if crawl.notes:
+            notes = " ".join(crawl.notes)
+        elif not items:
+            notes = "指定されたセレクタでは情報を抽出できませんでした。セレクタを調整してください。"
     else:
-        notes = "source_htmlが提供されなかったため、サーバー側での取得はスキップされました。HTMLを渡すか、外部ジョブでスクレイピングした結果を登録してください。"
+        notes = "source_htmlとURLのいずれも指定されていないため、取得をスキップしました。HTMLを渡すか、公式サイトURLを登録してください。"
+
+    parsed_at = datetime.utcnow()
+    history = scrape_history_store.get(event_id) or ScrapeHistory()
+    changes = None
+    # 取得に失敗して0件になった場合に全件削除として記録しないよう、結果がある場合のみ版を進める
+    if items:
+        # 他のワーカーが同じイベントの版を進めていても取りこぼさないよう、最新の履歴に重ねて保存する
+        with write_lock():
+            current = scrape_history_store.get(event_id)
+            history = (
+                current.model_copy(update={"versions": list(current.versions)})
+                if current is not None
+                else ScrapeHistory()
+            )
+            new_version = history.apply(items, parsed_at, source_url)
+            scrape_history_store[event_id] = history
+        if new_version:
+            changes = {
+                "added": len(new_version.added),
+                "removed": len(new_version.removed),
+                "changed": len(new_version.changed),
+            }
+        else:
+            changes = {"added": 0, "removed": 0, "changed": 0}
 
     scrape_result = ScrapeResult(
-        parsed_at=datetime.utcnow(),
+        parsed_at=parsed_at,
         selectors=selectors,
         items=items,
-        source_url=payload.source_url or event.event_website_url,
+        source_url=source_url,
         notes=notes,
+        pages=pages,
+        version=history.version,
+        changes=changes,
     )
 
-    updated_event = event.model_copy(
-        update={
-            "event_website_url": payload.source_url or event.event_website_url,
-            "scraped_data": scrape_result.model_dump(mode="json"),
-            "updated_at": datetime.utcnow(),
-        }
-    )
-    events_store[event_id] = updated_event
-    return updated_event
+    # クロール中（await）に行われた他の項目の編集を上書きしないよう、最新のレコードに結果だけを反映する
+    update_data: Dict[str, Any] = {"scraped_data": scrape_result.model_dump(mode="json")}
+    if payload.source_url:
+        update_data["event_website_url"] = payload.source_url
+    return _patch_record(events_store, event_id, update_data, "イベントが見つかりません")
+
+
+@app.get("/events/{event_id}/scrape/changes", response_model=ScrapeChangesResponse)
+async def get_scrape_changes(event_id: str, since: int = Query(default=0, ge=0)):
+    _require_event(event_id)
+    history = scrape_history_store.get(event_id) or ScrapeHistory()
+    return ScrapeChangesResponse(event_id=event_id, **history.changes_since(since))
+
+
+def _select_scraped_items(
+    event: Event, fingerprints: Optional[List[str]]
+) -> List[Dict[str, Any]]:
+    items = _scraped_items(event)
+    if fingerprints is None:
+        return items
+    requested = set(fingerprints)
+    items = [item for item in items if item["fingerprint"] in requested]
+    missing = requested - {item["fingerprint"] for item in items}
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail=f"指定したスクレイピング項目が見つかりません: {', '.join(sorted(missing))}",
+        )
+    return items
+
+
+def _match_candidates(
+    index: CompanyNameIndex, name: str, limit: int, threshold: float
+) -> List[TargetMatchCandidate]:
+    candidates = []
+    for target_company_id, score in index.match(name, limit=limit, threshold=threshold):
+        target = target_companies_store.get(target_company_id)
+        if target:
+            candidates.append(
+                TargetMatchCandidate(
+                    target_company_id=target_company_id, name=target.name, score=score
+                )
+            )
+    return candidates
+
+
+@app.post("/events/{event_id}/scrape/match", response_model=List[ScrapedItemMatch])
+async def match_scraped_items(event_id: str, request: ScrapeMatchRequest = ScrapeMatchRequest()):
+    """スクレイピングした出展者とイベント配下のターゲット企業を一括照合する"""
+    event = _require_event(event_id)
+    items = _select_scraped_items(event, request.fingerprints)
+    index = target_name_indexes.get(event_id) or CompanyNameIndex()
+    return [
+        ScrapedItemMatch(
+            item=item,
+            matches=_match_candidates(
+                index, str(item.get("text") or ""), request.limit_per_item, request.threshold
+            ),
+        )
+        for item in items
+    ]
+
+
+@app.post(
+    "/events/{event_id}/target-companies/from-scraped",
+    response_model=CreateTargetsFromScrapedResponse,
+    status_code=201,
+)
+async def create_targets_from_scraped(event_id: str, request: CreateTargetsFromScrapedRequest):
+    """スクレイピングした出展者のうち、既存企業と一致しないものをターゲット企業として一括登録する"""
+    event = _require_event(event_id)
+    items = _select_scraped_items(event, request.fingerprints)
+    index = target_name_indexes.setdefault(event_id, CompanyNameIndex())
+
+    created: List[TargetCompany] = []
+    skipped: List[ScrapedItemMatch] = []
+    for item in items:
+        name = str(item.get("text") or "").strip()
+        if not name:
+            continue
+        # 同じ一覧内の重複も、登録済みになった時点でインデックスに入るため検出される
+        matches = _match_candidates(index, name, 1, request.match_threshold)
+        if matches:
+            skipped.append(ScrapedItemMatch(item=item, matches=matches))
+            continue
+        now = datetime.utcnow()
+        target = TargetCompany(
+            target_company_id=str(uuid4()),
+            event_id=event_id,
+            name=name,
+            priority=request.priority,
+            highlight_tags=list(request.highlight_tags),
+            scraped_context={
+                "fingerprint": item["fingerprint"],
+                "text": name,
+                "href": item.get("href"),
+                "selector": item.get("selector"),
+            },
+            created_at=now,
+            updated_at=now,
+        )
+        target_companies_store[target.target_company_id] = target
+        created.append(target)
+    return CreateTargetsFromScrapedResponse(created=created, skipped=skipped)
 
 
 @app.post("/booths", response_model=Booth, status_code=201)
@@ -1148,26 +2718,32 @@ async def create_booth(payload: BoothCreate):
 
 
 @app.get("/booths", response_model=List[Booth])
-async def list_booths(event_id: Optional[str] = None):
+async def list_booths(event_id: Optional[str] = None, listing: ListFields = Depends()):
     if event_id:
         if event_id not in events_store:
             raise HTTPException(status_code=404, detail="イベントが見つかりません")
-        return [booth for booth in booths_store.values() if booth.event_id == event_id]
-    return list(booths_store.values())
+        booths = [booth for booth in booths_store.values() if booth.event_id == event_id]
+        return listing.response(booths_store, booths, Booth, "booth_id")
+    return listing.response(booths_store, booths_store.values(), Booth, "booth_id")
 
 
 @app.get("/booths/{booth_id}", response_model=Booth)
-async def get_booth(booth_id: str):
+async def get_booth(booth_id: str, response: Response):
     booth = booths_store.get(booth_id)
     if not booth:
         raise HTTPException(status_code=404, detail="ブースが見つかりません")
+    _set_etag(response, booths_store, booth_id)
     return booth
 
 
 @app.put("/booths/{booth_id}", response_model=Booth)
-async def update_booth(booth_id: str, payload: BoothUpdate):
-    current = booths_store.get(booth_id)
-    if not current:
+async def update_booth(
+    booth_id: str,
+    payload: BoothUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+):
+    if booth_id not in booths_store:
         raise HTTPException(status_code=404, detail="ブースが見つかりません")
 
     update_data = payload.model_dump(exclude_unset=True)
@@ -1178,17 +2754,17 @@ async def update_booth(booth_id: str, payload: BoothUpdate):
         if new_event_id and new_event_id not in events_store:
             raise HTTPException(status_code=404, detail="紐づくイベントが見つかりません")
 
-    updated = current.model_copy(update=update_data)
-    updated = updated.model_copy(update={"updated_at": datetime.utcnow()})
-    booths_store[booth_id] = updated
-    return updated
+    return _patch_record(
+        booths_store, booth_id, update_data, "ブースが見つかりません", if_match, response
+    )
 
 
 @app.get("/events/{event_id}/booths", response_model=List[Booth])
-async def list_booths_for_event(event_id: str):
+async def list_booths_for_event(event_id: str, listing: ListFields = Depends()):
     if event_id not in events_store:
         raise HTTPException(status_code=404, detail="イベントが見つかりません")
-    return [booth for booth in booths_store.values() if booth.event_id == event_id]
+    booths = [booth for booth in booths_store.values() if booth.event_id == event_id]
+    return listing.response(booths_store, booths, Booth, "booth_id")
 
 
 @app.post("/upload/image", response_model=UploadImageResponse, status_code=201)
@@ -1247,6 +2823,7 @@ async def list_visit_notes(
     note_type: Optional[NoteType] = None,
     highlight_only: bool = False,
     target_company_id: Optional[str] = None,
+    listing: ListFields = Depends(),
 ):
     _require_event(event_id)
     notes = [
@@ -1259,17 +2836,39 @@ async def list_visit_notes(
     if target_company_id:
         notes = [note for note in notes if note.target_company_id == target_company_id]
     notes.sort(key=lambda note: note.created_at, reverse=True)
-    return notes
+    return listing.response(visit_notes_store, notes, VisitNote, "visit_note_id")
 
 
 @app.get("/visit-notes/{visit_note_id}", response_model=VisitNote)
-async def get_visit_note(visit_note_id: str):
-    return _require_visit_note(visit_note_id)
+async def get_visit_note(visit_note_id: str, response: Response):
+    record = _require_visit_note(visit_note_id)
+    _set_etag(response, visit_notes_store, visit_note_id)
+    return record
+
+
+@app.get("/visit-notes/{visit_note_id}/similar", response_model=List[SimilarDocument])
+async def get_similar_to_visit_note(
+    visit_note_id: str,
+    limit: int = Query(default=10, ge=1, le=50),
+    event_id: Optional[str] = None,
+    doc_type: Optional[SimilarDocType] = Query(default=None, alias="type"),
+):
+    """内容の近い過去のノート・ターゲット企業・資料を返す（既定は全イベント横断）"""
+    _require_visit_note(visit_note_id)
+    # 件数が多いと行列積に数十msかかるため、イベントループを塞がないようスレッドで実行する
+    return await run_in_threadpool(
+        _similar_documents, f"visit_note:{visit_note_id}", limit, event_id, doc_type
+    )
 
 
 @app.put("/visit-notes/{visit_note_id}", response_model=VisitNote)
-async def update_visit_note(visit_note_id: str, payload: VisitNoteUpdate):
-    note = _require_visit_note(visit_note_id)
+async def update_visit_note(
+    visit_note_id: str,
+    payload: VisitNoteUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+):
+    _require_visit_note(visit_note_id)
     update_data = payload.model_dump(exclude_unset=True)
 
     if "event_id" in update_data and update_data["event_id"]:
@@ -1283,10 +2882,9 @@ async def update_visit_note(visit_note_id: str, payload: VisitNoteUpdate):
                     status_code=404, detail=f"添付画像が見つかりません: {image_id}"
                 )
 
-    updated = note.model_copy(update=update_data)
-    updated = _touch_visit_note(updated)
-    visit_notes_store[visit_note_id] = updated
-    return updated
+    return _patch_record(
+        visit_notes_store, visit_note_id, update_data, "来場ノートが見つかりません", if_match, response
+    )
 
 
 @app.delete("/visit-notes/{visit_note_id}", status_code=204)
@@ -1318,7 +2916,9 @@ async def create_keyword_note(event_id: str, payload: KeywordNoteBase):
 
 @app.get("/events/{event_id}/keywords", response_model=List[KeywordNote])
 async def list_keyword_notes(
-    event_id: str, status: Optional[Literal["open", "resolved"]] = None
+    event_id: str,
+    status: Optional[Literal["open", "resolved"]] = None,
+    listing: ListFields = Depends(),
 ):
     _require_event(event_id)
     notes = [
@@ -1327,27 +2927,34 @@ async def list_keyword_notes(
     if status:
         notes = [note for note in notes if note.status == status]
     notes.sort(key=lambda note: note.created_at, reverse=True)
-    return notes
+    return listing.response(keyword_notes_store, notes, KeywordNote, "keyword_note_id")
 
 
 @app.get("/keywords/{keyword_note_id}", response_model=KeywordNote)
-async def get_keyword_note(keyword_note_id: str):
-    return _require_keyword(keyword_note_id)
+async def get_keyword_note(keyword_note_id: str, response: Response):
+    record = _require_keyword(keyword_note_id)
+    _set_etag(response, keyword_notes_store, keyword_note_id)
+    return record
 
 
 @app.put("/keywords/{keyword_note_id}", response_model=KeywordNote)
-async def update_keyword_note(keyword_note_id: str, payload: KeywordNoteUpdate):
-    keyword_note = _require_keyword(keyword_note_id)
+async def update_keyword_note(
+    keyword_note_id: str,
+    payload: KeywordNoteUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+):
+    _require_keyword(keyword_note_id)
     update_data = payload.model_dump(exclude_unset=True)
     if "event_id" in update_data and update_data["event_id"]:
         _require_event(update_data["event_id"])
     if "target_company_id" in update_data and update_data["target_company_id"]:
         _require_target_company(update_data["target_company_id"])
 
-    updated = keyword_note.model_copy(update=update_data)
-    updated = updated.model_copy(update={"updated_at": datetime.utcnow()})
-    keyword_notes_store[keyword_note_id] = updated
-    return updated
+    return _patch_record(
+        keyword_notes_store, keyword_note_id, update_data, "キーワードメモが見つかりません",
+        if_match, response,
+    )
 
 
 @app.delete("/keywords/{keyword_note_id}", status_code=204)
@@ -1361,30 +2968,41 @@ async def delete_keyword_note(keyword_note_id: str):
 @app.post(
     "/keywords/{keyword_note_id}/suggest",
     response_model=KeywordSuggestionResponse,
+    dependencies=[Depends(_rate_limit("ai")), Depends(_ai_latency_budget)],
 )
 async def suggest_for_keyword(
     keyword_note_id: str, payload: KeywordSuggestionRequest = KeywordSuggestionRequest()
 ):
     keyword_note = _require_keyword(keyword_note_id)
-    suggestions = await _generate_keyword_suggestions(
-        keyword_note, payload.additional_context
-    )
-    updated = keyword_note.model_copy(
-        update={
-            "ai_suggestions": suggestions,
-            "updated_at": datetime.utcnow(),
-        }
+
+    async def generate() -> Tuple[List[str], Optional[str]]:
+        suggestions, model = await _generate_keyword_suggestions(
+            keyword_note, payload.additional_context
+        )
+        _patch_record(
+            keyword_notes_store, keyword_note_id,
+            {"ai_suggestions": suggestions, "ai_suggestions_model": model},
+            "キーワードメモが見つかりません",
+        )
+        return suggestions, model
+
+    # 同じメモ・同じ条件の提案が生成中なら、その結果を共有する
+    suggestions, model = await single_flight.run(
+        "keyword_suggest",
+        keyword_note_id,
+        {"keyword": keyword_note.keyword, "additional_context": payload.additional_context},
+        generate,
     )
-    keyword_notes_store[keyword_note_id] = updated
-    return KeywordSuggestionResponse(suggestions=suggestions)
+    return KeywordSuggestionResponse(suggestions=suggestions, ai_model=model)
 
 
 @app.post(
     "/events/{event_id}/materials",
     response_model=MaterialImage,
     status_code=201,
+    dependencies=[Depends(_ai_latency_budget)],
 )
-async def create_material_image(event_id: str, payload: MaterialImageCreate):
+async def create_material_image(event_id: str, payload: MaterialImageCreate, request: Request):
     _require_event(event_id)
     if payload.target_company_id:
         _require_target_company(payload.target_company_id)
@@ -1401,6 +3019,7 @@ async def create_material_image(event_id: str, payload: MaterialImageCreate):
     data["event_id"] = event_id
 
     if auto_ocr:
+        _check_rate_limit(request, "ai")
         analysis = await _run_material_analysis(uploaded_image, prompt_hint)
         if analysis.get("ocr_text") and not data.get("ocr_text"):
             data["ocr_text"] = analysis.get("ocr_text")
@@ -1408,6 +3027,8 @@ async def create_material_image(event_id: str, payload: MaterialImageCreate):
             data["ai_summary"] = analysis.get("ai_summary")
         if analysis.get("tags") and not data.get("tags"):
             data["tags"] = analysis.get("tags")
+        if analysis.get("ai_model"):
+            data["ai_model"] = analysis.get("ai_model")
 
     now = datetime.utcnow()
     material = MaterialImage(
@@ -1421,7 +3042,9 @@ async def create_material_image(event_id: str, payload: MaterialImageCreate):
 
 
 @app.get("/events/{event_id}/materials", response_model=List[MaterialImage])
-async def list_material_images(event_id: str, target_company_id: Optional[str] = None):
+async def list_material_images(
+    event_id: str, target_company_id: Optional[str] = None, listing: ListFields = Depends()
+):
     _require_event(event_id)
     materials = [
         material
@@ -1435,29 +3058,33 @@ async def list_material_images(event_id: str, target_company_id: Optional[str] =
             if material.target_company_id == target_company_id
         ]
     materials.sort(key=lambda material: material.created_at, reverse=True)
-    return materials
+    return listing.response(material_images_store, materials, MaterialImage, "material_id")
 
 
 @app.get("/materials/{material_id}", response_model=MaterialImage)
-async def get_material_image(material_id: str):
-    return _require_material(material_id)
+async def get_material_image(material_id: str, response: Response):
+    record = _require_material(material_id)
+    _set_etag(response, material_images_store, material_id)
+    return record
 
 
 @app.put("/materials/{material_id}", response_model=MaterialImage)
 async def update_material_image(
-    material_id: str, payload: MaterialImageUpdate
+    material_id: str,
+    payload: MaterialImageUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
 ):
-    material = _require_material(material_id)
+    _require_material(material_id)
     update_data = payload.model_dump(exclude_unset=True)
     if "target_company_id" in update_data and update_data["target_company_id"]:
         _require_target_company(update_data["target_company_id"])
     if "visit_note_id" in update_data and update_data["visit_note_id"]:
         _require_visit_note(update_data["visit_note_id"])
 
-    updated = material.model_copy(update=update_data)
-    updated = _touch_material(updated)
-    material_images_store[material_id] = updated
-    return updated
+    return _patch_record(
+        material_images_store, material_id, update_data, "資料画像が見つかりません", if_match, response
+    )
 
 
 @app.delete("/materials/{material_id}", status_code=204)
@@ -1494,6 +3121,7 @@ async def list_tasks(
     event_id: str,
     status: Optional[Literal["open", "in_progress", "completed"]] = None,
     target_company_id: Optional[str] = None,
+    listing: ListFields = Depends(),
 ):
     _require_event(event_id)
     tasks = [task for task in tasks_store.values() if task.event_id == event_id]
@@ -1504,27 +3132,31 @@ async def list_tasks(
             task for task in tasks if task.target_company_id == target_company_id
         ]
     tasks.sort(key=lambda task: task.created_at, reverse=True)
-    return tasks
+    return listing.response(tasks_store, tasks, Task, "task_id")
 
 
 @app.get("/tasks/{task_id}", response_model=Task)
-async def get_task(task_id: str):
-    return _require_task(task_id)
+async def get_task(task_id: str, response: Response):
+    record = _require_task(task_id)
+    _set_etag(response, tasks_store, task_id)
+    return record
 
 
 @app.put("/tasks/{task_id}", response_model=Task)
-async def update_task(task_id: str, payload: TaskUpdate):
-    task = _require_task(task_id)
+async def update_task(
+    task_id: str,
+    payload: TaskUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+):
+    _require_task(task_id)
     update_data = payload.model_dump(exclude_unset=True)
     if "target_company_id" in update_data and update_data["target_company_id"]:
         _require_target_company(update_data["target_company_id"])
     if "visit_note_id" in update_data and update_data["visit_note_id"]:
         _require_visit_note(update_data["visit_note_id"])
 
-    updated = task.model_copy(update=update_data)
-    updated = _touch_task(updated)
-    tasks_store[task_id] = updated
-    return updated
+    return _patch_record(tasks_store, task_id, update_data, "タスクが見つかりません", if_match, response)
 
 
 @app.delete("/tasks/{task_id}", status_code=204)
@@ -1535,8 +3167,266 @@ async def delete_task(task_id: str):
     return None
 
 
+# アーカイブに含めるイベント配下のレコード。インポート時に参照先が先に届くよう、この順に書き出す
+_ARCHIVE_ENTITIES: List[Tuple[str, RecordStore, Any, str]] = [
+    ("booth", booths_store, Booth, "booth_id"),
+    ("target_company", target_companies_store, TargetCompany, "target_company_id"),
+    ("visit_note", visit_notes_store, VisitNote, "visit_note_id"),
+    ("keyword_note", keyword_notes_store, KeywordNote, "keyword_note_id"),
+    ("material", material_images_store, MaterialImage, "material_id"),
+    ("task", tasks_store, Task, "task_id"),
+    ("event_report", event_reports_store, EventReport, "report_id"),
+    ("business_card", business_cards_store, BusinessCard, "card_id"),
+]
+# 参照項目 -> 参照先の種別（インポート時に採番し直したIDへ付け替える）
+_ARCHIVE_REFERENCES: Dict[str, str] = {
+    "event_id": "event",
+    "booth_id": "booth",
+    "target_company_id": "target_company",
+    "visit_note_id": "visit_note",
+    "image_id": "image",
+    "image_ids": "image",
+}
+
+
+def _event_archive_lines(event_id: str, images: str) -> Iterator[bytes]:
+    """イベントのアーカイブを1行ずつ生成する"""
+    event = events_store.get(event_id)
+    if event is None:
+        return
+    # 書き出し中に追加・削除されても件数と本文が食い違わないよう、対象のレコードは最初に確定する
+    records = {
+        kind: [record for record in store.values() if record.event_id == event_id]
+        for kind, store, _model, _id_field in _ARCHIVE_ENTITIES
+    }
+    image_ids: Dict[str, None] = {}
+    for note in records["visit_note"]:
+        image_ids.update(dict.fromkeys(note.image_ids))
+    for record in records["material"] + records["business_card"]:
+        if record.image_id:
+            image_ids[record.image_id] = None
+    image_records = [uploaded_images_store[key] for key in image_ids if key in uploaded_images_store]
+
+    yield header_line(event_id, images, datetime.utcnow().isoformat())
+    yield archive_line("event", event.model_dump())
+    # 参照のみの場合は本文を除き、GET /upload/image/{image_id} で取得できるようにする
+    image_exclude = None if images == "inline" else {"content_base64"}
+    for image in image_records:
+        yield archive_line("image", image.model_dump(exclude=image_exclude))
+    counts = {"event": 1, "image": len(image_records)}
+    for kind, _store, _model, _id_field in _ARCHIVE_ENTITIES:
+        for record in records[kind]:
+            yield archive_line(kind, record.model_dump())
+        counts[kind] = len(records[kind])
+    yield archive_line("end", {"counts": counts})
+
+
+@app.get("/events/{event_id}/export")
+async def export_event(
+    event_id: str,
+    images: ArchiveImages = Query(
+        default="reference", description="inline は画像本文（Base64）も含める。reference はIDとメタデータのみ"
+    ),
+    compression: Optional[Literal["zstd"]] = Query(default=None, description="zstd で圧縮する"),
+):
+    """イベントと配下のレコードを NDJSON のアーカイブとしてストリーミングで返す"""
+    _require_event(event_id)
+    if compression == "zstd" and not zstd_available():
+        raise HTTPException(status_code=400, detail="zstd 圧縮は利用できません（zstandard 未インストール）")
+    filename = f"event-{event_id}.ndjson" + (".zst" if compression else "")
+    return StreamingResponse(
+        encode_stream(_event_archive_lines(event_id, images), compression),
+        media_type=ZSTD_MEDIA_TYPE if compression else NDJSON_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+class _ArchiveImport:
+    """アーカイブのレコードを新しいIDで検証して溜め、end 行まで読み終えてから一度にストアへ反映する
+
+    受信の途中（await の間）はストアに何も書かないため、他のリクエストから取り込み途中のイベントは見えず、
+    途中で失敗しても溜めたレコードを捨てるだけで済む。
+    """
+
+    def __init__(self):
+        self.id_map: Dict[str, Dict[str, str]] = {"event": {}, "image": {}}
+        self.counts: Dict[str, int] = {}
+        self.missing_images: List[str] = []
+        self.event_id: Optional[str] = None
+        self.finished = False
+        self._header = False
+        self._pending: List[Tuple[RecordStore, str, Any]] = []
+        self._written: List[Tuple[RecordStore, str]] = []
+
+    def _stage(self, kind: str, store: RecordStore, key: str, record: Any) -> None:
+        self._pending.append((store, key, record))
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def flush(self) -> None:
+        # await を挟まずに全件を反映し、永続化のログでも1件にまとめる（他のワーカーの書き込みとも直列化される）。
+        # 反映の途中で失敗した場合は rollback() で書き込んだ分を削除する
+        with write_group():
+            for store, key, record in self._pending:
+                store[key] = record
+                self._written.append((store, key))
+        self._pending.clear()
+
+    def rollback(self) -> None:
+        self._pending.clear()
+        for store, key in reversed(self._written):
+            store.pop(key, None)
+        self._written.clear()
+
+    def _resolve(self, field_name: str, value: Any) -> Any:
+        target = _ARCHIVE_REFERENCES[field_name]
+        if field_name == "event_id":
+            # イベント配下のレコードは、すべて新しく作ったイベントに付け替える
+            return self.event_id if value else value
+        if isinstance(value, list):
+            return [self.id_map.get(target, {})[item] for item in value if item in self.id_map.get(target, {})]
+        return self.id_map.get(target, {}).get(value) if value else None
+
+    def _remap(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        data = dict(data)
+        for field_name in _ARCHIVE_REFERENCES:
+            if field_name in data:
+                data[field_name] = self._resolve(field_name, data[field_name])
+        if isinstance(data.get("visit_context"), dict):
+            data["visit_context"] = {
+                key: self._resolve(key, value) if key in _ARCHIVE_REFERENCES else value
+                for key, value in data["visit_context"].items()
+            }
+        return data
+
+    def add(self, line_number: int, entry: Dict[str, Any]) -> None:
+        kind = entry["type"]
+        data = entry.get("data")
+        if not self._header:
+            check_header(entry)
+            self._header = True
+            return
+        if self.finished:
+            raise ArchiveError(f"{line_number}行目: end 行の後にレコードがあります")
+        if not isinstance(data, dict):
+            raise ArchiveError(f"{line_number}行目: data がありません")
+        try:
+            self._add_record(kind, data, line_number)
+        except ValidationError as exc:
+            raise ArchiveError(f"{line_number}行目（{kind}）: {exc.errors()[0].get('msg')}")
+
+    def _add_record(self, kind: str, data: Dict[str, Any], line_number: int) -> None:
+        if kind == "end":
+            self.finished = True
+            return
+        if kind == "event":
+            if self.event_id is not None:
+                raise ArchiveError(f"{line_number}行目: event 行が複数あります")
+            event = Event.model_validate({**data, "event_id": str(uuid4())})
+            self.event_id = event.event_id
+            self.id_map["event"][data.get("event_id", "")] = event.event_id
+            self._stage("event", events_store, event.event_id, event)
+            return
+        if self.event_id is None:
+            raise ArchiveError(f"{line_number}行目: event 行より前に {kind} があります")
+        if kind == "image":
+            original_id = data.get("image_id", "")
+            if data.get("content_base64"):
+                image = UploadedImage.model_validate({**data, "image_id": str(uuid4())})
+                self.id_map["image"][original_id] = image.image_id
+                self._stage("image", uploaded_images_store, image.image_id, image)
+            elif original_id in uploaded_images_store:
+                # 参照のみのアーカイブを同じサーバーへ取り込む場合は既存の画像をそのまま使う
+                self.id_map["image"][original_id] = original_id
+            else:
+                self.missing_images.append(original_id)
+            return
+        for entity_kind, store, model, id_field in _ARCHIVE_ENTITIES:
+            if entity_kind != kind:
+                continue
+            fields = self._remap(data)
+            if kind == "material" and not fields.get("image_id"):
+                # 画像のない資料は作れないため取り込まない（missing_images で分かる）
+                return
+            record = model.model_validate({**fields, id_field: str(uuid4())})
+            self.id_map.setdefault(kind, {})[data.get(id_field, "")] = getattr(record, id_field)
+            self._stage(kind, store, getattr(record, id_field), record)
+            return
+        raise ArchiveError(f"{line_number}行目: 不明なレコード種別です: {kind}")
+
+    def finish(self) -> None:
+        if self.event_id is None:
+            raise ArchiveError("event 行がありません")
+        if not self.finished:
+            raise ArchiveError("アーカイブが途中で切れています（end 行がありません）")
+        self.flush()
+
+
+@app.post("/events/import", response_model=EventImportResponse, status_code=201)
+async def import_event(request: Request):
+    """GET /events/{event_id}/export のアーカイブを新しいイベントとして取り込む
+
+    本文は受信しながら1行ずつ処理する。zstd 圧縮の場合は Content-Type: application/zstd を指定する。
+    全レコードに新しいIDを振り、参照項目も付け替える。途中で失敗した場合は何も残さない。
+    """
+    compression = "zstd" if request.headers.get("content-type", "").startswith(ZSTD_MEDIA_TYPE) else None
+    if compression and not zstd_available():
+        raise HTTPException(status_code=400, detail="zstd 圧縮は利用できません（zstandard 未インストール）")
+    reader = ArchiveReader(compression)
+    session = _ArchiveImport()
+    try:
+        async for chunk in request.stream():
+            for line_number, entry in reader.feed(chunk):
+                session.add(line_number, entry)
+        for line_number, entry in reader.close():
+            session.add(line_number, entry)
+        session.finish()
+    except ArchiveError as exc:
+        session.rollback()
+        raise HTTPException(status_code=422, detail=str(exc))
+    except BaseException:
+        session.rollback()
+        raise
+    id_map = {
+        original: created
+        for mapping in session.id_map.values()
+        for original, created in mapping.items()
+        if original and original != created
+    }
+    return EventImportResponse(
+        event_id=session.event_id,
+        counts=session.counts,
+        id_map=id_map,
+        missing_images=session.missing_images,
+    )
+
+
+def _summary_compact_exclude() -> Dict[str, Any]:
+    """view=compact のサマリーで省く入れ子の項目（一覧の compact と同じ項目）"""
+    def every(store_name: str) -> Dict[str, Any]:
+        return {"__all__": set(COMPACT_LIST_EXCLUDES[store_name])}
+
+    return {
+        "event": set(COMPACT_LIST_EXCLUDES["events"]),
+        "highlights": {"highlight_companies": every("target_companies")},
+        "recent_materials": every("material_images"),
+        "last_report": set(COMPACT_LIST_EXCLUDES["event_reports"]),
+    }
+
+
 @app.get("/events/{event_id}/summary", response_model=EventSummaryResponse)
-async def get_event_summary(event_id: str):
+async def get_event_summary(
+    event_id: str,
+    view: ListView = Query(
+        default="full", description="compact はAIレポート本文・スクレイピング結果・OCR全文を省く"
+    ),
+    exclude: Optional[str] = Query(
+        default=None, description="省くセクション（カンマ区切り。例: keyword_notes,recent_materials）"
+    ),
+):
+    excluded_sections = _split_fields(exclude)
+    unknown = [name for name in excluded_sections if name not in EventSummaryResponse.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"不明な項目です: {', '.join(unknown)}")
     event = _require_event(event_id)
     data = _collect_event_data(event_id)
 
@@ -1568,7 +3458,7 @@ async def get_event_summary(event_id: str):
             key=lambda report: report.updated_at,
         )
 
-    return EventSummaryResponse(
+    summary = EventSummaryResponse(
         event=event,
         metrics=data["metrics"],
         highlights=highlights,
@@ -1576,16 +3466,23 @@ async def get_event_summary(event_id: str):
         keyword_notes=keyword_notes,
         last_report=last_report,
     )
+    if view == "full" and not excluded_sections:
+        return summary
+    # 省いた項目が null として補われないよう、response_model を通さずにJSON化する
+    excluded: Dict[str, Any] = _summary_compact_exclude() if view == "compact" else {}
+    for section in excluded_sections:
+        excluded[section] = True
+    return JSONBytesResponse(content=dumps(summary.model_dump(exclude=excluded)))
 
 
 @app.get("/events/{event_id}/reports", response_model=List[EventReport])
-async def list_event_reports(event_id: str):
+async def list_event_reports(event_id: str, listing: ListFields = Depends()):
     _require_event(event_id)
     reports = [
         report for report in event_reports_store.values() if report.event_id == event_id
     ]
     reports.sort(key=lambda report: report.created_at, reverse=True)
-    return reports
+    return listing.response(event_reports_store, reports, EventReport, "report_id")
 
 
 @app.get("/event-reports/{report_id}", response_model=EventReport)
@@ -1600,6 +3497,7 @@ async def get_event_report(report_id: str):
     "/events/{event_id}/generate-report",
     response_model=EventReport,
     status_code=201,
+    dependencies=[Depends(_rate_limit("ai")), Depends(_ai_latency_budget)],
 )
 async def generate_event_report(event_id: str, request: EventReportRequest):
     event = _require_event(event_id)
@@ -1619,26 +3517,17 @@ async def generate_event_report(event_id: str, request: EventReportRequest):
     event_reports_store[report_id] = report
 
     try:
-        content = await _generate_event_report_markdown(event, data, request)
-        updated = report.model_copy(
-            update={
-                "status": "completed",
-                "content": content,
-                "updated_at": datetime.utcnow(),
-            }
-        )
+        content, model = await _generate_event_report_markdown(event, data, request)
+        changes = {"status": "completed", "content": content, "ai_model": model}
     except Exception as exc:
+        if _is_admission_rejection(exc):
+            # 混雑で実行できなかっただけなので失敗として残さず、作りかけのレポートを消して 503 を返す
+            event_reports_store.pop(report_id, None)
+            raise
         print(f"Event report generation failed: {exc}")
-        updated = report.model_copy(
-            update={
-                "status": "failed",
-                "content": f"レポート生成に失敗しました: {exc}",
-                "updated_at": datetime.utcnow(),
-            }
-        )
+        changes = {"status": "failed", "content": f"レポート生成に失敗しました: {exc}"}
 
-    event_reports_store[report_id] = updated
-    return updated
+    return _patch_record(event_reports_store, report_id, changes, "イベントレポートが見つかりません")
 @app.post("/target-companies", response_model=TargetCompany, status_code=201)
 async def create_target_company(payload: TargetCompanyCreate):
     _require_event(payload.event_id)
@@ -1657,34 +3546,52 @@ async def create_target_company(payload: TargetCompanyCreate):
 
 
 @app.get("/target-companies", response_model=List[TargetCompany])
-async def list_target_companies(event_id: Optional[str] = None):
+async def list_target_companies(event_id: Optional[str] = None, listing: ListFields = Depends()):
+    targets = target_companies_store.values()
     if event_id:
         _require_event(event_id)
-        return [
-            target
-            for target in target_companies_store.values()
-            if target.event_id == event_id
-        ]
-    return list(target_companies_store.values())
+        targets = [target for target in targets if target.event_id == event_id]
+    return listing.response(target_companies_store, targets, TargetCompany, "target_company_id")
 
 
 @app.get("/target-companies/{target_company_id}", response_model=TargetCompany)
-async def get_target_company(target_company_id: str):
-    return _require_target_company(target_company_id)
+async def get_target_company(target_company_id: str, response: Response):
+    record = _require_target_company(target_company_id)
+    _set_etag(response, target_companies_store, target_company_id)
+    return record
+
+
+@app.get("/target-companies/{target_company_id}/similar", response_model=List[SimilarDocument])
+async def get_similar_to_target_company(
+    target_company_id: str,
+    limit: int = Query(default=10, ge=1, le=50),
+    event_id: Optional[str] = None,
+    doc_type: Optional[SimilarDocType] = Query(default=None, alias="type"),
+):
+    """事前調査レポート・概要の近い企業やノートを返す"""
+    _require_target_company(target_company_id)
+    return await run_in_threadpool(
+        _similar_documents, f"target_company:{target_company_id}", limit, event_id, doc_type
+    )
 
 
 @app.put("/target-companies/{target_company_id}", response_model=TargetCompany)
-async def update_target_company(target_company_id: str, payload: TargetCompanyUpdate):
-    target = _require_target_company(target_company_id)
+async def update_target_company(
+    target_company_id: str,
+    payload: TargetCompanyUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+):
+    _require_target_company(target_company_id)
     update_data = payload.model_dump(exclude_unset=True)
     if "event_id" in update_data and update_data["event_id"]:
         _require_event(update_data["event_id"])
     if "highlight_tags" in update_data and update_data["highlight_tags"] is None:
         update_data["highlight_tags"] = []
-    updated = target.model_copy(update=update_data)
-    updated = _touch_target_company(updated)
-    target_companies_store[target_company_id] = updated
-    return updated
+    return _patch_record(
+        target_companies_store, target_company_id, update_data, "ターゲット企業が見つかりません",
+        if_match, response,
+    )
 
 
 @app.delete("/target-companies/{target_company_id}", status_code=204)
@@ -1708,6 +3615,9 @@ async def delete_target_company(target_company_id: str):
         if task.target_company_id == target_company_id:
             updated_task = task.model_copy(update={"target_company_id": None})
             tasks_store[task.task_id] = updated_task
+    for card in list(business_cards_store.values()):
+        if card.target_company_id == target_company_id:
+            business_cards_store[card.card_id] = card.model_copy(update={"target_company_id": None})
     del target_companies_store[target_company_id]
     return None
 
@@ -1715,48 +3625,59 @@ async def delete_target_company(target_company_id: str):
 @app.post(
     "/target-companies/{target_company_id}/pre-research",
     response_model=TargetCompany,
+    dependencies=[Depends(_rate_limit("ai")), Depends(_ai_latency_budget)],
 )
 async def run_pre_research(target_company_id: str, request: PreResearchRequest):
     target = _require_target_company(target_company_id)
     event = _require_event(target.event_id)
 
     if target.ai_research and not request.force_refresh:
+        record_cache("pre_research", True)
         return target
+    record_cache("pre_research", False)
 
-    processing = target.model_copy(
-        update={"pre_research_status": "processing", "updated_at": datetime.utcnow()}
-    )
-    target_companies_store[target_company_id] = processing
-
-    try:
-        report = await _generate_pre_research_report(event, target, request)
-        summary_line = next(
-            (line for line in report.splitlines() if line.strip()), ""
+    async def research() -> TargetCompany:
+        not_found = "ターゲット企業が見つかりません"
+        previous_status = _require_target_company(target_company_id).pre_research_status
+        _patch_record(
+            target_companies_store, target_company_id, {"pre_research_status": "processing"}, not_found
         )
-        updated = processing.model_copy(
-            update={
+        try:
+            report, model = await _generate_pre_research_report(event, target, request)
+            summary_line = next(
+                (line for line in report.splitlines() if line.strip()), ""
+            )
+            changes = {
                 "ai_research": report,
                 "research_summary": summary_line[:200],
                 "pre_research_status": "completed",
-                "updated_at": datetime.utcnow(),
-            }
-        )
-    except Exception as exc:
-        print(f"Pre-research failed for {target_company_id}: {exc}")
-        updated = processing.model_copy(
-            update={
-                "pre_research_status": f"failed: {exc}",
-                "updated_at": datetime.utcnow(),
+                "ai_research_model": model,
             }
-        )
-
-    target_companies_store[target_company_id] = updated
-    return updated
+        except Exception as exc:
+            if _is_admission_rejection(exc):
+                # 混雑で実行できなかっただけなので失敗として残さず、元の状態に戻して 503 を返す
+                _patch_record(
+                    target_companies_store, target_company_id, {"pre_research_status": previous_status}, not_found
+                )
+                raise
+            print(f"Pre-research failed for {target_company_id}: {exc}")
+            changes = {"pre_research_status": f"failed: {exc}"}
+        # 生成中に編集されたメモなどを上書きしないよう、最新のレコードに結果の項目だけを反映する
+        return _patch_record(target_companies_store, target_company_id, changes, not_found)
+
+    # 同時に押された同じ条件の事前調査は、生成を1回にまとめて結果を共有する
+    return await single_flight.run(
+        "pre_research",
+        target_company_id,
+        request.model_dump(exclude={"force_refresh"}),
+        research,
+    )
 
 
 @app.post(
     "/events/{event_id}/target-companies/pre-research",
     response_model=List[TargetCompany],
+    dependencies=[Depends(_rate_limit("ai_batch")), Depends(_ai_latency_budget)],
 )
 async def batch_pre_research(event_id: str, request: BatchPreResearchRequest):
     _require_event(event_id)
@@ -1776,31 +3697,174 @@ async def batch_pre_research(event_id: str, request: BatchPreResearchRequest):
                 detail=f"指定したターゲット企業が見つかりません: {', '.join(missing)}",
             )
 
+    if request.new_since_version is not None:
+        history = scrape_history_store.get(event_id) or ScrapeHistory()
+        delta = history.changes_since(request.new_since_version)
+        new_items = delta["added"] + [entry["after"] for entry in delta["changed"]]
+        new_fingerprints = {item["fingerprint"] for item in new_items}
+        new_names = {normalize_text(str(item.get("text") or "")) for item in new_items}
+        targets = [
+            target
+            for target in targets
+            if (target.scraped_context or {}).get("fingerprint") in new_fingerprints
+            or normalize_text(target.name) in new_names
+        ]
+
     updated_targets: List[TargetCompany] = []
-    for target in targets:
-        updated = await run_pre_research(target.target_company_id, request)
-        updated_targets.append(updated)
+    # 1社ずつ実行枠を取り直すので、その合間に対話的なAI呼び出しが先に進む。
+    # 混雑で受け付けられなければ、残りを失敗として記録せずに 503 と Retry-After を返す
+    with ai_priority("batch"):
+        for target in targets:
+            updated = await run_pre_research(target.target_company_id, request)
+            updated_targets.append(updated)
 
     return updated_targets
 
 
-@app.post("/scan", response_model=CardScanResponse)
+def _validate_card_links(data: Dict[str, Any]) -> None:
+    if data.get("event_id"):
+        _require_event(data["event_id"])
+    if data.get("booth_id") and data["booth_id"] not in booths_store:
+        raise HTTPException(status_code=404, detail="紐づくブースが見つかりません")
+    if data.get("target_company_id"):
+        _require_target_company(data["target_company_id"])
+    if data.get("image_id") and data["image_id"] not in uploaded_images_store:
+        raise HTTPException(status_code=404, detail="名刺画像が見つかりません")
+
+
+def _merge_card(existing: BusinessCard, payload: BusinessCardCreate) -> BusinessCard:
+    """既存の名刺に、新しいスキャンで得た情報のうち未入力の項目だけを補う"""
+    incoming = payload.model_dump(exclude={"created_by", "merge_duplicates"})
+    update: Dict[str, Any] = {}
+    for field_name, value in incoming.items():
+        current = getattr(existing, field_name)
+        if field_name in ("departments", "titles"):
+            merged = list(dict.fromkeys([*current, *value]))
+            if merged != current:
+                update[field_name] = merged
+        elif field_name == "visit_notes":
+            if value and value not in (current or ""):
+                update[field_name] = f"{current}\n{value}" if current else value
+        elif field_name == "highlight":
+            update[field_name] = current or value
+        elif current in (None, "") and value not in (None, ""):
+            update[field_name] = value
+    scanned_by = list(existing.scanned_by)
+    if payload.created_by and payload.created_by not in scanned_by:
+        scanned_by.append(payload.created_by)
+    update.update(scanned_by=scanned_by, scan_count=existing.scan_count + 1, updated_at=datetime.utcnow())
+    # model_dump した値（visit_context などは dict）をそのまま入れず、検証し直してモデルに戻す
+    return BusinessCard.model_validate({**dict(existing), **update})
+
+
+@app.post("/cards", response_model=BusinessCardUpsertResponse, status_code=201)
+async def create_card(payload: BusinessCardCreate, response: Response):
+    """名刺を登録する。同一人物が登録済みなら統合して既存の名刺を返す（ステータス200）"""
+    _validate_card_links(payload.model_dump())
+    if payload.merge_duplicates:
+        duplicates = _find_duplicate_cards(payload)
+        if duplicates and duplicates[0].same_person:
+            merged = _merge_card(business_cards_store[duplicates[0].card_id], payload)
+            business_cards_store[merged.card_id] = merged
+            response.status_code = 200
+            return BusinessCardUpsertResponse(
+                card=merged, merged=True, matched_on=duplicates[0].matched_on
+            )
+
+    now = datetime.utcnow()
+    data = payload.model_dump(exclude={"created_by", "merge_duplicates"})
+    card = BusinessCard(
+        card_id=str(uuid4()),
+        scanned_by=[payload.created_by] if payload.created_by else [],
+        created_at=now,
+        updated_at=now,
+        **data,
+    )
+    business_cards_store[card.card_id] = card
+    return BusinessCardUpsertResponse(card=card)
+
+
+@app.post("/cards/duplicates", response_model=List[CardDuplicateCandidate])
+async def find_duplicate_cards(payload: BusinessCardBase):
+    """登録前に、同一人物と思われる登録済みの名刺を調べる"""
+    return _find_duplicate_cards(payload)
+
+
+@app.get("/cards", response_model=List[BusinessCard])
+async def list_cards(
+    event_id: Optional[str] = None,
+    booth_id: Optional[str] = None,
+    target_company_id: Optional[str] = None,
+    listing: ListFields = Depends(),
+):
+    cards = list(business_cards_store.values())
+    if event_id:
+        cards = [card for card in cards if card.event_id == event_id]
+    if booth_id:
+        cards = [card for card in cards if card.booth_id == booth_id]
+    if target_company_id:
+        cards = [card for card in cards if card.target_company_id == target_company_id]
+    cards.sort(key=lambda card: card.created_at, reverse=True)
+    return listing.response(business_cards_store, cards, BusinessCard, "card_id")
+
+
+@app.get("/cards/{card_id}", response_model=BusinessCard)
+async def get_card(card_id: str, response: Response):
+    record = _require_card(card_id)
+    _set_etag(response, business_cards_store, card_id)
+    return record
+
+
+@app.put("/cards/{card_id}", response_model=BusinessCard)
+async def update_card(
+    card_id: str,
+    payload: BusinessCardUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+):
+    _require_card(card_id)
+    update_data = payload.model_dump(exclude_unset=True)
+    _validate_card_links(update_data)
+    for list_field in ("departments", "titles"):
+        if list_field in update_data and update_data[list_field] is None:
+            update_data[list_field] = []
+    return _patch_record(
+        business_cards_store, card_id, update_data, "名刺が見つかりません", if_match, response
+    )
+
+
+@app.delete("/cards/{card_id}", status_code=204)
+async def delete_card(card_id: str):
+    if card_id not in business_cards_store:
+        raise HTTPException(status_code=404, detail="名刺が見つかりません")
+    del business_cards_store[card_id]
+    return None
+
+
+@app.post(
+    "/scan",
+    response_model=CardScanResponse,
+    dependencies=[Depends(_rate_limit("ai")), Depends(_ai_latency_budget)],
+)
 async def scan_card(request: CardScanRequest):
     """
     名刺画像をOCRでスキャンして情報を抽出
     """
     if not GEMINI_API_KEY or not gemini_client:
         # モックレスポンス（API キーがない場合）
-        return CardScanResponse(
+        mock = CardScanResponse(
             company_name="株式会社サンプル",
             departments=["営業部", "第一営業課"],
             titles=["課長"],
             full_name="山田 太郎",
             name_reading="Yamada Taro",
             email="yamada@sample.co.jp",
+            phone="03-1234-5678",
             company_url="https://sample.co.jp",
             address="東京都千代田区丸の内1-1-1"
         )
+        mock.duplicates = _find_duplicate_cards(mock)
+        return mock
 
     try:
         # Base64画像をデコード
@@ -1814,7 +3878,9 @@ async def scan_card(request: CardScanRequest):
             image_base64 = raw_image_base64
 
         try:
-            image_data = base64.b64decode(image_base64, validate=True)
+            image_data = await run_in_threadpool(
+                base64.b64decode, image_base64, validate=True
+            )
         except (binascii.Error, ValueError) as exc:
             raise HTTPException(
                 status_code=400,
@@ -1830,6 +3896,8 @@ async def scan_card(request: CardScanRequest):
         - full_name: 氏名
         - name_reading: 氏名のローマ字またはフリガナ（存在する場合のみ）
         - email: メールアドレス
+        - phone: 電話番号（代表または直通）
+        - mobile: 携帯電話番号
         - company_url: 会社URL
         - address: 会社住所
 
@@ -1840,9 +3908,9 @@ async def scan_card(request: CardScanRequest):
         """
 
         # 新しいSDKで画像を解析
-        response = gemini_client.models.generate_content(
-            model='gemini-1.5-flash',
-            contents=[
+        response, model = await _generate_content(
+            "scan",
+            [
                 prompt,
                 types.Part.from_bytes(
                     data=image_data,
@@ -1855,14 +3923,24 @@ async def scan_card(request: CardScanRequest):
         import json
         result = json.loads(response.text)
 
-        return CardScanResponse(**result)
+        scanned = CardScanResponse(**result)
+        scanned.ai_model = model
+        # 同僚が同じ人物を登録済みなら、再登録や事前調査の重複を避けられるよう候補を返す
+        scanned.duplicates = _find_duplicate_cards(scanned)
+        return scanned
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error scanning card: {e}")
         raise HTTPException(status_code=500, detail=f"名刺のスキャンに失敗しました: {str(e)}")
 
 
-@app.post("/deep-research", response_model=DeepResearchResponse)
+@app.post(
+    "/deep-research",
+    response_model=DeepResearchResponse,
+    dependencies=[Depends(_rate_limit("ai")), Depends(_ai_latency_budget)],
+)
 async def deep_research(request: DeepResearchRequest):
     """
     企業情報に基づいてDeepリサーチレポートを生成
@@ -1980,39 +4058,29 @@ async def deep_research(request: DeepResearchRequest):
 """
 
         # Google Search Groundingを使用（最新のSDK）
-        # モデル名を確認: gemini-2.0-flash-exp または gemini-1.5-pro など
+        # 候補のモデル（gemini-1.5-pro → gemini-2.0-flash-exp）は model_router が順に試す
         try:
-            # まずは gemini-1.5-pro を試す（Google Search Groundingをサポート）
-            response = gemini_client.models.generate_content(
-                model='gemini-1.5-pro',
-                contents=prompt,
-                config=types.GenerateContentConfig(
+            response, model = await _generate_content(
+                "deep_research",
+                prompt,
+                types.GenerateContentConfig(
                     tools=[types.Tool(google_search=types.GoogleSearch())],
                     temperature=0.7
                 )
             )
+        except HTTPException:
+            # 混雑による 503 は Grounding なしで再試行しない
+            raise
         except Exception as model_error:
-            # モデルが利用できない場合は、gemini-2.0-flash-expを試す
-            print(f"Warning: gemini-1.5-pro failed, trying gemini-2.0-flash-exp: {model_error}")
-            try:
-                response = gemini_client.models.generate_content(
-                    model='gemini-2.0-flash-exp',
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        tools=[types.Tool(google_search=types.GoogleSearch())],
-                        temperature=0.7
-                    )
-                )
-            except Exception as model_error2:
-                # それでも失敗する場合は、Google Searchなしで通常のモデルを使用
-                print(f"Warning: Google Search Grounding failed, using regular model: {model_error2}")
-                response = gemini_client.models.generate_content(
-                    model='gemini-1.5-pro',
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        temperature=0.7
-                    )
+            # それでも失敗する場合は、Google Searchなしで通常のモデルを使用
+            print(f"Warning: Google Search Grounding failed, using regular model: {model_error}")
+            response, model = await _generate_content(
+                "deep_research",
+                prompt,
+                types.GenerateContentConfig(
+                    temperature=0.7
                 )
+            )
 
         # レスポンスから情報を抽出
         if not response:
@@ -2075,9 +4143,12 @@ async def deep_research(request: DeepResearchRequest):
             report=report_text,
             status="completed",
             sources=sources,
-            search_queries=search_queries
+            search_queries=search_queries,
+            ai_model=model,
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generating deep research: {e}")
         import traceback
@@ -0,0 +1,185 @@
+"""出展者名とターゲット企業名のあいまい照合
+
+日本語の会社名を正規化（法人格表記の除去、全角/半角・ひらがな/カタカナの統一）したうえで
+文字バイグラムの転置インデックスから候補を絞り込み、Dice係数でスコアリングする。
+"""
+
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# NFKC適用後の表記で照合する（㈱ -> (株)、（株） -> (株) になる）
+_LEGAL_FORMS = [
+    "株式会社", "有限会社", "合同会社", "合資会社", "合名会社",
+    "一般社団法人", "一般財団法人", "公益社団法人", "公益財団法人",
+    "特定非営利活動法人", "npo法人", "独立行政法人", "国立研究開発法人",
+    "学校法人", "医療法人", "社会福祉法人",
+    "(株)", "(有)", "(同)", "(資)", "(名)", "(社)", "(財)",
+    "co.,ltd.", "co., ltd.", "co.,ltd", "co., ltd", "co.ltd", "ltd.", "ltd",
+    "inc.", "inc", "corporation", "corp.", "corp", "k.k.", "kk", "gmbh", "llc",
+]
+_LEGAL_PATTERN = re.compile(
+    "|".join(
+        re.escape(form) if not form.isascii() or not form[0].isalpha()
+        else r"(?<![a-z0-9])" + re.escape(form) + r"(?![a-z0-9])"
+        for form in sorted(_LEGAL_FORMS, key=len, reverse=True)
+    )
+)
+# 空白・記号類は照合に使わない（長音記号「ー」は残す）
+_STRIP_PATTERN = re.compile(r"[\s\-‐−–—・･.,、。'\"()\[\]{}「」『』&＆/]+")
+
+_HIRAGANA_START = ord("ぁ")
+_HIRAGANA_END = ord("ゖ")
+_KATAKANA_OFFSET = ord("ァ") - ord("ぁ")
+
+
+def _hiragana_to_katakana(text: str) -> str:
+    return "".join(
+        chr(ord(char) + _KATAKANA_OFFSET) if _HIRAGANA_START <= ord(char) <= _HIRAGANA_END else char
+        for char in text
+    )
+
+
+def normalize_company_name(name: Optional[str]) -> str:
+    """会社名を照合用に正規化する
+
+    例: 「株式会社ｻﾝﾌﾟﾙ」「（株）サンプル」「さんぷる株式会社」 -> 「サンプル」
+    """
+    if not name:
+        return ""
+    text = unicodedata.normalize("NFKC", name).lower()
+    text = _LEGAL_PATTERN.sub(" ", text)
+    text = _hiragana_to_katakana(text)
+    return _STRIP_PATTERN.sub("", text)
+
+
+def ngrams(text: str, size: int = 2) -> List[str]:
+    if not text:
+        return []
+    if len(text) <= size:
+        return [text]
+    return [text[i:i + size] for i in range(len(text) - size + 1)]
+
+
+def _digits(text: str) -> str:
+    return "".join(char for char in text if char.isdigit())
+
+
+class CompanyNameIndex:
+    """文字n-gramの転置インデックス（キーはターゲット企業IDなど任意の文字列）
+
+    スコアはn-gram集合のDice係数。各キーに整数スロットを割り当て、
+    n-gramごとのポスティングをNumPy配列にしておき、問い合わせ時は
+    該当ポスティングを連結して bincount するだけで全候補の共有数が求まる。
+    「株式会社」「工業」のような共通n-gramが多くてもPythonループにならない。
+
+    ポスティングは追記のみで、削除したスロットはサイズを無限大にして無効化する。
+    無効スロットが増えたら作り直す。
+    """
+
+    def __init__(self, size: int = 2):
+        self.size = size
+        self._slots: Dict[str, int] = {}
+        self._keys: List[Optional[str]] = []
+        self._normalized: List[str] = []
+        self._sizes = np.zeros(0, dtype=np.float64)
+        self._digit_keys = np.zeros(0, dtype=np.int64)
+        self._posting_arrays: Dict[str, np.ndarray] = {}
+        self._pending: Dict[str, List[int]] = {}
+        self._exact: Dict[str, Set[str]] = {}
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def add(self, key: str, name: str) -> None:
+        self._add_normalized(key, normalize_company_name(name))
+
+    def _add_normalized(self, key: str, normalized: str) -> None:
+        self.remove(key)
+        if not normalized:
+            return
+        slot = len(self._keys)
+        if slot >= len(self._sizes):
+            capacity = max(16, len(self._sizes) * 2)
+            sizes = np.full(capacity, np.inf)
+            sizes[: len(self._sizes)] = self._sizes
+            digit_keys = np.zeros(capacity, dtype=np.int64)
+            digit_keys[: len(self._digit_keys)] = self._digit_keys
+            self._sizes, self._digit_keys = sizes, digit_keys
+        grams = set(ngrams(normalized, self.size))
+        self._keys.append(key)
+        self._normalized.append(normalized)
+        self._slots[key] = slot
+        self._sizes[slot] = len(grams)
+        self._digit_keys[slot] = hash(_digits(normalized))
+        self._exact.setdefault(normalized, set()).add(key)
+        for gram in grams:
+            self._pending.setdefault(gram, []).append(slot)
+
+    def remove(self, key: str) -> None:
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        normalized = self._normalized[slot]
+        keys = self._exact.get(normalized)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._exact[normalized]
+        self._keys[slot] = None
+        self._sizes[slot] = np.inf
+        self._dead += 1
+        if self._dead > 1024 and self._dead > len(self._slots):
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        live = [(key, self._normalized[slot]) for key, slot in self._slots.items()]
+        self.__init__(self.size)
+        for key, normalized in live:
+            self._add_normalized(key, normalized)
+
+    def _posting_array(self, gram: str) -> Optional[np.ndarray]:
+        array = self._posting_arrays.get(gram)
+        pending = self._pending.pop(gram, None)
+        if pending:
+            added = np.asarray(pending, dtype=np.int64)
+            array = added if array is None else np.concatenate((array, added))
+            self._posting_arrays[gram] = array
+        return array
+
+    def match(
+        self, name: str, limit: int = 3, threshold: float = 0.5
+    ) -> List[Tuple[str, float]]:
+        """(キー, スコア) をスコア順に返す。正規化後の完全一致は1.0
+
+        数字部分だけが異なる名称（「第2工場」と「第3工場」など）は別物として減点する。
+        """
+        normalized = normalize_company_name(name)
+        if not normalized or not self._slots:
+            return []
+        query = set(ngrams(normalized, self.size))
+        arrays = [array for array in map(self._posting_array, query) if array is not None]
+
+        exact = self._exact.get(normalized, set())
+        scored = [(key, 1.0) for key in exact]
+        if arrays:
+            capacity = len(self._keys)
+            overlap = np.bincount(np.concatenate(arrays), minlength=capacity)
+            scores = 2.0 * overlap / (len(query) + self._sizes[:capacity])
+            digits_differ = self._digit_keys[:capacity] != hash(_digits(normalized))
+            scores = np.where(digits_differ, scores * 0.5, scores)
+            for slot in np.flatnonzero(scores >= max(threshold, 1e-9)):
+                key = self._keys[slot]
+                if key in exact:
+                    continue
+                scored.append((key, round(float(scores[slot]), 4)))
+        scored.sort(key=lambda pair: (-pair[1], pair[0]))
+        return scored[:limit]
+
+    def match_many(
+        self, names: Iterable[str], limit: int = 3, threshold: float = 0.5
+    ) -> List[List[Tuple[str, float]]]:
+        return [self.match(name, limit, threshold) for name in names]
@@ -0,0 +1,559 @@
+"""インメモリーストアの永続化（スナップショット＋追記ログ）
+
+PERSIST_DIR を設定すると、ストアへの書き込み・削除をすべて msgpack の追記ログ（WAL）に記録し、
+定期的に全ストアのスナップショットを書き出す。起動時は最新のスナップショットを読み込み、
+それ以降のログを再生して停止直前の状態に戻す。ログにはレコードのバージョンも記録するため、
+ETag や同期の seq も再起動をまたいで同じ値になる。
+
+ログはセグメント（wal-<番号>.log）に分かれており、スナップショットを取るときと起動時に新しいセグメントへ切り替える。
+スナップショットには切り替え後のセグメント番号を記録し、それより前のセグメントは書き出し後に削除する。
+異常終了で書きかけになったログの末尾は再生時に読み飛ばす（追記は常に新しいセグメントから再開する）。
+write_group() の中の書き込みは1件のエントリーにまとめて追記するため、再生時も全件をまとめて反映する
+（途中で落ちても、一部だけが反映された状態にはならない）。
+
+複数のワーカープロセス（WEB_CONCURRENCY >= 2）で動かす場合は、同じディレクトリのログを全ワーカーで共有する:
+    - 書き込みはロックファイル（wal.lock）の flock を取り、他ワーカーの追記を取り込んでから追記する
+      （If-Match の比較もロックの中で行うため、プロセスをまたいでも更新を取りこぼさない）
+    - 各ワーカーはリクエストの開始時と定期的にログの続きを読み、他ワーカーの変更を自分のストアに反映する
+      （ストアの購読者が動くため、検索インデックスやJSON断片キャッシュもそのまま追従する）
+    - スナップショットはリースを持つ1ワーカーだけが取る（cluster.BackgroundJobs）。
+      追従の遅れたワーカーのために、1世代前のスナップショット以降のセグメントを残す
+
+fsync の頻度は PERSIST_FSYNC で選ぶ:
+    always  書き込みごとに fsync（最も安全・最も遅い）
+    batch   PERSIST_FSYNC_INTERVAL_MS ごとにまとめて fsync（既定。停電時は最大でその間隔分を失う）
+    never   OSに任せる（プロセスが落ちても失わないが、OSごと落ちると失う可能性がある）
+"""
+
+import asyncio
+import gc
+import os
+import re
+import signal
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Any, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - 依存が無い環境向け
+    msgpack = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from metrics import REGISTRY
+from stores import RecordStore, clock, set_write_group, set_write_lock
+
+PERSIST_DIR = os.getenv("PERSIST_DIR", "")
+PERSIST_FSYNC = os.getenv("PERSIST_FSYNC", "batch")
+PERSIST_FSYNC_INTERVAL_MS = float(os.getenv("PERSIST_FSYNC_INTERVAL_MS", "100"))
+PERSIST_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("PERSIST_SNAPSHOT_INTERVAL_SECONDS", "600"))
+# ログがこの大きさを超えたら、間隔を待たずにスナップショットを取る
+PERSIST_SNAPSHOT_LOG_BYTES = int(os.getenv("PERSIST_SNAPSHOT_LOG_BYTES", str(64 * 1024 * 1024)))
+# 停止時にスナップショットを取り、次回の起動でログを再生せずに済ませる
+PERSIST_SNAPSHOT_ON_SHUTDOWN = os.getenv("PERSIST_SNAPSHOT_ON_SHUTDOWN", "true").lower() in ("1", "true", "yes")
+# uvicorn のワーカー数（--workers の既定値にもなる）。2以上ならログを他ワーカーと共有する
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+SNAPSHOT_FORMAT = "salon-store-snapshot"
+SNAPSHOT_VERSION = 2
+_FSYNC_MODES = ("always", "batch", "never")
+_PUT = 0
+_DELETE = 1
+# [_GROUP, [エントリー, ...]]
+_GROUP = 2
+_SEGMENT_PATTERN = re.compile(r"^wal-(\d+)\.log$")
+_SNAPSHOT_PATTERN = re.compile(r"^snapshot-(\d+)\.msgpack$")
+_READ_BYTES = 1024 * 1024
+# 追従が遅れてセグメントを取りこぼしていないかを確かめる間隔
+_GAP_CHECK_SECONDS = 5.0
+
+LOG_APPLIED = REGISTRY.counter(
+    "salon_store_log_applied_total",
+    "他のワーカーの書き込みを共有ログから取り込んだ件数",
+)
+
+
+def _dump(record: Any) -> Dict[str, Any]:
+    # 日時は文字列にしておく（msgpack の独自型への変換を Python で呼ぶより速く、復元時の検証も速い）
+    return record.model_dump(mode="json")
+
+
+def _packer() -> "msgpack.Packer":
+    return msgpack.Packer(use_bin_type=True)
+
+
+def _unpacker(file=None) -> "msgpack.Unpacker":
+    return msgpack.Unpacker(
+        file,
+        raw=False,
+        strict_map_key=False,
+        read_size=_READ_BYTES,
+        max_buffer_size=256 * 1024 * 1024,
+    )
+
+
+def _segment_name(number: int) -> str:
+    return f"wal-{number:08d}.log"
+
+
+class _SegmentReader:
+    """ログのセグメントを先頭から読み進める（他のワーカーが追記中のファイルも続きから読める）"""
+
+    def __init__(self, directory: str, number: int):
+        self.number = number
+        self.name = _segment_name(number)
+        self._file = open(os.path.join(directory, self.name), "rb")
+        self._unpacker = _unpacker()
+        self._fed = 0
+        # 読み終えた完全なエントリーの末尾
+        self.offset = 0
+        # 読めないバイト列があった（書きかけの末尾か破損）
+        self.broken = False
+
+    @property
+    def pending(self) -> bool:
+        """エントリーとして完結していないバイトを読んでいる"""
+        return self.broken or self._fed > self.offset
+
+    def has_more(self) -> bool:
+        return os.fstat(self._file.fileno()).st_size > self._fed
+
+    def entries(self) -> Iterator[list]:
+        while not self.broken:
+            chunk = self._file.read(_READ_BYTES)
+            if not chunk:
+                return
+            self._unpacker.feed(chunk)
+            self._fed += len(chunk)
+            while True:
+                try:
+                    entry = next(self._unpacker)
+                except StopIteration:
+                    break
+                except (ValueError, msgpack.UnpackException) as exc:
+                    print(f"WAL {self.name}: {self.offset} バイト目以降を読み飛ばします ({exc})")
+                    self.broken = True
+                    return
+                if not isinstance(entry, list) or not (
+                    len(entry) in (4, 5) or (len(entry) == 2 and entry[0] == _GROUP)
+                ):
+                    print(f"WAL {self.name}: {self.offset} バイト目以降を読み飛ばします (不正なエントリー)")
+                    self.broken = True
+                    return
+                self.offset = self._unpacker.tell()
+                yield entry
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class StorePersistence:
+    """RecordStore 群をディレクトリにスナップショット＋WALとして保存・復元する"""
+
+    def __init__(
+        self,
+        directory: str,
+        stores: Dict[str, Tuple[RecordStore, Any]],
+        fsync: str = PERSIST_FSYNC,
+        fsync_interval: float = PERSIST_FSYNC_INTERVAL_MS / 1000,
+        shared: bool = False,
+    ):
+        if msgpack is None:
+            raise RuntimeError("PERSIST_DIR を使うには msgpack をインストールしてください")
+        if fsync not in _FSYNC_MODES:
+            raise ValueError(f"PERSIST_FSYNC は {', '.join(_FSYNC_MODES)} のいずれかです: {fsync}")
+        if shared and fcntl is None:
+            raise RuntimeError("複数ワーカーでストアを共有するには flock が使えるOSが必要です")
+        self.directory = directory
+        # ストア名 -> (ストア, レコードのモデル)
+        self.stores = stores
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.shared = shared
+        self._packer = _packer()
+        self._segment = 0
+        self._file = None
+        self._dirty = False
+        self._replaying = False
+        # write_group() の中で溜めているエントリー
+        self._group: Optional[List[list]] = None
+        self._snapshot_lock = asyncio.Lock()
+        self._writing: Optional["asyncio.Future[str]"] = None
+        # 共有モード: 他ワーカーのログを読む位置と、書き込みを直列化するロック
+        self._reader: Optional[_SegmentReader] = None
+        self._lock_file = None
+        self._lock_depth = 0
+        self._thread_lock = threading.RLock()
+        self._last_gap_check = 0.0
+        # 読むべきログを取りこぼし、ストアが他ワーカーと食い違っている
+        self.diverged = False
+        for store, _model in stores.values():
+            store.subscribe(self._on_change)
+
+    # --- ファイル配置 ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _numbered(self, pattern: "re.Pattern[str]") -> List[Tuple[int, str]]:
+        found = []
+        for name in os.listdir(self.directory):
+            match = pattern.match(name)
+            if match:
+                found.append((int(match.group(1)), name))
+        return sorted(found)
+
+    def _open_segment(self, number: int) -> None:
+        if self._file is not None:
+            self._sync_file()
+            self._file.close()
+        self._segment = number
+        self._file = open(self._path(_segment_name(number)), "ab")
+
+    def _sync_file(self) -> None:
+        self._file.flush()
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+        self._dirty = False
+
+    # --- 追記ログ ---
+
+    def _on_change(self, store_name: str, key: str, _old: Any, new: Any) -> None:
+        if self._replaying or self._file is None or store_name not in self.stores:
+            return
+        version = self.stores[store_name][0].last_version
+        if new is None:
+            entry = [_DELETE, store_name, key, None, version]
+        else:
+            entry = [_PUT, store_name, key, _dump(new), version]
+        if self._group is not None:
+            self._group.append(entry)
+        else:
+            self._write_entry(entry)
+
+    def _write_entry(self, entry: list) -> None:
+        self._file.write(self._packer.pack(entry))
+        if self.fsync == "always":
+            self._sync_file()
+        else:
+            self._dirty = True
+
+    @contextmanager
+    def grouped(self) -> Iterator[None]:
+        """ブロック内の書き込みを1件のエントリーにまとめて追記する（入れ子可）"""
+        with self._locked():
+            if self._group is not None:
+                yield
+                return
+            self._group = []
+            try:
+                yield
+            finally:
+                # 途中で例外になっても、ストアに反映済みの分はログにも残してストアと揃える
+                entries, self._group = self._group, None
+                if entries and self._file is not None:
+                    self._write_entry([_GROUP, entries])
+
+    async def flush(self) -> None:
+        """溜まった書き込みをファイルへ送り、fsync はスレッドで行う"""
+        if self._file is None or not self._dirty:
+            return
+        self._file.flush()
+        self._dirty = False
+        if self.fsync == "batch":
+            await asyncio.to_thread(os.fsync, self._file.fileno())
+
+    # --- 共有モード ---
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """他ワーカーの書き込みを取り込んでから、ログへの追記を独占する（入れ子可）"""
+        with self._thread_lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            self._lock_depth = 1
+            try:
+                self._follow()
+                self._prepare_append()
+                yield
+            finally:
+                self._lock_depth = 0
+                try:
+                    # 他ワーカーが読めるよう、ロックを放す前にファイルへ送る
+                    if self._file is not None:
+                        self._file.flush()
+                finally:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _locked(self) -> ContextManager[Any]:
+        return self.exclusive() if self._lock_file is not None else nullcontext()
+
+    def _prepare_append(self) -> None:
+        """ロックの中で、追記先を最新のセグメントの読み終えた位置に合わせる"""
+        if self.diverged:
+            raise RuntimeError("共有ログを取りこぼしたため、このワーカーでは書き込めません（再起動待ち）")
+        reader = self._reader
+        if reader is None or self._file is None:
+            return
+        if reader.pending:
+            # 他のワーカーが書きかけのまま落ちた。続けて書くと読めなくなるため新しいセグメントへ移る
+            print(f"WAL {reader.name}: 書きかけの末尾があるため新しいセグメントに切り替えます")
+            self._open_segment(reader.number + 1)
+        elif self._segment != reader.number:
+            self._open_segment(reader.number)
+
+    def _drain(self, reader: _SegmentReader) -> int:
+        applied = 0
+        self._replaying = True
+        try:
+            for entry in reader.entries():
+                self._apply_entry(entry)
+                applied += 1
+        finally:
+            self._replaying = False
+        return applied
+
+    def _follow(self) -> int:
+        """読み位置から最新のセグメントの末尾までを反映する"""
+        reader = self._reader
+        if reader is None:
+            return 0
+        applied = 0
+        while True:
+            if reader.has_more():
+                applied += self._drain(reader)
+            if not os.path.exists(self._path(_segment_name(reader.number + 1))):
+                return applied
+            # 切り替えはロックの中で行うため、次のセグメントがあれば今のセグメントへの追記は終わっている
+            applied += self._drain(reader)
+            reader.close()
+            reader = self._reader = _SegmentReader(self.directory, reader.number + 1)
+
+    def catch_up(self) -> int:
+        """他ワーカーの書き込みを反映する（リクエストの開始時と定期的に呼ぶ）"""
+        if self._reader is None:
+            return 0
+        with self._thread_lock:
+            applied = self._follow()
+        if applied:
+            LOG_APPLIED.inc(amount=applied)
+        return applied
+
+    def _check_gap(self) -> None:
+        """読むべきセグメントが既に削除されていないか確かめる
+
+        スナップショット2回分以上追従が遅れた場合だけ起こる。ストアを正しく戻せないため、
+        書き込みを止めて自分を終了し、uvicorn が起動し直したワーカーにスナップショットから読み込ませる。
+        """
+        segments = [number for number, _name in self._numbered(_SEGMENT_PATTERN)]
+        following = self._reader.number + 1
+        if not segments or segments[-1] <= following or following in segments:
+            return
+        print(f"WAL {_segment_name(following)} が既に削除されているため、このワーカーを再起動します")
+        self.diverged = True
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    # --- 復元 ---
+
+    def _apply_entry(self, entry: list) -> None:
+        if entry[0] == _GROUP:
+            for grouped_entry in entry[1]:
+                self._apply_entry(grouped_entry)
+            return
+        op, store_name, key, data = entry[:4]
+        version = entry[4] if len(entry) > 4 else None
+        if store_name not in self.stores:
+            return
+        store, model = self.stores[store_name]
+        store.restore(key, None if op == _DELETE else model.model_validate(data), version)
+
+    def _load_snapshot(self, name: str) -> Tuple[int, int]:
+        """スナップショットを読み込み、(続きから再生するログのセグメント番号, 取得時のバージョン) を返す"""
+        with open(self._path(name), "rb") as file:
+            unpacker = _unpacker(file)
+            header = next(unpacker, None)
+            if (
+                not isinstance(header, dict)
+                or header.get("format") != SNAPSHOT_FORMAT
+                or header.get("version") != SNAPSHOT_VERSION
+            ):
+                raise RuntimeError(f"未対応のスナップショットです: {name}")
+            count = 0
+            for entry in unpacker:
+                if isinstance(entry, dict):
+                    if entry.get("count") != count:
+                        raise RuntimeError(f"スナップショットの件数が一致しません: {name}")
+                    clock.observe(header["clock"])
+                    return header["wal_segment"], header["clock"]
+                store_name, key, data, version = entry
+                if store_name in self.stores:
+                    store, model = self.stores[store_name]
+                    store.restore(key, model.model_validate(data), version)
+                count += 1
+        raise RuntimeError(f"スナップショットが途中で切れています: {name}")
+
+    def load(self) -> Dict[str, float]:
+        """最新のスナップショットとそれ以降のログから復元し、新しいセグメントへの追記を始める"""
+        os.makedirs(self.directory, exist_ok=True)
+        if self.shared:
+            self._lock_file = open(self._path("wal.lock"), "a+b")
+        start = time.perf_counter()
+        # 大量のレコードを作る間に世代別GCが何度も全体を走査すると復元が数倍遅くなるため、止めておく
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with self._locked():
+                first_segment = 0
+                snapshot_version = 0
+                snapshots = self._numbered(_SNAPSHOT_PATTERN)
+                # スナップショットは書き終えてから名前を付けるため、壊れていればディスクの障害として起動を止める
+                if snapshots:
+                    self._replaying = True
+                    try:
+                        first_segment, snapshot_version = self._load_snapshot(snapshots[-1][1])
+                    finally:
+                        self._replaying = False
+                replayed = 0
+                last_segment = first_segment - 1
+                for number, _name in self._numbered(_SEGMENT_PATTERN):
+                    if number >= first_segment:
+                        reader = _SegmentReader(self.directory, number)
+                        replayed += self._drain(reader)
+                        reader.close()
+                        last_segment = number
+                # 書きかけの末尾の後ろに追記しないよう、起動のたびに新しいセグメントから書き始める
+                self._open_segment(last_segment + 1)
+                if self.shared:
+                    self._reader = _SegmentReader(self.directory, self._segment)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if self.shared:
+            set_write_lock(self.exclusive)
+        set_write_group(self.grouped)
+        records = sum(len(store) for store, _model in self.stores.values())
+        elapsed = time.perf_counter() - start
+        print(
+            f"Stores restored from {self.directory}: {records} records"
+            f" (replayed {replayed} log entries, {elapsed:.2f}s)"
+        )
+        return {
+            "records": records,
+            "replayed": replayed,
+            "seconds": elapsed,
+            "snapshot_version": snapshot_version,
+        }
+
+    # --- スナップショット ---
+
+    def _snapshot_entries(
+        self, items: Dict[str, List[Tuple[str, Any, Optional[int]]]]
+    ) -> Iterator[List[Any]]:
+        for store_name, records in items.items():
+            for key, record, version in records:
+                yield [store_name, key, _dump(record), version]
+
+    def _write_snapshot(
+        self, items: Dict[str, List[Tuple[str, Any, Optional[int]]]], segment: int, version: int
+    ) -> str:
+        packer = _packer()
+        name = f"snapshot-{segment:08d}.msgpack"
+        temporary = self._path(name + ".tmp")
+        count = 0
+        with open(temporary, "wb") as file:
+            file.write(packer.pack({
+                "format": SNAPSHOT_FORMAT,
+                "version": SNAPSHOT_VERSION,
+                "wal_segment": segment,
+                "clock": version,
+                "created_at": datetime.utcnow().isoformat(),
+            }))
+            for entry in self._snapshot_entries(items):
+                file.write(packer.pack(entry))
+                count += 1
+            file.write(packer.pack({"count": count}))
+            file.flush()
+            os.fsync(file.fileno())
+        previous = [number for number, _name in self._numbered(_SNAPSHOT_PATTERN) if number < segment]
+        os.replace(temporary, self._path(name))
+        # 共有モードでは追従の遅れたワーカーのために、1世代前のスナップショット以降のログを残す
+        keep_from = previous[-1] if self.shared and previous else segment
+        self._remove_before(keep_from, name)
+        return name
+
+    def _remove_before(self, segment: int, keep_snapshot: str) -> None:
+        for number, name in self._numbered(_SEGMENT_PATTERN):
+            if number < segment:
+                os.remove(self._path(name))
+        for _number, name in self._numbered(_SNAPSHOT_PATTERN):
+            if name != keep_snapshot:
+                os.remove(self._path(name))
+
+    async def snapshot(self) -> None:
+        """ログを新しいセグメントへ切り替え、その時点の全ストアを書き出す"""
+        async with self._snapshot_lock:
+            start = time.perf_counter()
+            # 切り替えと全レコードの取得を await なしで行い、スナップショットとログの境目を一致させる
+            with self._locked():
+                self._open_segment(self._segment + 1)
+                segment = self._segment
+                version = clock.value
+                items = {
+                    name: [(key, record, store.version(key)) for key, record in store.items()]
+                    for name, (store, _model) in self.stores.items()
+                }
+            # 停止時に呼び出し元が取り消されても書き出しは最後まで行い、close() がその完了を待つ
+            self._writing = asyncio.ensure_future(
+                asyncio.to_thread(self._write_snapshot, items, segment, version)
+            )
+            name = await asyncio.shield(self._writing)
+            records = sum(len(records) for records in items.values())
+            print(f"Snapshot {name} written: {records} records in {time.perf_counter() - start:.2f}s")
+
+    def needs_snapshot(self) -> bool:
+        if self._file is None:
+            return False
+        return os.fstat(self._file.fileno()).st_size >= PERSIST_SNAPSHOT_LOG_BYTES
+
+    async def run(self) -> None:
+        """fsync と、他ワーカーの書き込みの取り込みを定期的に行う（lifespan でタスクとして起動する）"""
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            await self.flush()
+            if self.shared and not self.diverged:
+                self.catch_up()
+                if time.monotonic() - self._last_gap_check >= _GAP_CHECK_SECONDS:
+                    self._last_gap_check = time.monotonic()
+                    self._check_gap()
+
+    async def close(self, snapshot: bool = True) -> None:
+        if self._file is None:
+            return
+        if self._writing is not None and not self._writing.done():
+            await asyncio.wait([self._writing])
+        if snapshot and not self.diverged:
+            await self.snapshot()
+        if self.shared:
+            set_write_lock(None)
+        set_write_group(None)
+        self._sync_file()
+        self._file.close()
+        self._file = None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
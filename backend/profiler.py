@@ -0,0 +1,196 @@
+"""稼働中プロセスのスタックをサンプリングする統計プロファイラ
+
+sys._current_frames() を別スレッドから一定間隔で取得し、
+flamegraph.pl / speedscope がそのまま読み込める collapsed 形式で集計する。
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Optional
+from uuid import uuid4
+
+MAX_PROFILE_SECONDS = 60.0
+MIN_INTERVAL_SECONDS = 0.001
+
+# スレッドが待機しているだけのフレーム（除外しないと結果が埋もれる）
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("profiler.py", "_run"),
+}
+
+
+def _thread_label(name: str) -> str:
+    # AnyIOのワーカースレッドは名前が共通なのでそのまままとめて集計される
+    return name.replace(" ", "_").replace(";", "_")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES
+
+
+class SamplingProfiler:
+    """指定間隔で全スレッド（または指定スレッド）のスタックを採取する"""
+
+    def __init__(
+        self,
+        interval: float = 0.005,
+        thread_ids: Optional[set] = None,
+        include_idle: bool = False,
+    ):
+        self.interval = max(interval, MIN_INTERVAL_SECONDS)
+        self.thread_ids = thread_ids
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.sample_count = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.time()
+        self._thread = threading.Thread(
+            target=self._run, name="salon-sampling-profiler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped_at = time.time()
+        return self
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                if not self.include_idle and _is_idle(frame):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(_thread_label(names.get(thread_id, str(thread_id))))
+                labels.reverse()
+                self.stacks[";".join(labels)] += 1
+            self.sample_count += 1
+
+    def collapsed(self) -> str:
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def summary(self) -> Dict[str, object]:
+        return {
+            "interval": self.interval,
+            "samples": self.sample_count,
+            "stacks": len(self.stacks),
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+        }
+
+
+class ProfileResultStore:
+    """リクエスト単位のプロファイル結果を新しい順に一定件数だけ保持する"""
+
+    def __init__(self, max_entries: int = 20):
+        self.max_entries = max_entries
+        self._results: "OrderedDict[str, Dict[str, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, profile_id: str, result: Dict[str, object]) -> None:
+        with self._lock:
+            self._results[profile_id] = result
+            self._results.move_to_end(profile_id)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, object]]:
+        with self._lock:
+            return self._results.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            return [
+                {"profile_id": profile_id, **{k: v for k, v in result.items() if k != "collapsed"}}
+                for profile_id, result in reversed(self._results.items())
+            ]
+
+
+profile_results = ProfileResultStore()
+
+# プロセス全体の時間指定プロファイルは同時に1本まで
+whole_process_lock = threading.Lock()
+
+
+class RequestProfilingMiddleware:
+    """X-Profile ヘッダー付きのリクエスト処理中だけサンプリングするASGIミドルウェア
+
+    認可は authorize(token) に委ね、許可された場合のみレスポンスに
+    X-Profile-Id を付与して結果を profile_results に保存する。
+    """
+
+    def __init__(self, app, authorize, interval: float = 0.002):
+        self.app = app
+        self.authorize = authorize
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        toggle = headers.get(b"x-profile", b"").decode("latin-1").lower()
+        if toggle not in ("1", "true", "on"):
+            await self.app(scope, receive, send)
+            return
+        token = headers.get(b"x-admin-token", b"").decode("latin-1")
+        if not self.authorize(token):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = str(uuid4())
+        profiler = SamplingProfiler(interval=self.interval).start()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-profile-id", profile_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            route = scope.get("route")
+            profile_results.put(
+                profile_id,
+                {
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "route": getattr(route, "path", None),
+                    **profiler.summary(),
+                    "collapsed": profiler.collapsed(),
+                },
+            )
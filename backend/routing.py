@@ -0,0 +1,173 @@
+"""AI呼び出しのモデル選択
+
+呼び出し箇所ごとにモデルの候補（先頭が品質優先の既定）と所要時間の目安を設定し、呼び出しのたびに順番を決める。
+
+- 実測の成功率が下がったモデルは候補の末尾に回す（時間が経って記録が古くなれば元に戻る）
+- 待ち時間の見積もり＋そのモデルの平均所要時間が目安を超えるなら、速いモデルを先頭にする
+  （ただし所要時間の実測が古くなったモデルは、見積もりを更新するためときどき目安を超えても先頭のまま試す）
+- 待ち行列が深いときも、行列を早くはけさせるため速いモデルを先頭にする
+
+先頭のモデルが失敗したら残りの候補を順に試し、結果を返したモデル名を呼び出し側へ返す。
+所要時間と成功率はワーカープロセスごとにモデル単位で集計する。
+"""
+
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+# 成功率を計算する期間と、判定に必要な最低件数
+MODEL_AVAILABILITY_WINDOW_SECONDS = float(os.getenv("AI_MODEL_AVAILABILITY_WINDOW_SECONDS", "300"))
+MODEL_AVAILABILITY_MIN_SAMPLES = int(os.getenv("AI_MODEL_AVAILABILITY_MIN_SAMPLES", "5"))
+# これを下回ったモデルは候補の末尾に回す
+MODEL_MIN_AVAILABILITY = float(os.getenv("AI_MODEL_MIN_AVAILABILITY", "0.5"))
+# 実測がないモデルの所要時間の仮定値
+DEFAULT_EXPECTED_SECONDS = 10.0
+# 目安を超えると見積もられて使われないモデルも、最後の呼び出しからこの秒数が経てば1回試して実測し直す（0で無効）。
+# 見積もりは呼び出したときにしか更新されないため、これがないと一度遅かったモデルはずっと選ばれない
+MODEL_PROBE_INTERVAL_SECONDS = float(os.getenv("AI_MODEL_PROBE_INTERVAL_SECONDS", "300"))
+
+AI_MODEL_SERVED = REGISTRY.counter(
+    "salon_ai_model_served_total",
+    "結果を返したAIモデルと選ばれた理由（reason=preferred/latency_budget/queue_depth/availability/probe/fallback）",
+    ("call_site", "model", "reason"),
+)
+AI_MODEL_AVAILABILITY = REGISTRY.gauge(
+    "salon_ai_model_availability",
+    "直近のAIモデル呼び出しの成功率",
+    ("model",),
+)
+AI_MODEL_EXPECTED_SECONDS = REGISTRY.gauge(
+    "salon_ai_model_expected_seconds",
+    "AIモデル呼び出しの所要時間の移動平均（成功分）",
+    ("model",),
+)
+
+# リクエストごとに指定されたAI呼び出しの所要時間の目安（秒）
+_latency_budget: ContextVar[Optional[float]] = ContextVar("ai_latency_budget", default=None)
+
+
+@contextmanager
+def latency_budget(seconds: Optional[float]) -> Iterator[None]:
+    """このブロック内（とそこから起動したタスク）のAI呼び出しの所要時間の目安を指定する"""
+    token = _latency_budget.set(seconds)
+    try:
+        yield
+    finally:
+        _latency_budget.reset(token)
+
+
+def current_latency_budget(default: Optional[float]) -> Optional[float]:
+    budget = _latency_budget.get()
+    return default if budget is None else budget
+
+
+@dataclass
+class ModelRoute:
+    # 品質を優先した順のモデル名
+    models: List[str]
+    # 待ち時間を含めた所要時間の目安（None なら制限しない）
+    latency_budget: Optional[float] = None
+
+
+@dataclass
+class _ModelStats:
+    expected_seconds: float
+    # (時刻, 成功したか)
+    outcomes: Deque[Tuple[float, bool]] = field(default_factory=lambda: deque(maxlen=100))
+    # 見積もりの更新のために最後に試した時刻
+    probed_at: Optional[float] = None
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        routes: Dict[str, ModelRoute],
+        expected_seconds: Optional[Dict[str, float]] = None,
+        queue_depth_threshold: int = 0,
+    ):
+        self.routes = routes
+        self.queue_depth_threshold = queue_depth_threshold
+        self._priors = expected_seconds or {}
+        self._stats: Dict[str, _ModelStats] = {}
+
+    def _model_stats(self, model: str) -> _ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = _ModelStats(self._priors.get(model, DEFAULT_EXPECTED_SECONDS))
+        return stats
+
+    def expected_seconds(self, model: str) -> float:
+        return self._model_stats(model).expected_seconds
+
+    def availability(self, model: str, now: Optional[float] = None) -> Optional[float]:
+        """直近の成功率（件数が足りなければ None）"""
+        outcomes = self._model_stats(model).outcomes
+        now = time.monotonic() if now is None else now
+        while outcomes and now - outcomes[0][0] > MODEL_AVAILABILITY_WINDOW_SECONDS:
+            outcomes.popleft()
+        if len(outcomes) < MODEL_AVAILABILITY_MIN_SAMPLES:
+            return None
+        return sum(1 for _at, ok in outcomes if ok) / len(outcomes)
+
+    def _is_available(self, model: str) -> bool:
+        availability = self.availability(model)
+        return availability is None or availability >= MODEL_MIN_AVAILABILITY
+
+    def _should_probe(self, model: str, now: float) -> bool:
+        """見積もりが古いので、目安を超えても試して実測し直すか（同時に来た呼び出しでは1回だけ）"""
+        if MODEL_PROBE_INTERVAL_SECONDS <= 0:
+            return False
+        stats = self._model_stats(model)
+        last = max(
+            stats.outcomes[-1][0] if stats.outcomes else float("-inf"),
+            stats.probed_at if stats.probed_at is not None else float("-inf"),
+        )
+        if now - last < MODEL_PROBE_INTERVAL_SECONDS:
+            return False
+        stats.probed_at = now
+        return True
+
+    def plan(
+        self,
+        call_site: str,
+        latency_budget: Optional[float] = None,
+        queue_wait: float = 0.0,
+        queue_depth: int = 0,
+    ) -> Tuple[List[str], str]:
+        """試す順のモデルと、先頭を選んだ理由を返す"""
+        route = self.routes[call_site]
+        available = [model for model in route.models if self._is_available(model)]
+        if not available:
+            # すべて不調なら既定の順で試す
+            return list(route.models), "availability"
+        reason = "preferred" if available[0] == route.models[0] else "availability"
+        chosen = available[0]
+        fastest = min(available, key=self.expected_seconds)
+        budget = route.latency_budget if latency_budget is None else latency_budget
+        if fastest != chosen:
+            if budget is not None and queue_wait + self.expected_seconds(chosen) > budget:
+                if self._should_probe(chosen, time.monotonic()):
+                    reason = "probe"
+                else:
+                    chosen, reason = fastest, "latency_budget"
+            elif self.queue_depth_threshold > 0 and queue_depth >= self.queue_depth_threshold:
+                chosen, reason = fastest, "queue_depth"
+        ordered = [chosen] + [model for model in available if model != chosen]
+        ordered += [model for model in route.models if model not in available]
+        return ordered, reason
+
+    def record(self, model: str, ok: bool, seconds: float) -> None:
+        stats = self._model_stats(model)
+        stats.outcomes.append((time.monotonic(), ok))
+        if ok:
+            stats.expected_seconds += (seconds - stats.expected_seconds) * 0.2
+            AI_MODEL_EXPECTED_SECONDS.set(stats.expected_seconds, model)
+        availability = self.availability(model)
+        if availability is not None:
+            AI_MODEL_AVAILABILITY.set(availability, model)
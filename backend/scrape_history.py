@@ -0,0 +1,160 @@
+"""スクレイピング結果の版管理と差分計算
+
+出展者一覧の各項目を正規化テキスト＋hrefのフィンガープリントで識別し、
+再スクレイピングごとに追加・削除・変更の差分だけを版として保存する。
+履歴は pydantic モデルにして他のストアと同じく永続化・ワーカー間の共有ができるようにしている。
+"""
+
+import hashlib
+import re
+import unicodedata
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from pydantic import BaseModel, Field
+
+# 比較対象から外す項目（取得したページ位置などは出展者の変化ではない）
+_VOLATILE_KEYS = {"fingerprint", "page_url"}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text or "")).strip().lower()
+
+
+def normalize_href(href: Optional[str]) -> str:
+    if not href:
+        return ""
+    parts = urlsplit(href.strip())
+    path = parts.path.rstrip("/") or parts.path
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+
+def item_fingerprint(item: Dict[str, Any]) -> str:
+    text = normalize_text(str(item.get("text") or item.get("title") or ""))
+    href = normalize_href(item.get("href") or item.get("url"))
+    return hashlib.sha1(f"{text}\n{href}".encode("utf-8")).hexdigest()[:16]
+
+
+def _content(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in item.items() if key not in _VOLATILE_KEYS}
+
+
+def diff_items(
+    old: Dict[str, Dict[str, Any]], new: Dict[str, Dict[str, Any]]
+) -> Dict[str, List[Dict[str, Any]]]:
+    """フィンガープリントをキーにした2つの項目集合の差分を求める
+
+    同じhrefのまま名称だけ変わった項目は削除＋追加ではなく変更として扱う。
+    """
+    added = [item for fp, item in new.items() if fp not in old]
+    removed = [item for fp, item in old.items() if fp not in new]
+    changed = [
+        {"before": old[fp], "after": item}
+        for fp, item in new.items()
+        if fp in old and _content(old[fp]) != _content(item)
+    ]
+
+    removed_by_href: Dict[str, Dict[str, Any]] = {}
+    for item in removed:
+        href = normalize_href(item.get("href"))
+        if href:
+            removed_by_href.setdefault(href, item)
+    renamed = set()
+    still_added = []
+    for item in added:
+        before = removed_by_href.pop(normalize_href(item.get("href")), None) if item.get("href") else None
+        if before is None:
+            still_added.append(item)
+            continue
+        changed.append({"before": before, "after": item})
+        renamed.add(before["fingerprint"])
+    return {
+        "added": still_added,
+        "removed": [item for item in removed if item["fingerprint"] not in renamed],
+        "changed": changed,
+    }
+
+
+class ScrapeVersion(BaseModel):
+    version: int
+    parsed_at: datetime
+    source_url: Optional[str]
+    added: List[Dict[str, Any]] = Field(default_factory=list)
+    removed: List[Dict[str, Any]] = Field(default_factory=list)
+    changed: List[Dict[str, Any]] = Field(default_factory=list)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "parsed_at": self.parsed_at,
+            "source_url": self.source_url,
+            "added": len(self.added),
+            "removed": len(self.removed),
+            "changed": len(self.changed),
+        }
+
+
+class ScrapeHistory(BaseModel):
+    """イベント1件分の現在の項目集合と差分の履歴（各版には差分のみ保持する）"""
+
+    current: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+    versions: List[ScrapeVersion] = Field(default_factory=list)
+
+    @property
+    def version(self) -> int:
+        return self.versions[-1].version if self.versions else 0
+
+    def apply(
+        self,
+        items: List[Dict[str, Any]],
+        parsed_at: datetime,
+        source_url: Optional[str] = None,
+    ) -> Optional[ScrapeVersion]:
+        """新しい抽出結果を取り込み、差分があれば新しい版として記録する（items に fingerprint を付与）"""
+        incoming: Dict[str, Dict[str, Any]] = {}
+        for item in items:
+            fingerprint = item_fingerprint(item)
+            item["fingerprint"] = fingerprint
+            incoming.setdefault(fingerprint, item)
+
+        delta = diff_items(self.current, incoming)
+        self.current = incoming
+        if not any(delta.values()):
+            return None
+        version = ScrapeVersion(
+            version=self.version + 1,
+            parsed_at=parsed_at,
+            source_url=source_url,
+            **delta,
+        )
+        self.versions.append(version)
+        return version
+
+    def items_at(self, version: int) -> Dict[str, Dict[str, Any]]:
+        """現在の集合から新しい版の差分を逆適用して、指定版時点の集合を復元する"""
+        state = dict(self.current)
+        for entry in reversed(self.versions):
+            if entry.version <= version:
+                break
+            for item in entry.added:
+                state.pop(item["fingerprint"], None)
+            for change in entry.changed:
+                state.pop(change["after"]["fingerprint"], None)
+                state[change["before"]["fingerprint"]] = change["before"]
+            for item in entry.removed:
+                state[item["fingerprint"]] = item
+        return state
+
+    def changes_since(self, since: int) -> Dict[str, Any]:
+        """since版から現在までの正味の差分（途中で追加・削除された項目は打ち消す）"""
+        since = max(0, min(since, self.version))
+        delta = diff_items(self.items_at(since), self.current)
+        return {
+            "since": since,
+            "current_version": self.version,
+            **delta,
+            "versions": [entry.summary() for entry in self.versions if entry.version > since],
+        }
@@ -0,0 +1,251 @@
+"""展示会サイトHTMLからの出展者情報抽出エンジン
+
+数MBある出展者一覧ページの解析でイベントループを塞がないよう、
+大きなHTMLはプロセスプールで解析する。パーサーは SCRAPE_PARSER で選択でき、
+selectolax(lexbor) / lxml が無い環境では BeautifulSoup(html.parser) にフォールバックする。
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import REGISTRY
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # pragma: no cover - 依存が無い環境向け
+    LexborHTMLParser = None
+
+try:
+    import lxml.etree
+    import lxml.html
+    from cssselect import GenericTranslator
+except ImportError:  # pragma: no cover - 依存が無い環境向け
+    lxml = None
+    GenericTranslator = None
+
+from bs4 import BeautifulSoup
+import soupsieve
+
+PARSER_BACKENDS = ("selectolax", "lxml", "html.parser")
+
+SCRAPE_PARSER = os.getenv("SCRAPE_PARSER", "auto")
+SCRAPE_POOL_WORKERS = int(os.getenv("SCRAPE_POOL_WORKERS", "2"))
+# これより小さいHTMLはプロセス間転送のコストの方が大きいのでスレッドで解析する
+SCRAPE_PROCESS_MIN_BYTES = int(os.getenv("SCRAPE_PROCESS_MIN_BYTES", str(256 * 1024)))
+
+SCRAPE_PARSE_DURATION = REGISTRY.histogram(
+    "salon_scrape_parse_duration_seconds",
+    "スクレイピングHTML解析の所要時間（パーサー・実行場所別）",
+    ("parser", "executor"),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+
+def resolve_parser(name: Optional[str] = None) -> str:
+    """設定値から利用可能なパーサーを決定する（auto は速いものから順に選ぶ）"""
+    name = (name or SCRAPE_PARSER or "auto").lower()
+    available = {
+        "selectolax": LexborHTMLParser is not None,
+        "lxml": lxml is not None and GenericTranslator is not None,
+        "html.parser": True,
+    }
+    if name in available and available[name]:
+        return name
+    if name not in ("auto",) and name not in available:
+        print(f"Warning: unknown SCRAPE_PARSER={name}, falling back to auto")
+    for backend in PARSER_BACKENDS:
+        if available[backend]:
+            return backend
+    return "html.parser"
+
+
+@lru_cache(maxsize=256)
+def _compile_soupsieve(selector: str):
+    return soupsieve.compile(selector)
+
+
+@lru_cache(maxsize=256)
+def _compile_lxml(selector: str):
+    return lxml.etree.XPath(GenericTranslator().css_to_xpath(selector))
+
+
+def _parse_bs4(html: str):
+    return BeautifulSoup(html, "html.parser")
+
+
+def _select_bs4(soup, selector: str, include_links: bool):
+    for element in _compile_soupsieve(selector).iselect(soup):
+        href = element.get("href") if include_links else None
+        yield element.get_text(strip=True), href
+
+
+def _parse_lxml(html: str):
+    return lxml.html.fromstring(html)
+
+
+def _select_lxml(root, selector: str, include_links: bool):
+    for element in _compile_lxml(selector)(root):
+        text = "".join(part.strip() for part in element.itertext())
+        href = element.get("href") if include_links else None
+        yield text, href
+
+
+def _parse_selectolax(html: str):
+    return LexborHTMLParser(html)
+
+
+def _select_selectolax(tree, selector: str, include_links: bool):
+    for node in tree.css(selector):
+        text = node.text(deep=True, separator="", strip=True)
+        href = node.attributes.get("href") if include_links else None
+        yield text, href
+
+
+# パーサー名 -> (HTMLを解析する関数, 解析済みツリーにセレクタを適用する関数)
+_BACKENDS = {
+    "selectolax": (_parse_selectolax, _select_selectolax),
+    "lxml": (_parse_lxml, _select_lxml),
+    "html.parser": (_parse_bs4, _select_bs4),
+}
+
+
+def _validate_selectors(selectors: List[str], parser: str) -> None:
+    # lxml は解析前に全セレクタをコンパイルして構文エラーを早めに検出する
+    if parser == "lxml":
+        for selector in selectors:
+            _compile_lxml(selector)
+
+
+def iter_items(
+    tree: Any,
+    selectors: List[str],
+    include_links: bool = True,
+    parser: str = "html.parser",
+) -> Iterator[Dict[str, Any]]:
+    """セレクタ順に抽出結果を逐次返す（呼び出し側が必要数で打ち切れる）"""
+    select = _BACKENDS[parser][1]
+    seen = set()
+    for selector in selectors:
+        for text, href in select(tree, selector, include_links):
+            if not text:
+                continue
+            key = (selector, text)
+            if key in seen:
+                continue
+            seen.add(key)
+            entry: Dict[str, Any] = {"text": text, "selector": selector}
+            if href:
+                entry["href"] = href
+            yield entry
+
+
+def extract_page(
+    html: str,
+    selectors: List[str],
+    limit: int,
+    include_links: bool = True,
+    parser: str = "html.parser",
+    link_selectors: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """limit件に達した時点で解析を打ち切って抽出結果を返す
+
+    link_selectors を指定すると、同じ解析結果からページ送りリンクのhrefも返す。
+    高速パーサーが対応していないセレクタ（soupsieve独自の疑似クラスなど）は
+    html.parser で解析し直す。プロセスプールのワーカーからも呼ばれる。
+    """
+    items: List[Dict[str, Any]] = []
+    links: List[str] = []
+    try:
+        _validate_selectors(selectors + (link_selectors or []), parser)
+        tree = _BACKENDS[parser][0](html)
+        if limit > 0:
+            for entry in iter_items(tree, selectors, include_links, parser):
+                items.append(entry)
+                if len(items) >= limit:
+                    break
+        select = _BACKENDS[parser][1]
+        for selector in link_selectors or []:
+            for _, href in select(tree, selector, True):
+                if href and href not in links:
+                    links.append(href)
+    except Exception as exc:
+        if parser == "html.parser":
+            raise
+        print(f"Warning: {parser} failed to evaluate selectors ({exc}), retrying with html.parser")
+        return extract_page(html, selectors, limit, include_links, "html.parser", link_selectors)
+    return {"items": items, "links": links}
+
+
+def extract_items(
+    html: str,
+    selectors: List[str],
+    limit: int,
+    include_links: bool = True,
+    parser: str = "html.parser",
+) -> List[Dict[str, Any]]:
+    return extract_page(html, selectors, limit, include_links, parser)["items"]
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if SCRAPE_POOL_WORKERS <= 0:
+        return None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=SCRAPE_POOL_WORKERS)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def parse_scrape_page(
+    html: str,
+    selectors: List[str],
+    limit: int,
+    include_links: bool = True,
+    parser: Optional[str] = None,
+    link_selectors: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """HTMLを解析して抽出結果を返す（大きなHTMLはプロセスプール、それ以外はスレッド）"""
+    global _executor
+    backend = resolve_parser(parser)
+    executor = _get_executor() if len(html) >= SCRAPE_PROCESS_MIN_BYTES else None
+    args = (html, selectors, limit, include_links, backend, link_selectors)
+    start = time.perf_counter()
+    if executor is not None:
+        try:
+            result = await asyncio.wrap_future(executor.submit(extract_page, *args))
+            SCRAPE_PARSE_DURATION.observe(time.perf_counter() - start, backend, "process")
+            return result
+        except BrokenProcessPool as exc:
+            # ワーカーが落ちた場合はプールを作り直し、今回はスレッドで処理する
+            print(f"Warning: scrape process pool is broken ({exc}), falling back to thread")
+            _executor = None
+    result = await run_in_threadpool(extract_page, *args)
+    SCRAPE_PARSE_DURATION.observe(time.perf_counter() - start, backend, "thread")
+    return result
+
+
+async def parse_scrape_items(
+    html: str,
+    selectors: List[str],
+    limit: int,
+    include_links: bool = True,
+    parser: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    result = await parse_scrape_page(html, selectors, limit, include_links, parser)
+    return result["items"]
@@ -0,0 +1,313 @@
+"""来場ノート・キーワードメモ・資料OCRテキストの全文検索
+
+外部サービスを使わず、文字バイグラムの転置インデックスとBM25で順位付けする。
+日本語は分かち書きせずに連続する文字をバイグラムに分割し、英数字は単語単位で扱う。
+
+ポスティングはスロット番号（文書の登録順）の昇順に追記するだけの array で持ち、
+問い合わせ時に NumPy 配列として読み出して searchsorted で AND 結合する。
+更新・削除は旧スロットを無効化して新しいスロットに追記し、無効スロットが増えたら作り直す。
+"""
+
+import math
+import re
+import unicodedata
+from array import array
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_WIDTH = 80
+SNIPPET_LEAD = 24
+# 1文字のクエリを展開する際に、対象とするバイグラムの上限
+MAX_EXPANDED_TERMS = 512
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[^\W_a-z0-9]+")
+_TF_MAX = 65535
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def tokenize(text: str) -> List[str]:
+    """英数字は単語、それ以外の連続文字はバイグラム（1文字だけならその文字）に分割する"""
+    tokens: List[str] = []
+    for run in _TOKEN_PATTERN.findall(normalize(text)):
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def query_terms(query: str) -> List[str]:
+    """ハイライト用に、空白区切りのクエリ語を正規化して返す"""
+    return [term for term in (normalize(part) for part in query.split()) if term]
+
+
+def _grow(values: np.ndarray, size: int, fill: Any) -> np.ndarray:
+    if size <= len(values):
+        return values
+    grown = np.full(max(size, len(values) * 2, 64), fill, dtype=values.dtype)
+    grown[: len(values)] = values
+    return grown
+
+
+@dataclass
+class SearchHit:
+    key: str
+    score: float
+    fields: Dict[str, Any]
+    snippet: str
+    highlights: List[Tuple[int, int]]
+
+
+@dataclass
+class SearchPage:
+    total: int
+    hits: List[SearchHit] = field(default_factory=list)
+
+
+def make_snippet(text: str, terms: List[str]) -> Tuple[str, List[Tuple[int, int]]]:
+    """最初に一致した語の周辺を切り出し、スニペット内の一致位置 (開始, 終了) を返す"""
+    if not text:
+        return "", []
+    # 1文字ずつ正規化して、正規化後の位置から元の文字位置を引けるようにする
+    normalized_chars: List[str] = []
+    origins: List[int] = []
+    for position, char in enumerate(text):
+        for normalized_char in normalize(char):
+            normalized_chars.append(normalized_char)
+            origins.append(position)
+    haystack = "".join(normalized_chars)
+
+    matches: List[Tuple[int, int]] = []
+    for term in terms:
+        start = haystack.find(term)
+        while start != -1:
+            matches.append((origins[start], origins[start + len(term) - 1] + 1))
+            start = haystack.find(term, start + len(term))
+    matches.sort()
+
+    begin = max(0, matches[0][0] - SNIPPET_LEAD) if matches else 0
+    end = min(len(text), begin + SNIPPET_WIDTH)
+    highlights: List[Tuple[int, int]] = []
+    for start, stop in matches:
+        if start < begin or stop > end or (highlights and start < highlights[-1][1] + begin):
+            continue
+        highlights.append((start - begin, stop - begin))
+    snippet = text[begin:end]
+    prefix = "…" if begin > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    offset = len(prefix)
+    return (
+        prefix + snippet + suffix,
+        [(start + offset, stop + offset) for start, stop in highlights],
+    )
+
+
+class SearchIndex:
+    """文書キー -> (本文, 付随フィールド) の転置インデックス
+
+    filter_fields に指定したフィールドは整数コード化して保持し、検索時の絞り込みに使う。
+    """
+
+    def __init__(self, filter_fields: Tuple[str, ...] = ()):
+        self.filter_fields = filter_fields
+        self._slots: Dict[str, int] = {}
+        self._keys: List[Optional[str]] = []
+        self._texts: List[Optional[str]] = []
+        self._fields: List[Optional[Dict[str, Any]]] = []
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        # 1文字クエリの展開用（文字 -> その文字を含むバイグラム）
+        self._char_terms: Dict[str, Set[str]] = {}
+        self._codes: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._filter_codes = {name: np.zeros(0, dtype=np.int32) for name in filter_fields}
+        self._total_length = 0
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._slots
+
+    def _code(self, value: Optional[str], create: bool) -> int:
+        if value is None:
+            return 0
+        code = self._codes.get(value)
+        if code is None and create:
+            code = len(self._codes) + 1
+            self._codes[value] = code
+        return code or -1
+
+    def add(self, key: str, text: str, fields: Optional[Dict[str, Any]] = None) -> None:
+        """文書を登録する（同じキーがあれば置き換える）"""
+        self.remove(key)
+        fields = dict(fields or {})
+        slot = len(self._keys)
+        self._keys.append(key)
+        self._texts.append(text)
+        self._fields.append(fields)
+        self._slots[key] = slot
+
+        capacity = slot + 1
+        self._alive = _grow(self._alive, capacity, False)
+        self._lengths = _grow(self._lengths, capacity, 0)
+        for name in self.filter_fields:
+            codes = _grow(self._filter_codes[name], capacity, 0)
+            codes[slot] = self._code(fields.get(name), create=True)
+            self._filter_codes[name] = codes
+
+        tokens = tokenize(text)
+        self._alive[slot] = True
+        self._lengths[slot] = len(tokens)
+        self._total_length += len(tokens)
+
+        frequencies: Dict[str, int] = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for token, frequency in frequencies.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = (array("i"), array("H"))
+                self._postings[token] = posting
+                if len(token) == 2 and not token.isascii():
+                    for char in set(token):
+                        self._char_terms.setdefault(char, set()).add(token)
+            posting[0].append(slot)
+            posting[1].append(min(frequency, _TF_MAX))
+
+    def remove(self, key: str) -> None:
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        self._alive[slot] = False
+        self._total_length -= int(self._lengths[slot])
+        self._keys[slot] = None
+        self._texts[slot] = None
+        self._fields[slot] = None
+        self._dead += 1
+        if self._dead > 1024 and self._dead > len(self._slots):
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        live = [
+            (key, self._texts[slot], self._fields[slot]) for key, slot in self._slots.items()
+        ]
+        live.sort(key=lambda entry: self._slots[entry[0]])
+        self.__init__(self.filter_fields)
+        for key, text, fields in live:
+            self.add(key, text or "", fields)
+
+    def _term_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """有効な文書だけのスロット（昇順）と語頻度を返す
+
+        無効スロットがなければ array をそのまま読むビューを返す。ビューが残っている間は
+        array に追記できないため、呼び出し側は検索処理の中だけで使い捨てること。
+        """
+        posting = self._postings.get(term)
+        if posting is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint16)
+        slots = np.frombuffer(posting[0], dtype=np.int32)
+        frequencies = np.frombuffer(posting[1], dtype=np.uint16)
+        if not self._dead:
+            return slots, frequencies
+        alive = self._alive[slots]
+        return slots[alive], frequencies[alive]
+
+    def _clause_postings(self, terms: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """OR 結合した語のポスティング（スロット昇順・重複なし）と語頻度を返す"""
+        if len(terms) == 1:
+            return self._term_postings(terms[0])
+        parts = [self._term_postings(term) for term in terms]
+        slots = np.concatenate([part[0] for part in parts])
+        weights = np.concatenate([part[1] for part in parts])
+        # スロット番号で数え上げる方がソートより速い（文書数ぶんの一時配列で済む）
+        counts = np.bincount(slots, weights=weights, minlength=len(self._keys))
+        unique = np.flatnonzero(counts).astype(np.int32)
+        return unique, counts[unique]
+
+    def _clauses(self, query: str) -> List[List[str]]:
+        clauses: List[List[str]] = []
+        for token in dict.fromkeys(tokenize(query)):
+            if len(token) == 1 and not token.isascii():
+                # バイグラムの一部としてしか現れない1文字は、その文字を含むバイグラムのORで探す
+                expanded = sorted(self._char_terms.get(token, ()))[:MAX_EXPANDED_TERMS]
+                clauses.append(([token] if token in self._postings else []) + expanded or [token])
+            else:
+                clauses.append([token])
+        return clauses
+
+    def search(
+        self,
+        query: str,
+        filters: Optional[Dict[str, Optional[str]]] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> SearchPage:
+        """全ての語を含む文書をBM25で順位付けして返す（filters は完全一致の絞り込み）"""
+        clauses = self._clauses(query)
+        live = len(self._slots)
+        if not clauses or not live:
+            return SearchPage(total=0)
+
+        postings = [self._clause_postings(terms) for terms in clauses]
+        if any(len(slots) == 0 for slots, _ in postings):
+            return SearchPage(total=0)
+        postings.sort(key=lambda posting: len(posting[0]))
+
+        candidates = postings[0][0]
+        for name, value in (filters or {}).items():
+            if value is None:
+                continue
+            code = self._code(value, create=False)
+            candidates = candidates[self._filter_codes[name][candidates] == code]
+        for slots, _ in postings[1:]:
+            if len(candidates) == 0:
+                break
+            positions = np.minimum(np.searchsorted(slots, candidates), len(slots) - 1)
+            candidates = candidates[slots[positions] == candidates]
+        if len(candidates) == 0:
+            return SearchPage(total=0)
+
+        average_length = max(self._total_length / live, 1.0)
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[candidates] / average_length)
+        scores = np.zeros(len(candidates), dtype=np.float32)
+        for slots, frequencies in postings:
+            document_frequency = len(slots)
+            idf = math.log(1 + (live - document_frequency + 0.5) / (document_frequency + 0.5))
+            tf = frequencies[np.searchsorted(slots, candidates)].astype(np.float32)
+            scores += idf * tf * (BM25_K1 + 1) / (tf + norms)
+
+        total = len(candidates)
+        wanted = min(offset + limit, total)
+        if wanted <= offset:
+            return SearchPage(total=total)
+        if wanted < total:
+            top = np.argpartition(-scores, wanted - 1)[:wanted]
+        else:
+            top = np.arange(total)
+        # 同点は新しい文書を先にする
+        order = top[np.lexsort((-candidates[top], -scores[top]))][offset:wanted]
+
+        terms = query_terms(query)
+        hits = []
+        for position in order:
+            slot = int(candidates[position])
+            snippet, highlights = make_snippet(self._texts[slot] or "", terms)
+            hits.append(
+                SearchHit(
+                    key=self._keys[slot],
+                    score=round(float(scores[position]), 4),
+                    fields=self._fields[slot],
+                    snippet=snippet,
+                    highlights=highlights,
+                )
+            )
+        return SearchPage(total=total, hits=hits)
@@ -0,0 +1,119 @@
+"""一覧レスポンスの高速なJSON化
+
+response_model を指定したエンドポイントは、戻り値のモデルを呼び出しのたびに検証し直してからJSONにするため、
+長い ai_research や scraped_context を持つレコードが多いと一覧の取得だけでCPUを使い切る。
+ここではレコードごとのJSON断片を (ストア名, キー) 単位でストアのバージョンと組にしてキャッシュし、
+一覧は断片を連結しただけのバイト列として返す。書き込み時はストアの購読で断片を破棄する。
+
+FieldSelection で返す項目を絞った場合は、model_dump の段階で項目を落としてからJSON化する。
+名前の付いた表示形式（full / compact）だけを断片として保存し、任意の項目の組み合わせは都度JSON化する。
+"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional, Tuple
+
+import orjson
+import pydantic_core
+from fastapi.responses import Response
+
+from stores import RecordStore
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+# レコード -> JSON化する dict（表示形式ごとの射影。None はモデルの全項目）
+Projection = Callable[[Any], Dict[str, Any]]
+
+
+def dumps(value: Any) -> bytes:
+    return orjson.dumps(value, option=_ORJSON_OPTIONS)
+
+
+def record_json(record: Any, projection: Optional[Projection] = None) -> bytes:
+    """pydantic モデルを response_model 経由と同じ内容のJSONにする"""
+    data = projection(record) if projection is not None else record.model_dump()
+    try:
+        return dumps(data)
+    except TypeError:
+        # orjson が扱えない値（scraped_data 内の独自型など）は pydantic に任せる
+        return pydantic_core.to_json(data)
+
+
+@dataclass(frozen=True)
+class FieldSelection:
+    """一覧で返す項目の指定"""
+
+    # None は全項目
+    include: Optional[FrozenSet[str]] = None
+    exclude: FrozenSet[str] = frozenset()
+    # 断片キャッシュに使う表示形式名（None は保存しない）
+    view: Optional[str] = "full"
+
+    def projection(self) -> Optional[Projection]:
+        if self.include is None and not self.exclude:
+            return None
+        include = set(self.include) if self.include is not None else None
+        exclude = set(self.exclude) or None
+        return lambda record: record.model_dump(include=include, exclude=exclude)
+
+
+FULL = FieldSelection()
+
+
+class JSONBytesResponse(Response):
+    """JSON化済みのバイト列をそのまま返す"""
+
+    media_type = "application/json"
+
+
+class FragmentCache:
+    """(ストア名, キー) -> {表示形式: (バージョン, JSON断片)}"""
+
+    def __init__(self):
+        self._fragments: Dict[Tuple[str, str], Dict[str, Tuple[Optional[int], bytes]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._fragments)
+
+    def invalidate(self, store_name: str, key: str, _old: Any, _new: Any) -> None:
+        """ストアの購読者として登録し、書き込み・削除のたびに断片を破棄する"""
+        self._fragments.pop((store_name, key), None)
+
+    def fragment(
+        self,
+        store: RecordStore,
+        key: str,
+        record: Any,
+        view: Optional[str] = "full",
+        projection: Optional[Projection] = None,
+    ) -> bytes:
+        if view is None:
+            return record_json(record, projection)
+        version = store.version(key)
+        views = self._fragments.get((store.name, key))
+        if views is not None:
+            cached = views.get(view)
+            # ストアに入っていない（組み立て途中の）レコードや古い版の断片は使わない
+            if cached is not None and version is not None and cached[0] == version:
+                return cached[1]
+        data = record_json(record, projection)
+        if version is not None and store.get(key) is record:
+            self._fragments.setdefault((store.name, key), {})[view] = (version, data)
+        return data
+
+    def list_response(
+        self,
+        store: RecordStore,
+        records: Iterable[Any],
+        key_field: str,
+        selection: FieldSelection = FULL,
+    ) -> JSONBytesResponse:
+        """レコードの一覧を、キャッシュした断片の連結で返す"""
+        projection = selection.projection()
+        body = b"[" + b",".join(
+            self.fragment(store, getattr(record, key_field), record, selection.view, projection)
+            for record in records
+        ) + b"]"
+        return JSONBytesResponse(content=body)
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,217 @@
+"""ノート・事前調査レポート・資料OCRテキストの類似検索
+
+外部サービスを使わず、文字バイグラム（英数字は単語）を符号付き特徴ハッシングで
+固定次元のベクトルにし、連続した NumPy 行列に並べて内積（正規化済みなのでコサイン類似度）で
+上位k件を求める。複数の問い合わせは行列積1回でまとめて処理する。
+
+索引の更新はストアの購読者としてイベントループ上で、検索はスレッドプールで行われるため、
+状態の読み書きはロックで守り、時間のかかる行列積だけをロックの外で行う。
+"""
+
+import os
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from search import tokenize
+
+SIMILARITY_DIM = int(os.getenv("SIMILARITY_DIM", "512"))
+# 行列積1回あたりに扱う文書数（一時的な類似度行列のメモリを抑える）
+_CHUNK_ROWS = 65536
+
+
+def _token_features(token: str, dim: int) -> Tuple[int, float]:
+    # プロセス間で同じベクトルになるよう、ソルト付きの hash() ではなく crc32 を使う
+    digest = zlib.crc32(token.encode("utf-8"))
+    return digest % dim, (1.0 if digest & 0x80000000 else -1.0)
+
+
+def vectorize(text: str, dim: int = SIMILARITY_DIM) -> Optional[np.ndarray]:
+    """L2正規化したハッシュ化n-gramベクトル。特徴がなければ None"""
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    features = [_token_features(token, dim) for token in tokens]
+    indices = np.fromiter((index for index, _ in features), dtype=np.int64, count=len(features))
+    signs = np.fromiter((sign for _, sign in features), dtype=np.float64, count=len(features))
+    counts = np.bincount(indices, weights=signs, minlength=dim)
+    # 長文で頻出するn-gramが支配しないよう、語頻度は対数で抑える
+    vector = (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+    norm = float(np.linalg.norm(vector))
+    if norm == 0.0:
+        return None
+    return vector / norm
+
+
+class VectorIndex:
+    """キー -> ベクトルの行列。削除した行は0にして空き行として再利用する
+
+    行列が足りなくなると新しい配列に作り直す（参照を取った検索側は古い配列をそのまま使える）。
+    """
+
+    def __init__(self, dim: int = SIMILARITY_DIM, filter_fields: Tuple[str, ...] = ()):
+        self.dim = dim
+        self.filter_fields = filter_fields
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._filter_codes = {name: np.zeros(0, dtype=np.int32) for name in filter_fields}
+        self._codes: Dict[str, int] = {}
+        self._slots: Dict[str, int] = {}
+        self._keys: List[Optional[str]] = []
+        self._fields: List[Optional[Dict[str, Any]]] = []
+        self._free: List[int] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._slots
+
+    def _code(self, value: Optional[str], create: bool) -> int:
+        if value is None:
+            return 0
+        code = self._codes.get(value)
+        if code is None and create:
+            code = len(self._codes) + 1
+            self._codes[value] = code
+        return code or -1
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        slot = len(self._keys)
+        self._keys.append(None)
+        self._fields.append(None)
+        if slot >= len(self._matrix):
+            capacity = max(64, len(self._matrix) * 2)
+            matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            matrix[: len(self._matrix)] = self._matrix
+            alive = np.zeros(capacity, dtype=bool)
+            alive[: len(self._alive)] = self._alive
+            self._matrix, self._alive = matrix, alive
+            for name in self.filter_fields:
+                codes = np.zeros(capacity, dtype=np.int32)
+                codes[: len(self._filter_codes[name])] = self._filter_codes[name]
+                self._filter_codes[name] = codes
+        return slot
+
+    def vector(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            slot = self._slots.get(key)
+            return None if slot is None else self._matrix[slot].copy()
+
+    def add(self, key: str, vector: np.ndarray, fields: Optional[Dict[str, Any]] = None) -> None:
+        """正規化済みベクトルを登録する（同じキーは上書き）"""
+        fields = dict(fields or {})
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._allocate()
+                self._slots[key] = slot
+            self._matrix[slot] = vector
+            self._alive[slot] = True
+            self._keys[slot] = key
+            self._fields[slot] = fields
+            for name in self.filter_fields:
+                self._filter_codes[name][slot] = self._code(fields.get(name), create=True)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            slot = self._slots.pop(key, None)
+            if slot is None:
+                return
+            self._matrix[slot] = 0.0
+            self._alive[slot] = False
+            self._keys[slot] = None
+            self._fields[slot] = None
+            self._free.append(slot)
+
+    def _mask(self, rows: int, filters: Optional[Dict[str, Optional[str]]]) -> np.ndarray:
+        mask = self._alive[:rows].copy()
+        for name, value in (filters or {}).items():
+            if value is not None:
+                mask &= self._filter_codes[name][:rows] == self._code(value, create=False)
+        return mask
+
+    def top_k_many(
+        self,
+        queries: np.ndarray,
+        k: int = 10,
+        filters: Optional[Dict[str, Optional[str]]] = None,
+        exclude: Sequence[Optional[str]] = (),
+        min_score: float = 0.0,
+    ) -> List[List[Tuple[str, float, Dict[str, Any]]]]:
+        """問い合わせベクトル（行列）ごとに (キー, 類似度, フィールド) の上位k件を返す
+
+        exclude[i] は i 番目の問い合わせから除外するキー（通常は問い合わせ元の文書自身）。
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        results: List[List[Tuple[str, float, Dict[str, Any]]]] = [[] for _ in range(len(queries))]
+        # 行数・行列・絞り込み条件・各行のキーを同じ時点でそろえて取り出す
+        with self._lock:
+            rows = len(self._keys)
+            if rows == 0 or len(queries) == 0:
+                return results
+            matrix = self._matrix
+            mask = self._mask(rows, filters)
+            keys = self._keys[:rows]
+            excluded = [self._slots.get(key) if key is not None else None for key in exclude]
+
+        candidates = np.flatnonzero(mask)
+        if len(candidates) == 0:
+            return results
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_slots = np.zeros((len(queries), 0), dtype=np.int64)
+        # 候補が多いときは行列の連続領域（コピーなしのビュー）で計算してから除外し、
+        # 絞り込みで少ないときだけ候補行を集めて計算する
+        gather = len(candidates) * 4 < rows
+        for start in range(0, len(candidates) if gather else rows, _CHUNK_ROWS):
+            if gather:
+                slots = candidates[start:start + _CHUNK_ROWS]
+                scores = queries @ matrix[slots].T
+            else:
+                slots = np.arange(start, min(start + _CHUNK_ROWS, rows))
+                scores = queries @ matrix[start:start + len(slots)].T
+                scores[:, ~mask[start:start + len(slots)]] = -np.inf
+            for position, slot in enumerate(excluded):
+                if slot is not None:
+                    scores[position, slots == slot] = -np.inf
+            # チャンクごとの上位候補と、それまでの上位候補を合わせて絞り直す
+            take = min(k, scores.shape[1])
+            top = np.argpartition(scores, -take, axis=1)[:, -take:]
+            best_scores = np.concatenate(
+                [best_scores, np.take_along_axis(scores, top, axis=1)], axis=1
+            )
+            best_slots = np.concatenate([best_slots, slots[top]], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_slots = np.take_along_axis(best_slots, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        with self._lock:
+            for row in range(len(queries)):
+                for column in order[row]:
+                    score = float(best_scores[row, column])
+                    if not score > min_score:
+                        break
+                    slot = int(best_slots[row, column])
+                    key = keys[slot]
+                    # 計算中に削除された、または別の文書に置き換わった行は返さない
+                    if key is None or self._slots.get(key) != slot:
+                        continue
+                    results[row].append((key, round(score, 4), self._fields[slot]))
+        return results
+
+    def top_k(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        filters: Optional[Dict[str, Optional[str]]] = None,
+        exclude: Optional[str] = None,
+        min_score: float = 0.0,
+    ) -> List[Tuple[str, float, Dict[str, Any]]]:
+        return self.top_k_many(query[np.newaxis, :], k, filters, [exclude], min_score)[0]
@@ -0,0 +1,59 @@
+"""同じ入力に対するAI処理の同時実行をまとめる（single-flight）
+
+(処理名, 対象ID, 入力のハッシュ) をキーに実行中のタスクを1つだけ持ち、
+完了までに同じキーで呼ばれたものはそのタスクの結果を共有する。
+完了後は記録を消すので、以降の呼び出しは改めて実行される（結果のキャッシュはしない）。
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+
+from metrics import record_cache
+
+T = TypeVar("T")
+
+FlightKey = Tuple[str, str, str]
+
+
+def input_hash(payload: Any) -> str:
+    """リクエスト内容のハッシュ（キーの順序に依存しない）"""
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[FlightKey, "asyncio.Task[Any]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def run(
+        self,
+        operation: str,
+        entity_id: str,
+        payload: Any,
+        func: Callable[[], Awaitable[T]],
+    ) -> T:
+        """func() を実行する。同じキーで実行中なら、その結果（例外も含む）を待つ"""
+        key = (operation, entity_id, input_hash(payload))
+        task = self._flights.get(key)
+        record_cache(f"single_flight_{operation}", task is not None)
+        if task is None:
+            # 呼び出し元が切断されても、相乗りしている他の呼び出しのために処理は続ける
+            task = asyncio.ensure_future(func())
+            self._flights[key] = task
+            task.add_done_callback(lambda _task: self._forget(key, _task))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: FlightKey, task: "asyncio.Task[Any]") -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # 誰も待っていない状態で失敗しても「未取得の例外」警告を出さない
+        if not task.cancelled():
+            task.exception()
+
+
+single_flight = SingleFlight()
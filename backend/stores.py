@@ -0,0 +1,180 @@
+"""インメモリーストアの基盤
+
+既存コードは各ストアを dict として読み書きしているため、dict を継承したまま
+書き込み・削除時に購読者（検索インデックスなど）へ変更を通知する。
+
+書き込みごとに全ストア共通で単調増加するバージョンを振り、patch() では期待するバージョンと
+一致する場合だけ更新する（ETag / If-Match による楽観的排他制御に使う）。
+バージョンは永続化のログにも記録し、再起動後や他のワーカープロセスでも同じ値になる（restore()）。
+
+複数のワーカープロセスでストアを共有する場合は、永続化側が set_write_lock() でプロセス間のロックを登録する。
+書き込みはそのロックの中で他プロセスの変更を取り込んでから行う。
+バッチのように複数の書き込みをまとめて反映する処理は write_group() の中で行い、永続化のログでも1件にまとめる
+（異常終了しても、再起動後に途中までの書き込みだけが戻ることがない）。
+"""
+
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+# listener(store_name, key, old_value, new_value)。削除時は new_value が None
+StoreListener = Callable[[str, str, Optional[Any], Optional[Any]], None]
+
+_MISSING = object()
+
+
+class VersionClock:
+    """レコードのバージョンの採番（全ストアで共有する）"""
+
+    def __init__(self):
+        self.value = 0
+
+    def tick(self) -> int:
+        self.value += 1
+        return self.value
+
+    def observe(self, version: int) -> None:
+        """ログから復元したバージョンまで進める"""
+        if version > self.value:
+            self.value = version
+
+
+clock = VersionClock()
+
+# 書き込み全体を他プロセスと直列化するロック（入れ子で呼ばれる）。単一プロセスでは何もしない
+_write_lock: Callable[[], ContextManager[Any]] = nullcontext
+
+
+def set_write_lock(factory: Optional[Callable[[], ContextManager[Any]]]) -> None:
+    global _write_lock
+    _write_lock = factory or nullcontext
+
+
+def write_lock() -> ContextManager[Any]:
+    """複数の読み出しと書き込みを、他プロセスの書き込みが割り込まない1つの操作にする"""
+    return _write_lock()
+
+
+# 書き込みを永続化のログで1件にまとめるコンテキスト（入れ子で呼ばれる）。永続化しない場合は何もしない
+_write_group: Callable[[], ContextManager[Any]] = nullcontext
+
+
+def set_write_group(factory: Optional[Callable[[], ContextManager[Any]]]) -> None:
+    global _write_group
+    _write_group = factory or nullcontext
+
+
+def write_group() -> ContextManager[Any]:
+    """ブロック内の書き込みを、ログの再生や他プロセスへの反映ではすべてか何もないかのどちらかにする
+
+    write_lock() と同じく他プロセスの書き込みとも直列化する。
+    """
+    return _write_group()
+
+
+class VersionConflict(Exception):
+    """patch() の期待バージョンが現在のバージョンと一致しない"""
+
+    def __init__(self, key: str, expected: int, actual: Optional[int]):
+        super().__init__(f"{key}: expected version {expected}, actual {actual}")
+        self.key = key
+        self.expected = expected
+        self.actual = actual
+
+
+class RecordStore(dict):
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+        self._listeners: List[StoreListener] = []
+        # 削除して同じキーで作り直しても古いバージョンと一致しないよう、全ストア共通の clock で数える
+        self._versions: Dict[str, int] = {}
+        # 直近の変更（削除を含む）のバージョン。購読者が変更ログ等に記録する
+        self.last_version = 0
+
+    def subscribe(self, listener: StoreListener) -> None:
+        self._listeners.append(listener)
+
+    def _notify(self, key: str, old: Optional[Any], new: Optional[Any]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(self.name, key, old, new)
+            except Exception as exc:
+                # 付随するインデックスの不具合で本体の書き込みを失敗させない
+                print(f"Store listener failed ({self.name}/{key}): {exc}")
+
+    def version(self, key: str) -> Optional[int]:
+        return self._versions.get(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        with _write_lock():
+            old = dict.get(self, key)
+            dict.__setitem__(self, key, value)
+            self._versions[key] = self.last_version = clock.tick()
+            self._notify(key, old, value)
+
+    def __delitem__(self, key: str) -> None:
+        with _write_lock():
+            old = dict.__getitem__(self, key)
+            dict.__delitem__(self, key)
+            self._versions.pop(key, None)
+            self.last_version = clock.tick()
+            self._notify(key, old, None)
+
+    def restore(self, key: str, value: Optional[Any], version: Optional[int]) -> None:
+        """ログに記録された変更をそのバージョンのまま反映する（value=None は削除）"""
+        if version is None:
+            version = clock.tick()
+        else:
+            clock.observe(version)
+        old = dict.get(self, key)
+        if value is None:
+            if old is None:
+                return
+            dict.__delitem__(self, key)
+            self._versions.pop(key, None)
+        else:
+            dict.__setitem__(self, key, value)
+            self._versions[key] = version
+        self.last_version = version
+        self._notify(key, old, value)
+
+    def patch(self, key: str, changes: Dict[str, Any], expected_version: Optional[int] = None) -> Any:
+        """現在のレコード（pydanticモデル）に changes だけを反映して保存し、更新後のレコードを返す
+
+        読み出しから書き込みまでの間に await がないため、途中で他の書き込みが割り込むことはない
+        （他のワーカープロセスとは write_lock() で直列化する）。
+        レコードがなければ KeyError、expected_version が現在と異なれば VersionConflict。
+        """
+        with _write_lock():
+            current = dict.__getitem__(self, key)
+            if expected_version is not None and self._versions.get(key) != expected_version:
+                raise VersionConflict(key, expected_version, self._versions.get(key))
+            # model_copy(update=...) は値を検証しないため、dict のまま渡された入れ子の項目もモデルに戻す
+            updated = type(current).model_validate({**dict(current), **changes})
+            self[key] = updated
+            return updated
+
+    def pop(self, key: str, default: Any = _MISSING) -> Any:
+        with _write_lock():
+            if key not in self:
+                if default is _MISSING:
+                    raise KeyError(key)
+                return default
+            value = dict.__getitem__(self, key)
+            del self[key]
+            return value
+
+    def update(self, *args, **kwargs) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        with _write_lock():
+            if key not in self:
+                self[key] = default
+            return dict.__getitem__(self, key)
+
+    def clear(self) -> None:
+        for key in list(self.keys()):
+            del self[key]
+
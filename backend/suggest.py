@@ -0,0 +1,237 @@
+"""ダッシュボードのインクリメンタルサーチ用の前方一致インデックス
+
+(キー, 候補ID) をソート済み配列に保持し、bisect で前方一致範囲を求める。
+キーは正規化した表記・語ごとの末尾部分・法人格を除いた会社名・読み（かな/ローマ字）から作るため、
+「さんぷ」「サンプ」「sanp」「taro」のいずれでも候補に当たる。
+"""
+
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from matching import normalize_company_name
+
+# 1回の問い合わせで走査するキー数の上限（ありふれた1文字でも一定時間で返す）
+MAX_SCAN = 256
+
+_WORD_SPLIT = re.compile(r"[\s・･/／,、]+")
+_KATAKANA_ONLY = re.compile(r"^[ァ-ヴー]+$")
+
+_HIRAGANA_START = ord("ぁ")
+_HIRAGANA_END = ord("ゖ")
+_KATAKANA_OFFSET = ord("ァ") - ord("ぁ")
+
+_ROMAJI = {
+    "ア": "a", "イ": "i", "ウ": "u", "エ": "e", "オ": "o",
+    "カ": "ka", "キ": "ki", "ク": "ku", "ケ": "ke", "コ": "ko",
+    "サ": "sa", "シ": "shi", "ス": "su", "セ": "se", "ソ": "so",
+    "タ": "ta", "チ": "chi", "ツ": "tsu", "テ": "te", "ト": "to",
+    "ナ": "na", "ニ": "ni", "ヌ": "nu", "ネ": "ne", "ノ": "no",
+    "ハ": "ha", "ヒ": "hi", "フ": "fu", "ヘ": "he", "ホ": "ho",
+    "マ": "ma", "ミ": "mi", "ム": "mu", "メ": "me", "モ": "mo",
+    "ヤ": "ya", "ユ": "yu", "ヨ": "yo",
+    "ラ": "ra", "リ": "ri", "ル": "ru", "レ": "re", "ロ": "ro",
+    "ワ": "wa", "ヲ": "o", "ン": "n",
+    "ガ": "ga", "ギ": "gi", "グ": "gu", "ゲ": "ge", "ゴ": "go",
+    "ザ": "za", "ジ": "ji", "ズ": "zu", "ゼ": "ze", "ゾ": "zo",
+    "ダ": "da", "ヂ": "ji", "ヅ": "zu", "デ": "de", "ド": "do",
+    "バ": "ba", "ビ": "bi", "ブ": "bu", "ベ": "be", "ボ": "bo",
+    "パ": "pa", "ピ": "pi", "プ": "pu", "ペ": "pe", "ポ": "po",
+    "ヴ": "vu",
+    "ァ": "a", "ィ": "i", "ゥ": "u", "ェ": "e", "ォ": "o",
+    "ャ": "ya", "ュ": "yu", "ョ": "yo", "ヮ": "wa",
+}
+# 拗音・外来音（2文字で1音）
+_ROMAJI_DIGRAPHS = {
+    "キャ": "kya", "キュ": "kyu", "キョ": "kyo", "シャ": "sha", "シュ": "shu", "ショ": "sho",
+    "チャ": "cha", "チュ": "chu", "チョ": "cho", "ニャ": "nya", "ニュ": "nyu", "ニョ": "nyo",
+    "ヒャ": "hya", "ヒュ": "hyu", "ヒョ": "hyo", "ミャ": "mya", "ミュ": "myu", "ミョ": "myo",
+    "リャ": "rya", "リュ": "ryu", "リョ": "ryo", "ギャ": "gya", "ギュ": "gyu", "ギョ": "gyo",
+    "ジャ": "ja", "ジュ": "ju", "ジョ": "jo", "ビャ": "bya", "ビュ": "byu", "ビョ": "byo",
+    "ピャ": "pya", "ピュ": "pyu", "ピョ": "pyo", "ティ": "ti", "ディ": "di", "トゥ": "tu",
+    "ファ": "fa", "フィ": "fi", "フェ": "fe", "フォ": "fo", "ウィ": "wi", "ウェ": "we",
+    "シェ": "she", "ジェ": "je", "チェ": "che", "ヴァ": "va", "ヴィ": "vi", "ヴェ": "ve",
+    "ヴォ": "vo", "デュ": "dyu",
+}
+
+
+def _hiragana_to_katakana(text: str) -> str:
+    return "".join(
+        chr(ord(char) + _KATAKANA_OFFSET) if _HIRAGANA_START <= ord(char) <= _HIRAGANA_END else char
+        for char in text
+    )
+
+
+def normalize_prefix(text: Optional[str]) -> str:
+    """前方一致の比較用に正規化する（NFKC・小文字化・ひらがな→カタカナ・空白除去）"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return _WORD_SPLIT.sub("", _hiragana_to_katakana(text))
+
+
+def katakana_to_romaji(text: str) -> str:
+    """カタカナをヘボン式ローマ字にする（長音記号は表記しない）"""
+    result: List[str] = []
+    index = 0
+    double_next = False
+    while index < len(text):
+        pair = text[index:index + 2]
+        if pair in _ROMAJI_DIGRAPHS:
+            romaji, index = _ROMAJI_DIGRAPHS[pair], index + 2
+        else:
+            char = text[index]
+            index += 1
+            if char == "ッ":
+                double_next = True
+                continue
+            romaji = _ROMAJI.get(char, "" if char == "ー" else char)
+        if double_next and romaji:
+            romaji = ("t" if romaji.startswith("ch") else romaji[0]) + romaji
+            double_next = False
+        result.append(romaji)
+    return "".join(result)
+
+
+def prefix_keys(text: str, readings: Iterable[str] = ()) -> Set[str]:
+    """候補に当たるべき正規化キーの集合（全体・各語からの末尾部分・法人格除去・読み）"""
+    keys: Set[str] = set()
+    for source in [text, *readings]:
+        if not source:
+            continue
+        words = [
+            word for word in _WORD_SPLIT.split(_hiragana_to_katakana(unicodedata.normalize("NFKC", source).lower()))
+            if word
+        ]
+        for start in range(len(words)):
+            keys.add("".join(words[start:]))
+        stripped = normalize_prefix(normalize_company_name(source))
+        if stripped:
+            keys.add(stripped)
+    for key in list(keys):
+        if _KATAKANA_ONLY.match(key):
+            keys.add(katakana_to_romaji(key))
+    keys.discard("")
+    return keys
+
+
+@dataclass
+class Suggestion:
+    entry_id: str
+    text: str
+    kind: str
+    payload: Dict[str, Any] = field(default_factory=dict)
+
+
+class _PrefixArray:
+    def __init__(self):
+        self._keys: List[Tuple[str, str]] = []
+
+    def insert(self, key: str, entry_id: str) -> None:
+        insort(self._keys, (key, entry_id))
+
+    def delete(self, key: str, entry_id: str) -> None:
+        position = bisect_left(self._keys, (key, entry_id))
+        if position < len(self._keys) and self._keys[position] == (key, entry_id):
+            del self._keys[position]
+
+    def scan(self, prefix: str) -> Iterable[Tuple[str, str]]:
+        position = bisect_left(self._keys, (prefix,))
+        for key, entry_id in self._keys[position:position + MAX_SCAN]:
+            if not key.startswith(prefix):
+                break
+            yield key, entry_id
+
+
+class SuggestIndex:
+    """候補ID単位で登録するソート済み配列の前方一致インデックス
+
+    scope（イベントIDなど）を指定した候補は全体とscope別の両方に登録し、
+    scope付きの問い合わせは他イベントの候補を走査しない。
+    同じ候補IDを複数回 add した場合は参照数を数え、同じ回数 remove されるまで残す
+    （複数の企業に付いた同じタグなど）。
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Suggestion] = {}
+        self._entry_keys: Dict[str, Tuple[Set[str], Optional[str]]] = {}
+        self._refs: Dict[str, int] = {}
+        self._global = _PrefixArray()
+        self._scoped: Dict[str, _PrefixArray] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(
+        self,
+        entry_id: str,
+        text: str,
+        kind: str,
+        payload: Optional[Dict[str, Any]] = None,
+        readings: Iterable[str] = (),
+        scope: Optional[str] = None,
+    ) -> None:
+        if entry_id in self._entries:
+            self._refs[entry_id] += 1
+            return
+        keys = prefix_keys(text, readings)
+        self._entries[entry_id] = Suggestion(entry_id, text, kind, dict(payload or {}))
+        self._entry_keys[entry_id] = (keys, scope)
+        self._refs[entry_id] = 1
+        targets = [self._global]
+        if scope is not None:
+            targets.append(self._scoped.setdefault(scope, _PrefixArray()))
+        for key in keys:
+            for target in targets:
+                target.insert(key, entry_id)
+
+    def remove(self, entry_id: str) -> None:
+        if entry_id not in self._entries:
+            return
+        self._refs[entry_id] -= 1
+        if self._refs[entry_id] > 0:
+            return
+        del self._refs[entry_id]
+        del self._entries[entry_id]
+        keys, scope = self._entry_keys.pop(entry_id)
+        targets = [self._global]
+        if scope is not None and scope in self._scoped:
+            targets.append(self._scoped[scope])
+        for key in keys:
+            for target in targets:
+                target.delete(key, entry_id)
+
+    def suggest(
+        self,
+        prefix: str,
+        limit: int = 8,
+        kinds: Optional[Iterable[str]] = None,
+        scope: Optional[str] = None,
+    ) -> List[Suggestion]:
+        """前方一致する候補を、一致したキーが短い（入力に近い）順に返す"""
+        normalized = normalize_prefix(prefix)
+        if not normalized:
+            return []
+        target = self._global if scope is None else self._scoped.get(scope)
+        if target is None:
+            return []
+        allowed = set(kinds) if kinds else None
+        best: Dict[str, int] = {}
+        for key, entry_id in target.scan(normalized):
+            if allowed is not None and self._entries[entry_id].kind not in allowed:
+                continue
+            if entry_id not in best or len(key) < best[entry_id]:
+                best[entry_id] = len(key)
+        ranked = sorted(best.items(), key=lambda pair: (pair[1], self._entries[pair[0]].text))
+        results: List[Suggestion] = []
+        seen: Set[Tuple[str, str]] = set()
+        for entry_id, _ in ranked:
+            entry = self._entries[entry_id]
+            # 別イベントに付いた同じタグなどは1件にまとめる
+            if not entry.payload.get("source_id") and (entry.kind, entry.text) in seen:
+                continue
+            seen.add((entry.kind, entry.text))
+            results.append(entry)
+            if len(results) >= limit:
+                break
+        return results
@@ -0,0 +1,209 @@
+"""main.py のAPIのテスト（インメモリーのストアに対して TestClient で実行する）
+
+使い方:
+    python -m pytest test_api.py
+"""
+
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from admission import Overloaded
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def _create_event(client: TestClient, name: str = "展示会") -> dict:
+    response = client.post("/events", json={"name": name, "start_date": "2026-01-01", "end_date": "2026-01-02"})
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+@pytest.mark.parametrize(
+    "path, id_field, create, body",
+    [
+        ("/events", "event_id", None, {"name": None}),
+        ("/target-companies", "target_company_id", ("/target-companies", {"name": "株式会社A"}), {"name": None}),
+        ("/visit-notes", "visit_note_id", ("/events/{event_id}/notes", {"content": "メモ"}), {"content": None}),
+        ("/tasks", "task_id", ("/events/{event_id}/tasks", {"title": "資料送付"}), {"status": None}),
+    ],
+)
+def test_put_null_for_required_field_returns_422(client, path, id_field, create, body):
+    event = _create_event(client)
+    if create is None:
+        record_id = event["event_id"]
+    else:
+        create_path, data = create
+        response = client.post(
+            create_path.format(event_id=event["event_id"]), json={"event_id": event["event_id"], **data}
+        )
+        assert response.status_code == 201, response.text
+        record_id = response.json()[id_field]
+
+    response = client.put(f"{path}/{record_id}", json=body)
+    assert response.status_code == 422, response.text
+    field_name = next(iter(body))
+    assert any(error["loc"][-1] == field_name for error in response.json()["detail"])
+    # 不正な値は保存されていない
+    assert client.get(f"{path}/{record_id}").json()[field_name] is not None
+
+
+@pytest.fixture
+def overloaded_ai(monkeypatch):
+    """AI呼び出しの待ち行列が一杯の状態にする"""
+
+    async def acquire(priority):
+        raise Overloaded("queue_full", 7)
+
+    monkeypatch.setattr(main, "GEMINI_API_KEY", main.GEMINI_API_KEY or "test-key")
+    monkeypatch.setattr(main, "gemini_client", main.gemini_client or object())
+    monkeypatch.setattr(main.ai_gate, "_acquire", acquire)
+
+
+def test_pre_research_returns_503_when_ai_is_overloaded(client, overloaded_ai):
+    event = _create_event(client)
+    target = client.post("/target-companies", json={"event_id": event["event_id"], "name": "株式会社A"}).json()
+
+    response = client.post(f"/target-companies/{target['target_company_id']}/pre-research", json={})
+    assert response.status_code == 503, response.text
+    assert response.headers["retry-after"] == "7"
+    assert main.target_companies_store[target["target_company_id"]].pre_research_status is None
+
+    response = client.post(f"/events/{event['event_id']}/target-companies/pre-research", json={})
+    assert response.status_code == 503, response.text
+    assert main.target_companies_store[target["target_company_id"]].pre_research_status is None
+
+
+def test_event_report_returns_503_when_ai_is_overloaded(client, overloaded_ai):
+    event = _create_event(client)
+    reports_before = len(main.event_reports_store)
+
+    response = client.post(f"/events/{event['event_id']}/generate-report", json={})
+    assert response.status_code == 503, response.text
+    assert response.headers["retry-after"] == "7"
+    assert len(main.event_reports_store) == reports_before
+
+
+@pytest.mark.parametrize("weak", [False, True])
+def test_if_match_accepts_current_etag(client, weak):
+    event = _create_event(client)
+    etag = client.get(f"/events/{event['event_id']}").headers["etag"]
+
+    response = client.put(
+        f"/events/{event['event_id']}", json={"name": "改名"}, headers={"If-Match": f"W/{etag}" if weak else etag}
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["name"] == "改名"
+    assert response.headers["etag"] != etag
+
+
+def test_if_match_rejects_stale_etag(client):
+    event = _create_event(client)
+    etag = client.get(f"/events/{event['event_id']}").headers["etag"]
+    assert client.put(f"/events/{event['event_id']}", json={"name": "先の更新"}).status_code == 200
+
+    response = client.put(f"/events/{event['event_id']}", json={"name": "後の更新"}, headers={"If-Match": etag})
+    assert response.status_code == 412, response.text
+    assert main.events_store[event["event_id"]].name == "先の更新"
+
+
+def test_batch_resolves_temp_ids(client):
+    event = _create_event(client)
+    response = client.post(
+        "/batch",
+        json={
+            "operations": [
+                {
+                    "op": "create",
+                    "entity": "target_companies",
+                    "temp_id": "tmp-target",
+                    "data": {"event_id": event["event_id"], "name": "株式会社A"},
+                },
+                {
+                    "op": "create",
+                    "entity": "visit_notes",
+                    "temp_id": "tmp-note",
+                    "data": {"event_id": event["event_id"], "target_company_id": "tmp-target", "content": "商談"},
+                },
+                {
+                    "op": "create",
+                    "entity": "tasks",
+                    "data": {
+                        "event_id": event["event_id"],
+                        "title": "お礼メール",
+                        "target_company_id": "tmp-target",
+                        "visit_note_id": "tmp-note",
+                    },
+                },
+                {"op": "update", "entity": "visit_notes", "id": "tmp-note", "data": {"highlight": True}},
+            ]
+        },
+    )
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["committed"] is True
+    target_id, note_id = body["id_map"]["tmp-target"], body["id_map"]["tmp-note"]
+    assert [result["status"] for result in body["results"]] == [201, 201, 201, 200]
+    assert main.visit_notes_store[note_id].target_company_id == target_id
+    assert main.visit_notes_store[note_id].highlight is True
+    task = main.tasks_store[body["results"][2]["id"]]
+    assert (task.target_company_id, task.visit_note_id) == (target_id, note_id)
+
+
+def test_atomic_batch_applies_nothing_when_an_operation_fails(client):
+    event = _create_event(client)
+    note = client.post(
+        f"/events/{event['event_id']}/notes", json={"event_id": event["event_id"], "content": "元のメモ"}
+    ).json()
+    counts = (len(main.target_companies_store), len(main.visit_notes_store))
+
+    response = client.post(
+        "/batch",
+        json={
+            "operations": [
+                {
+                    "op": "create",
+                    "entity": "target_companies",
+                    "data": {"event_id": event["event_id"], "name": "株式会社B"},
+                },
+                {"op": "update", "entity": "visit_notes", "id": note["visit_note_id"], "data": {"content": "変更"}},
+                {"op": "update", "entity": "tasks", "id": "no-such-task", "data": {"title": "x"}},
+            ]
+        },
+    )
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["committed"] is False
+    assert [result["status"] for result in body["results"]] == [424, 424, 404]
+    assert (len(main.target_companies_store), len(main.visit_notes_store)) == counts
+    assert main.visit_notes_store[note["visit_note_id"]].content == "元のメモ"
+
+
+def test_idempotent_replay(client):
+    key = f"test-{uuid4()}"
+    body = {"name": "再送テスト", "start_date": "2026-01-01", "end_date": "2026-01-02"}
+    count = len(main.events_store)
+
+    first = client.post("/events", json=body, headers={"Idempotency-Key": key})
+    second = client.post("/events", json=body, headers={"Idempotency-Key": key})
+    assert first.status_code == second.status_code == 201
+    assert "idempotent-replayed" not in first.headers
+    assert second.headers["idempotent-replayed"] == "true"
+    assert second.json()["event_id"] == first.json()["event_id"]
+    assert len(main.events_store) == count + 1
+
+
+def test_idempotency_key_reused_with_different_body(client):
+    key = f"test-{uuid4()}"
+    body = {"name": "元の本文", "start_date": "2026-01-01", "end_date": "2026-01-02"}
+    assert client.post("/events", json=body, headers={"Idempotency-Key": key}).status_code == 201
+    count = len(main.events_store)
+
+    response = client.post("/events", json={**body, "name": "別の本文"}, headers={"Idempotency-Key": key})
+    assert response.status_code == 422, response.text
+    assert len(main.events_store) == count
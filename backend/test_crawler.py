@@ -0,0 +1,176 @@
+"""crawler.py のテスト（ローカルに立てた代役のHTTPサーバーに対して実行する）
+
+使い方:
+    python -m pytest test_crawler.py
+"""
+
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+import pytest
+
+from crawler import Crawler
+
+PAGES = {
+    "/list?page=1": '<ul><li class="exhibitor">株式会社A</li><li class="exhibitor">株式会社B</li></ul>'
+    '<a rel="next" href="/list?page=2">次へ</a>',
+    "/list?page=2": '<ul><li class="exhibitor">株式会社C</li></ul><a rel="next" href="/list?page=3">次へ</a>',
+    "/list?page=3": '<ul><li class="exhibitor">株式会社D</li></ul>',
+    "/private/list": '<ul><li class="exhibitor">非公開</li></ul>',
+}
+ROBOTS = "User-agent: *\nDisallow: /private/\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # (パス, ステータス) を記録する
+    requests: List[Tuple[str, int]] = []
+
+    def _send(self, status: int, body: bytes = b"", headers: Tuple[Tuple[str, str], ...] = ()) -> None:
+        self.requests.append((self.path, status))
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        port = self.server.server_address[1]
+        if self.path == "/robots.txt":
+            self._send(200, ROBOTS.encode("utf-8"), (("Content-Type", "text/plain"),))
+        elif self.path in PAGES:
+            etag = f'"{abs(hash(PAGES[self.path]))}"'
+            if self.headers.get("If-None-Match") == etag:
+                self._send(304, headers=(("ETag", etag),))
+            else:
+                self._send(
+                    200,
+                    PAGES[self.path].encode("utf-8"),
+                    (("Content-Type", "text/html; charset=utf-8"), ("ETag", etag)),
+                )
+        elif self.path == "/redirect-metadata":
+            self._send(302, headers=(("Location", "http://169.254.169.254/latest/meta-data/"),))
+        elif self.path == "/redirect-loopback":
+            # 許可したネットワーク（127.0.0.1/32）の外にある別のループバックアドレスへ飛ばす
+            self._send(302, headers=(("Location", f"http://127.0.0.2:{port}/list?page=1"),))
+        elif self.path == "/redirect-list":
+            self._send(301, headers=(("Location", "/list?page=3"),))
+        elif self.path == "/large":
+            self._send(200, b"x" * 200_000, (("Content-Type", "text/html"),))
+        elif self.path == "/large-stream":
+            # Content-Length なしで送り、読み込み中に上限で打ち切れることを確かめる
+            self.requests.append((self.path, 200))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            try:
+                for _ in range(100):
+                    self.wfile.write(b"x" * 10_000)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        else:
+            self._send(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _Handler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def _run(crawler: Crawler, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await crawler.aclose()
+
+    return asyncio.run(main())
+
+
+def _local_crawler(**kwargs) -> Crawler:
+    return Crawler(allowed_networks=["127.0.0.1/32"], **kwargs)
+
+
+def test_follows_pagination(server):
+    crawler = _local_crawler()
+    result = _run(crawler, crawler.crawl(f"{server}/list?page=1", ["li.exhibitor"], limit=10))
+    assert [item["text"] for item in result.items] == ["株式会社A", "株式会社B", "株式会社C", "株式会社D"]
+    assert [page["result"] for page in result.pages] == ["ok", "ok", "ok"]
+    assert result.items[2]["page_url"] == f"{server}/list?page=2"
+
+
+def test_stops_at_limit(server):
+    crawler = _local_crawler()
+    result = _run(crawler, crawler.crawl(f"{server}/list?page=1", ["li.exhibitor"], limit=2))
+    assert len(result.items) == 2
+    assert len(result.pages) == 1
+
+
+def test_robots_txt_denies(server):
+    crawler = _local_crawler()
+    result = _run(crawler, crawler.crawl(f"{server}/private/list", ["li.exhibitor"], limit=10))
+    assert result.items == []
+    assert result.pages == [{"url": f"{server}/private/list", "result": "robots_denied"}]
+    assert ("/private/list", 200) not in _Handler.requests
+
+
+def test_conditional_get_on_recrawl(server):
+    crawler = _local_crawler()
+
+    async def crawl_twice():
+        first = await crawler.crawl(f"{server}/list?page=1", ["li.exhibitor"], limit=10)
+        second = await crawler.crawl(f"{server}/list?page=1", ["li.exhibitor"], limit=10)
+        return first, second
+
+    first, second = _run(crawler, crawl_twice())
+    assert [page["result"] for page in second.pages] == ["not_modified"] * 3
+    assert [item["text"] for item in second.items] == [item["text"] for item in first.items]
+    assert [status for path, status in _Handler.requests if path.startswith("/list")] == [200] * 3 + [304] * 3
+
+
+def test_follows_public_redirect(server):
+    crawler = _local_crawler()
+    status, body = _run(crawler, crawler.fetch(f"{server}/redirect-list"))
+    assert status == "ok"
+    assert "株式会社D" in body
+
+
+def test_blocks_loopback_by_default(server):
+    crawler = Crawler()
+    status, body = _run(crawler, crawler.fetch(f"{server}/list?page=1"))
+    assert (status, body) == ("blocked", None)
+    assert _Handler.requests == []
+
+
+def test_blocks_metadata_address_directly():
+    crawler = Crawler()
+    status, _body = _run(crawler, crawler.fetch("http://169.254.169.254/latest/meta-data/"))
+    assert status == "blocked"
+
+
+@pytest.mark.parametrize("path", ["/redirect-metadata", "/redirect-loopback"])
+def test_blocks_redirect_to_internal_address(server, path):
+    crawler = _local_crawler()
+    status, body = _run(crawler, crawler.fetch(f"{server}{path}"))
+    assert (status, body) == ("blocked", None)
+    assert [requested for requested, _status in _Handler.requests if requested.startswith("/list")] == []
+
+
+@pytest.mark.parametrize("path", ["/large", "/large-stream"])
+def test_aborts_oversized_page(server, path):
+    crawler = _local_crawler(max_page_bytes=50_000)
+    status, body = _run(crawler, crawler.fetch(f"{server}{path}"))
+    assert (status, body) == ("error", None)
@@ -0,0 +1,63 @@
+"""persistence.py のテスト（一時ディレクトリに書き出したログを別のストアへ読み込み直して確かめる）
+
+使い方:
+    python -m pytest test_persistence.py
+"""
+
+import asyncio
+import os
+from typing import Tuple
+
+import pytest
+from pydantic import BaseModel
+
+from persistence import StorePersistence, _segment_name
+from stores import RecordStore, write_group
+
+
+class Item(BaseModel):
+    name: str
+
+
+def _open(directory: str) -> Tuple[RecordStore, StorePersistence]:
+    store = RecordStore("items")
+    persistence = StorePersistence(str(directory), {"items": (store, Item)}, fsync="never")
+    persistence.load()
+    return store, persistence
+
+
+def _close(persistence: StorePersistence) -> None:
+    asyncio.run(persistence.close(snapshot=False))
+
+
+def test_group_is_replayed_as_a_whole(tmp_path):
+    store, persistence = _open(tmp_path)
+    store["single"] = Item(name="単独")
+    with write_group():
+        for index in range(3):
+            store[f"batch-{index}"] = Item(name=f"まとめて{index}")
+        del store["single"]
+    _close(persistence)
+
+    restored, persistence = _open(tmp_path)
+    assert sorted(restored) == ["batch-0", "batch-1", "batch-2"]
+    _close(persistence)
+
+
+@pytest.mark.parametrize("cut", [1, 20])
+def test_truncated_group_is_not_replayed_partially(tmp_path, cut):
+    store, persistence = _open(tmp_path)
+    store["before"] = Item(name="前")
+    with write_group():
+        for index in range(3):
+            store[f"batch-{index}"] = Item(name=f"まとめて{index}")
+    segment = persistence._segment
+    _close(persistence)
+
+    # 書き込みの途中で落ちた状態を作る
+    path = os.path.join(tmp_path, _segment_name(segment))
+    os.truncate(path, os.path.getsize(path) - cut)
+
+    restored, persistence = _open(tmp_path)
+    assert sorted(restored) == ["before"]
+    _close(persistence)